@@ -11,7 +11,7 @@ from __future__ import absolute_import, print_function
 
 from flask_admin.contrib.sqla import ModelView
 
-from .models import Event, Identifier, Relationship
+from .models import Event, EventHash, Identifier, Relationship
 
 
 class IdentifierModelView(ModelView):
@@ -75,6 +75,26 @@ class EventModelView(ModelView):
     column_searchable_list = ('payload',)
 
 
+class EventHashModelView(ModelView):
+    """ModelView for the EventHash."""
+
+    can_create = False
+    can_edit = False
+    can_delete = True
+    can_view_details = True
+
+    column_list = (
+        'hash',
+        'event_id',
+        'accepted',
+        'duplicates',
+        'last_duplicate',
+    )
+    column_default_sort = ('duplicates', True)
+
+    column_searchable_list = ('hash',)
+
+
 identifier_adminview = dict(
     model=Identifier,
     modelview=IdentifierModelView,
@@ -91,3 +111,9 @@ event_adminview = dict(
     model=Event,
     modelview=EventModelView,
 )
+
+
+event_hash_adminview = dict(
+    model=EventHash,
+    modelview=EventHashModelView,
+)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Consistency checks of the relationships index against the database."""
+
+import hashlib
+import json
+import os
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterator, List
+
+import sqlalchemy as sa
+from elasticsearch.helpers import scan
+from flask import current_app
+from invenio_db import db
+from invenio_search import current_search_client
+
+from ..indexer import DocumentsContext, build_documents, bulk_delete, \
+    index_documents, lean_document
+from ..models import Group, GroupM2M, GroupRelationship, GroupType
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False)
+
+
+def document_checksum(doc: dict) -> str:
+    """Compute the checksum of the content of a relationship doc.
+
+    The identifiers of the source and target are compared regardless of
+    their order.
+    """
+    doc = dict(doc)
+    for key in ('Source', 'Target'):
+        group = doc.get(key)
+        if isinstance(group, dict) and 'Identifier' in group:
+            doc[key] = dict(group, Identifier=sorted(
+                group['Identifier'], key=_dumps))
+    return hashlib.sha1(_dumps(doc).encode('utf-8')).hexdigest()
+
+
+def group_checksum(checksums: dict) -> str:
+    """Compute the checksum of the docs of a group, keyed by doc ID."""
+    content = ','.join('{}:{}'.format(k, checksums[k])
+                       for k in sorted(checksums))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def iter_version_group_ids(chunk_size: int,
+                           after: uuid.UUID=None) -> Iterator[List]:
+    """Iterate over the Version group IDs in chunks, ordered by ID."""
+    while True:
+        query = (db.session.query(Group.id)
+                 .filter(Group.type == GroupType.Version)
+                 .order_by(Group.id))
+        if after is not None:
+            query = query.filter(Group.id > after)
+        chunk = [i for i, in query.limit(chunk_size)]
+        if not chunk:
+            break
+        yield chunk
+        after = chunk[-1]
+
+
+def expected_documents(version_group_ids: List,
+                       ctx: DocumentsContext=None) -> dict:
+    """Build the docs of the relationships of Version groups.
+
+    Every doc has a Version group as its source, so that the docs are
+    returned grouped by the ``Source.ID`` they are expected to have.
+    """
+    gr = GroupRelationship
+    identity_ids = [i for i, in db.session.query(GroupM2M.subgroup_id)
+                    .filter(GroupM2M.group_id.in_(version_group_ids))]
+    condition = sa.and_(gr.type == GroupType.Version,
+                        gr.source_id.in_(version_group_ids))
+    if identity_ids:
+        condition = sa.or_(condition, sa.and_(
+            gr.type == GroupType.Identity, gr.source_id.in_(identity_ids)))
+    ids = [i for i, in db.session.query(gr.id).filter(condition)]
+    docs = defaultdict(dict)
+    for doc in build_documents(ids, ctx=ctx) if ids else []:
+        docs[doc['Source']['ID']][doc['ID']] = doc
+    return docs
+
+
+def indexed_checksums(version_group_ids: List,
+                      index: str='relationships') -> dict:
+    """Get the checksums of the indexed docs of Version groups."""
+    query = {'query': {'terms': {
+        'Source.ID': [str(i) for i in version_group_ids]}}}
+    checksums = defaultdict(dict)
+    for hit in scan(current_search_client, query=query, index=index):
+        doc = hit['_source']
+        checksums[doc['Source']['ID']][hit['_id']] = document_checksum(doc)
+    return checksums
+
+
+def check_groups(version_group_ids: List, repair: bool=True,
+                 index: str='relationships') -> Counter:
+    """Compare the indexed docs of Version groups with the database.
+
+    The docs of each group are compared by count and checksum, and only the
+    docs of the groups that do not match are indexed or deleted.
+    """
+    split = current_app.config['ASCLEPIAS_INDEXER_SPLIT_GROUPS']
+    expected = expected_documents(version_group_ids)
+    indexed = indexed_checksums(version_group_ids, index=index)
+    stats = Counter(groups=len(version_group_ids))
+    to_index, to_delete = [], set()
+    for group_id in map(str, version_group_ids):
+        docs = expected.get(group_id, {})
+        checksums = {
+            k: document_checksum(lean_document(d) if split else d)
+            for k, d in docs.items()}
+        found = indexed.get(group_id, {})
+        if len(checksums) == len(found) and \
+                group_checksum(checksums) == group_checksum(found):
+            continue
+        stats['mismatched_groups'] += 1
+        to_index += [d for k, d in docs.items()
+                     if found.get(k) != checksums[k]]
+        to_delete |= set(found) - set(checksums)
+    if to_delete:
+        # Docs found under the wrong source may belong to existing
+        # relationships, which are indexed again instead
+        moved = build_documents(to_delete)
+        to_index += moved
+        to_delete -= {d['ID'] for d in moved}
+    stats['indexed'] = len(to_index)
+    stats['deleted'] = len(to_delete)
+    if repair:
+        stats['errors'] += len(index_documents(to_index, index=index))
+        stats['errors'] += len(bulk_delete(
+            current_search_client, to_delete, index=index,
+            chunk_size=current_app.config[
+                'ASCLEPIAS_INDEXER_BULK_CHUNK_SIZE']))
+    return stats
+
+
+def delete_orphan_documents(chunk_size: int, repair: bool=True,
+                            index: str='relationships') -> Counter:
+    """Delete the indexed docs of relationships that no longer exist."""
+    stats = Counter()
+    hits = scan(current_search_client, index=index, size=chunk_size,
+                query={'query': {'match_all': {}}, '_source': False})
+    ids = (hit['_id'] for hit in hits)
+    while True:
+        chunk = set(islice(ids, chunk_size))
+        if not chunk:
+            break
+        existing = {str(i) for i, in db.session.query(GroupRelationship.id)
+                    .filter(GroupRelationship.id.in_(chunk))}
+        orphans = chunk - existing
+        stats['orphans'] += len(orphans)
+        if repair and orphans:
+            stats['errors'] += len(bulk_delete(
+                current_search_client, orphans, index=index,
+                chunk_size=chunk_size))
+    return stats
+
+
+def _read_checkpoint(path: str) -> uuid.UUID:
+    if path and os.path.exists(path):
+        with open(path) as fp:
+            return uuid.UUID(json.load(fp)['last_group_id'])
+
+
+def _write_checkpoint(path: str, last_group_id):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fp:
+        json.dump({'last_group_id': str(last_group_id)}, fp)
+    os.replace(tmp_path, path)
+
+
+def _check_groups_job(app, version_group_ids: List, repair: bool,
+                      index: str) -> Counter:
+    with app.app_context():
+        try:
+            return check_groups(version_group_ids, repair=repair, index=index)
+        finally:
+            db.session.remove()
+
+
+def check_index(chunk_size: int=1000, workers: int=1,
+                checkpoint: str=None, repair: bool=True,
+                index: str='relationships',
+                progress: Callable=None) -> Counter:
+    """Check the relationships index against the database.
+
+    Version groups are checked in chunks of ``chunk_size`` groups, by up to
+    ``workers`` threads at a time. After each round of chunks, the last
+    checked group is saved to the ``checkpoint`` file, from which a
+    subsequent check resumes. Once all groups are checked, the docs of
+    relationships that no longer exist are deleted and the checkpoint is
+    removed. ``progress`` is called with the stats after each round.
+    """
+    app = current_app._get_current_object()
+    after = _read_checkpoint(checkpoint)
+    stats = Counter()
+    chunks = iter_version_group_ids(chunk_size, after=after)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            wave = [chunk for _, chunk in zip(range(workers), chunks)]
+            if not wave:
+                break
+            if workers > 1:
+                results = list(executor.map(
+                    lambda ids: _check_groups_job(app, ids, repair, index),
+                    wave))
+            else:
+                results = [check_groups(ids, repair=repair, index=index)
+                           for ids in wave]
+            for result in results:
+                stats.update(result)
+            if checkpoint:
+                _write_checkpoint(checkpoint, wave[-1][-1])
+            if progress:
+                progress(stats)
+
+    stats.update(delete_orphan_documents(
+        chunk_size, repair=repair, index=index))
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return stats
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Events deduplication functions."""
+
+import hashlib
+import json
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Set, Tuple
+
+import sqlalchemy as sa
+from flask import current_app
+from invenio_db import db
+
+from ..models import EventHash
+from ..utils import insert_ignore
+
+
+def event_content_hash(event: dict) -> str:
+    """Compute the canonical content hash of an event.
+
+    Only the event type and the payload are hashed, so that the same content
+    sent again with a different ID, time or creator is detected.
+    """
+    content = json.dumps([event['EventType'], event['Payload']],
+                         sort_keys=True, separators=(',', ':'),
+                         ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+#: Event types undoing each other. Accepting an event releases the content
+#: claimed by its counterpart, so that e.g. a relationship that is created,
+#: deleted and created again is not a duplicate the second time.
+COUNTERPART_EVENT_TYPES = {
+    'RelationshipCreated': 'RelationshipDeleted',
+    'RelationshipDeleted': 'RelationshipCreated',
+}
+
+
+def counterpart_content_hash(event: dict) -> str:
+    """Compute the content hash of the event undoing an event."""
+    return event_content_hash(dict(
+        event, EventType=COUNTERPART_EVENT_TYPES[event['EventType']]))
+
+
+def release_event_hashes(hashes: Iterable[str]):
+    """Release claimed content hashes, so that they are accepted again."""
+    hashes = set(hashes)
+    if hashes:
+        (EventHash.query.filter(EventHash.hash.in_(hashes))
+         .delete(synchronize_session=False))
+
+
+def claim_event_hashes(claims: Iterable[Tuple[str, uuid.UUID]],
+                       keep_owner: bool=False) -> Set[uuid.UUID]:
+    """Claim the content hashes of events and return the duplicate events.
+
+    ``claims`` are ``(content_hash, event_id)`` pairs. An event is a duplicate
+    if its content was already claimed by an event (or by a previous pair)
+    within ``ASCLEPIAS_EVENTS_DEDUP_WINDOW``. With ``keep_owner``, an event is
+    not a duplicate of itself. Hashes claimed outside of the window are
+    claimed again. The duplicates counters are updated accordingly.
+    """
+    window = current_app.config['ASCLEPIAS_EVENTS_DEDUP_WINDOW']
+    now = datetime.utcnow()
+    window_start = now - window if window is not None else None
+
+    claimed = {}
+    duplicates = set()
+    counts = Counter()
+    for content_hash, event_id in claims:
+        if content_hash in claimed:
+            duplicates.add(event_id)
+            counts[content_hash] += 1
+        else:
+            claimed[content_hash] = event_id
+    if not claimed:
+        return duplicates
+
+    def _locked_rows(hashes):
+        return (EventHash.query.filter(EventHash.hash.in_(hashes))
+                .with_for_update().populate_existing())
+
+    existing = {row.hash: row for row in _locked_rows(list(claimed))}
+    missing = [h for h in claimed if h not in existing]
+    if missing:
+        db.session.execute(insert_ignore(EventHash.__table__), [
+            dict(hash=h, event_id=claimed[h], accepted=now, duplicates=0)
+            for h in missing])
+        # Hashes that were claimed concurrently by other events
+        for row in _locked_rows(missing):
+            if row.event_id != claimed[row.hash]:
+                duplicates.add(claimed[row.hash])
+                counts[row.hash] += 1
+    for content_hash, row in existing.items():
+        event_id = claimed[content_hash]
+        if keep_owner and row.event_id == event_id:
+            continue
+        if window_start is not None and row.accepted < window_start:
+            row.event_id = event_id
+            row.accepted = now
+        else:
+            duplicates.add(event_id)
+            counts[content_hash] += 1
+
+    if counts:
+        table = EventHash.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.hash == sa.bindparam('b_hash'))
+            .values(duplicates=table.c.duplicates + sa.bindparam('b_count'),
+                    last_duplicate=now),
+            [{'b_hash': h, 'b_count': c} for h, c in counts.items()])
+    return duplicates
+
+
+def get_deduplication_stats() -> dict:
+    """Get the number of distinct accepted contents and of duplicates."""
+    hashes, duplicates = db.session.query(
+        sa.func.count(EventHash.hash),
+        sa.func.coalesce(sa.func.sum(EventHash.duplicates), 0)).one()
+    return {'hashes': hashes, 'duplicates': int(duplicates)}
@@ -6,27 +6,36 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 """Events API."""
 
+import json
+from datetime import datetime
 
-import jsonschema
+from flask import current_app
 from invenio_db import db
+from jsonschema.exceptions import ValidationError as JSONValidationError
 from marshmallow.exceptions import \
     ValidationError as MarshmallowValidationError
+from sqlalchemy import inspect
 
-from ..indexer import update_indices
-from ..jsonschemas import EVENT_SCHEMA
-from ..models import ObjectEvent, PayloadType
-from ..schemas.loaders import EventSchema, RelationshipSchema
-from ..tasks import process_event
+from ..jsonschemas.validators import validate_schema
+from ..models import EventStatus, ObjectEvent, PayloadType
+from ..schemas.loaders import EventSchema, normalize_relationship
+from ..tasks import process_event, process_events, queue_events
+from .deduplication import claim_event_hashes, counterpart_content_hash, \
+    event_content_hash, release_event_hashes
 from .ingestion import update_groups, update_metadata
+from .metrics import StageTimer
 
 
 class EventAPI:
     """Event API."""
 
     @classmethod
-    def handle_event(cls, event: dict):
-        """Handle an event payload."""
-        jsonschema.validate(event, EVENT_SCHEMA)
+    def handle_event(cls, event: dict) -> bool:
+        """Handle an event payload.
+
+        Returns whether the event was accepted, i.e. is not a duplicate.
+        """
+        validate_schema('event', event)
 
         event_type = event['EventType']
         # TODO: Remove relationship_deleted handler and simplify the code here
@@ -35,37 +44,173 @@ class EventAPI:
             "RelationshipDeleted": cls.relationship_deleted,
         }
         handler = handlers[event_type]
-        handler(event)
+        return handler(event)
 
     @classmethod
-    def create_event(cls, event: dict):
-        """Create the event database model."""
-        event_obj, errors = EventSchema(check_existing=True).load(event)
-        if errors:
-            raise MarshmallowValidationError(errors)
+    def handle_events_stream(cls, lines) -> dict:
+        """Handle a stream of newline-delimited event payloads.
+
+        Each line is parsed and validated on its own, so that a single invalid
+        event does not reject the rest of the stream. Accepted events are
+        inserted in batches of ``ASCLEPIAS_BULK_EVENTS_BATCH_SIZE`` and sent
+        for processing in chunks of ``ASCLEPIAS_BULK_EVENTS_TASK_CHUNK_SIZE``.
+        Events with the ID of a stored event or with the same content as an
+        already accepted event are reported as duplicates and are not stored.
+        """
+        batch_size = current_app.config['ASCLEPIAS_BULK_EVENTS_BATCH_SIZE']
+        report = {'accepted': 0, 'rejected': 0, 'duplicate': 0,
+                  'results': []}
+        batch = []
+        batch_ids = set()
+        for line_no, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                continue
+            result = {'line': line_no}
+            try:
+                event = json.loads(line)
+                validate_schema('event', event)
+                event_obj = cls.load_event(event)
+                if event_obj.id in batch_ids:
+                    raise ValueError('Duplicate event ID in the same batch.')
+            except JSONValidationError as e:
+                result.update(status='rejected', message=e.message)
+            except MarshmallowValidationError as e:
+                result.update(status='rejected',
+                              message='Validation error: ' + str(e.messages))
+            except ValueError as e:
+                result.update(status='rejected', message=str(e))
+            else:
+                result['id'] = str(event_obj.id)
+                if cls._is_stored(event_obj):
+                    result['status'] = 'duplicate'
+                else:
+                    result['status'] = 'accepted'
+                    batch.append((event_obj, event_content_hash(event),
+                                  counterpart_content_hash(event), result))
+                    batch_ids.add(event_obj.id)
+            report[result['status']] += 1
+            report['results'].append(result)
+
+            if len(batch) >= batch_size:
+                cls._commit_batch(batch, report)
+                batch, batch_ids = [], set()
+        if batch:
+            cls._commit_batch(batch, report)
+        return report
+
+    @classmethod
+    def _commit_batch(cls, batch: list, report: dict):
+        """Skip the duplicates of a batch and commit the rest."""
+        duplicates = cls._deduplicate(
+            [(content_hash, counterpart_hash, event_obj.id)
+             for event_obj, content_hash, counterpart_hash, _ in batch])
+        for event_obj, _, _, result in batch:
+            if event_obj.id in duplicates:
+                result['status'] = 'duplicate'
+                report['accepted'] -= 1
+                report['duplicate'] += 1
+        cls._commit_events([event_obj for event_obj, _, _, _ in batch
+                            if event_obj.id not in duplicates])
+
+    @classmethod
+    def _deduplicate(cls, claims: list) -> set:
+        """Claim the events' content hashes and return the duplicates.
+
+        ``claims`` are ``(content_hash, counterpart_hash, event_id)``
+        tuples. The content claimed by the counterparts of the accepted
+        events is released.
+        """
+        if not current_app.config['ASCLEPIAS_EVENTS_DEDUP']:
+            return set()
+        duplicates = claim_event_hashes(
+            [(content_hash, event_id) for content_hash, _, event_id
+             in claims])
+        release_event_hashes(
+            counterpart_hash for _, counterpart_hash, event_id in claims
+            if event_id not in duplicates)
+        return duplicates
+
+    @classmethod
+    def load_event(cls, event: dict):
+        """Load and validate the event database model.
 
-        # Validate the entries in the payload
-        for payload in event['Payload']:
-            errors = RelationshipSchema(check_existing=True).validate(payload)
+        The payload's relationships are stored in their normalized form, so
+        that processing the event does not need to validate them again. An
+        event with the ID of a stored event is returned as it is stored.
+        """
+        received = datetime.utcnow()
+        timer = StageTimer()
+        with timer.stage('intake'):
+            event_obj, errors = EventSchema(check_existing=True).load(event)
             if errors:
                 raise MarshmallowValidationError(errors)
 
+            # Validate the entries in the payload, keeping their normalized
+            # form
+            normalized_payload = [
+                normalize_relationship(payload)
+                for payload in event['Payload']]
+        if cls._is_stored(event_obj):
+            return event_obj
+        event_obj.normalized_payload = normalized_payload
+        event_obj.received = received
+        event_obj.status = EventStatus.Received
+        event_obj.timings = timer.timings
+        return event_obj
+
+    @classmethod
+    def _is_stored(cls, event_obj) -> bool:
+        """Check if an event was loaded from the database."""
+        return not inspect(event_obj).transient
+
+    @classmethod
+    def create_event(cls, event: dict):
+        """Create the event database model."""
+        event_obj = cls.load_event(event)
         db.session.add(event_obj)
         return event_obj
 
     @classmethod
-    def relationship_created(cls, event: dict):
+    def _commit_events(cls, event_objs: list):
+        """Insert a batch of events and send them for processing."""
+        chunk_size = \
+            current_app.config['ASCLEPIAS_BULK_EVENTS_TASK_CHUNK_SIZE']
+        db.session.add_all(event_objs)
+        event_uuids = [str(e.id) for e in event_objs]
+        db.session.commit()
+        if current_app.config['ASCLEPIAS_EVENTS_BATCH_MODE']:
+            queue_events(event_uuids)
+            return
+        for idx in range(0, len(event_uuids), chunk_size):
+            process_events.delay(event_uuids[idx:idx + chunk_size])
+
+    @classmethod
+    def relationship_created(cls, event: dict) -> bool:
         """Handle a relationship creation event."""
-        cls._handle_relationship_event(event)
+        return cls._handle_relationship_event(event)
 
     @classmethod
-    def relationship_deleted(cls, event: dict):
+    def relationship_deleted(cls, event: dict) -> bool:
         """Handle a relationship deletion event."""
-        cls._handle_relationship_event(event, delete=True)
+        return cls._handle_relationship_event(event, delete=True)
 
     @classmethod
-    def _handle_relationship_event(cls, event: dict, delete=False):
-        event_obj = cls.create_event(event)
+    def _handle_relationship_event(cls, event: dict, delete=False) -> bool:
+        event_obj = cls.load_event(event)
+        if cls._is_stored(event_obj):
+            return False
+        if cls._deduplicate([(event_content_hash(event),
+                              counterpart_content_hash(event), event_obj.id)]):
+            db.session.commit()
+            return False
+        db.session.add(event_obj)
         event_uuid = str(event_obj.id)
         db.session.commit()
-        process_event.delay(event_uuid)
+        if current_app.config['ASCLEPIAS_EVENTS_BATCH_MODE']:
+            queue_events([event_uuid])
+        else:
+            process_event.delay(event_uuid)
+        return True
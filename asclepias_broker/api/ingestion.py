@@ -8,14 +8,115 @@
 """Relationshps ingestion functions."""
 
 import uuid
-from typing import Tuple
+from typing import Dict, Iterable, List, Tuple
 
+import sqlalchemy as sa
 from invenio_db import db
-from sqlalchemy.orm import aliased
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.util import identity_key
 
-from ..models import Group, GroupM2M, GroupMetadata, GroupRelationship, \
-    GroupRelationshipM2M, GroupRelationshipMetadata, GroupType, Identifier, \
-    Identifier2Group, Relation, Relationship, Relationship2GroupRelationship
+from ..cache import current_groups_cache
+from ..models import Group, GroupClosure, GroupM2M, GroupMetadata, \
+    GroupRelationship, GroupRelationshipM2M, GroupRelationshipMetadata, \
+    GroupType, Identifier, Identifier2Group, Relation, Relationship, \
+    Relationship2GroupRelationship
+from ..utils import identifier_url, insert_ignore
+from .outbox import add_dirty_group_relationships
+
+
+def _duplicate_relationships(queried_fk, grouping_fk, group_a_id, group_b_id):
+    """Select the group relationships that collide when merging two groups.
+
+    Returns a subquery of ``(keep_id, drop_id)`` pairs, where ``keep_id`` is
+    the relationship of group A and ``drop_id`` is the relationship of group B
+    with the same relation to the same group.
+    """
+    keep_gr = GroupRelationship.__table__.alias('keep_gr')
+    drop_gr = GroupRelationship.__table__.alias('drop_gr')
+    return (
+        sa.select([keep_gr.c.id.label('keep_id'),
+                   drop_gr.c.id.label('drop_id')])
+        .where(sa.and_(
+            keep_gr.c[queried_fk] == group_a_id,
+            drop_gr.c[queried_fk] == group_b_id,
+            keep_gr.c[grouping_fk] == drop_gr.c[grouping_fk],
+            keep_gr.c.relation == drop_gr.c.relation))
+        .alias('dup')
+    )
+
+
+def _merge_relationship_metadata(dup):
+    """Concatenate the histories of the dropped relationships to the kept."""
+    keep_meta = GroupRelationshipMetadata.__table__
+    drop_meta = keep_meta.alias('drop_meta')
+    join_cond = sa.and_(
+        keep_meta.c.group_relationship_id == dup.c.keep_id,
+        drop_meta.c.group_relationship_id == dup.c.drop_id)
+    if db.engine.dialect.name == 'postgresql':
+        older_first = sa.case(
+            [(drop_meta.c.updated < keep_meta.c.updated,
+              drop_meta.c.json.op('||')(keep_meta.c.json))],
+            else_=keep_meta.c.json.op('||')(drop_meta.c.json))
+        db.session.execute(
+            keep_meta.update().where(join_cond).values(json=older_first))
+    else:
+        # Fallback for databases without JSON array concatenation: fetch all
+        # pairs in one query and write them back in a single executemany.
+        pairs = db.session.execute(
+            sa.select([keep_meta.c.group_relationship_id,
+                       keep_meta.c.json, keep_meta.c.updated,
+                       drop_meta.c.json, drop_meta.c.updated])
+            .where(join_cond)
+        ).fetchall()
+        params = [
+            {'b_id': keep_id,
+             'b_json': (drop_json + keep_json if drop_updated < keep_updated
+                        else keep_json + drop_json)}
+            for keep_id, keep_json, keep_updated, drop_json, drop_updated
+            in pairs
+        ]
+        if params:
+            db.session.execute(
+                keep_meta.update()
+                .where(keep_meta.c.group_relationship_id ==
+                       sa.bindparam('b_id'))
+                .values(json=sa.bindparam('b_json')),
+                params)
+
+
+def _move_relationship_m2m(dup, cls, fk, other_fk):
+    """Move the M2M rows of the dropped relationships to the kept ones.
+
+    Rows that already exist for the kept relationship are deleted instead.
+    """
+    m2m = cls.__table__
+    other = m2m.alias('other_m2m')
+    keep_id = (sa.select([dup.c.keep_id])
+               .where(dup.c.drop_id == m2m.c[fk])
+               .correlate(m2m)
+               .as_scalar())
+    is_dropped = m2m.c[fk].in_(sa.select([dup.c.drop_id]))
+    db.session.execute(
+        m2m.delete().where(sa.and_(
+            is_dropped,
+            sa.exists().where(sa.and_(
+                other.c[fk] == keep_id,
+                other.c[other_fk] == m2m.c[other_fk])).correlate(m2m))))
+    db.session.execute(m2m.update().where(is_dropped).values({fk: keep_id}))
+
+
+def _delete_group_relationships(condition):
+    """Delete group relationships and their documents from the index.
+
+    The documents are deleted through the indexing outbox, once the
+    transaction is committed.
+    """
+    gr_table = GroupRelationship.__table__
+    ids = [row.id for row in db.session.execute(
+        sa.select([gr_table.c.id]).where(condition))]
+    if ids:
+        db.session.execute(gr_table.delete().where(gr_table.c.id.in_(ids)))
+        add_dirty_group_relationships(ids)
 
 
 def merge_group_relationships(group_a, group_b, merged_group):
@@ -39,115 +140,58 @@ def merge_group_relationships(group_a, group_b, merged_group):
     violate the unique constraint. We do that by removing the duplicate
     relationships (only one of each duplicate pair), so that we can later
     execute and UPDATE.
+
+    All of this is done with a fixed number of set-based statements,
+    independently of the number of duplicate relationships. When
+    'merged_group' is one of the merged groups, its own relationships are
+    left untouched.
     """
     # Determine if this is an Identity-type group merge
     identity_groups = group_a.type == GroupType.Identity
+    merge_groups_ids = [group_a.id, group_b.id]
+    moved_groups_ids = [i for i in merge_groups_ids if i != merged_group.id]
+    gr_table = GroupRelationship.__table__
 
     # Remove all GroupRelationship objects between groups A and B.
     # Correspnding GroupRelationshipM2M objects will cascade
-    (
-        GroupRelationship.query.filter(
-            ((GroupRelationship.source_id == group_a.id) &
-             (GroupRelationship.target_id == group_b.id)) |
-            ((GroupRelationship.source_id == group_b.id) &
-             (GroupRelationship.target_id == group_a.id)))
-        .delete(synchronize_session='fetch')
-    )
+    _delete_group_relationships(
+        (gr_table.c.source_id.in_(merge_groups_ids)) &
+        (gr_table.c.target_id.in_(merge_groups_ids)) &
+        (gr_table.c.source_id != gr_table.c.target_id))
 
     # We need to execute the same group relation merging twice, first for the
     # 'outgoing' relations ('A Cites X' + 'B Cites X' = 'AB Cites X'), and then
     # for the 'incoming' edges ('Y Cites A' + 'Y Cites B' = 'Y Cites AB').
     # Instead of repeating the code twice, we parametrize it as seen below
-    merge_groups_ids = [group_a.id, group_b.id]
     for queried_fk, grouping_fk in [('source_id', 'target_id'),
                                     ('target_id', 'source_id'), ]:
-        left_gr = aliased(GroupRelationship, name='left_gr')
-        right_gr = aliased(GroupRelationship, name='right_gr')
-        left_queried_fk = getattr(left_gr, queried_fk)
-        right_queried_fk = getattr(right_gr, queried_fk)
-        left_grouping_fk = getattr(left_gr, grouping_fk)
-        right_grouping_fk = getattr(right_gr, grouping_fk)
-
-        # 'duplicate_relations' holds GroupRelations, which should be
+        # 'dup' holds pairs of GroupRelationships, which should be
         # "squashed" after group merging. If we didn't do this, we would
-        # violate the UNIQUE constraint
-        # Generate 'duplicate_relations' by joining the table with itself
-        # by the "grouping_fk" (target_id/source_id)
-        duplicate_relations = (
-            db.session.query(left_gr, right_gr)
-            .filter(
-                left_gr.id < right_gr.id,  # Don't repeat the same pairs
-                left_queried_fk.in_(merge_groups_ids),
-                right_queried_fk.in_(merge_groups_ids),
-                right_queried_fk != left_queried_fk,
-                right_gr.relation == left_gr.relation)
-            .join(
-                right_gr,
-                left_grouping_fk == right_grouping_fk)
-        )
-        del_rel = set()
-        for rel_a, rel_b in duplicate_relations:
-            kwargs = {
-                queried_fk: merged_group.id,
-                grouping_fk: getattr(rel_a, grouping_fk),
-                'relation': rel_a.relation,
-                'id': uuid.uuid4(),
-                'type': rel_a.type
-            }
-            new_grp_rel = GroupRelationship(**kwargs)
-            db.session.add(new_grp_rel)
-            if identity_groups:
-                group_rel_meta = GroupRelationshipMetadata(
-                    group_relationship_id=new_grp_rel.id)
-                db.session.add(group_rel_meta)
-                json1, json2 = rel_a.data.json, rel_b.data.json
-                if rel_b.data.updated < rel_a.data.updated:
-                    json1, json2 = json2, json1
-                group_rel_meta.json = json1
-                group_rel_meta.update(json2, validate=False, multi=True)
-
-            # Delete the duplicate pairs of relationship M2Ms before updating
-            delete_duplicate_relationship_m2m(rel_a, rel_b)
-            rel_ids = [rel_a.id, rel_b.id]
-            (
-                GroupRelationshipM2M.query
-                .filter(GroupRelationshipM2M.relationship_id.in_(rel_ids))
-                .update({GroupRelationshipM2M.relationship_id: new_grp_rel.id},
-                        synchronize_session='fetch')
-            )
-            (
-                GroupRelationshipM2M.query
-                .filter(GroupRelationshipM2M.subrelationship_id.in_(rel_ids))
-                .update(
-                    {GroupRelationshipM2M.subrelationship_id: new_grp_rel.id},
-                    synchronize_session='fetch')
-            )
-            if identity_groups:
-                cls = Relationship2GroupRelationship
-                delete_duplicate_relationship_m2m(rel_a, rel_b, cls=cls)
-                (
-                    cls.query
-                    .filter(cls.group_relationship_id.in_(rel_ids))
-                    .update({cls.group_relationship_id: new_grp_rel.id},
-                            synchronize_session='fetch')
-                )
-            del_rel.add(rel_a.id)
-            del_rel.add(rel_b.id)
-        # Delete the duplicate relations
-        (
-            GroupRelationship.query
-            .filter(GroupRelationship.id.in_(del_rel))
-            .delete(synchronize_session='fetch')
-        )
+        # violate the UNIQUE constraint. Of each pair we keep the
+        # relationship of group A and drop the one of group B.
+        dup = _duplicate_relationships(
+            queried_fk, grouping_fk, group_a.id, group_b.id)
+        if identity_groups:
+            _merge_relationship_metadata(dup)
+        _move_relationship_m2m(
+            dup, GroupRelationshipM2M, 'relationship_id',
+            'subrelationship_id')
+        _move_relationship_m2m(
+            dup, GroupRelationshipM2M, 'subrelationship_id',
+            'relationship_id')
+        if identity_groups:
+            _move_relationship_m2m(
+                dup, Relationship2GroupRelationship, 'group_relationship_id',
+                'relationship_id')
+        # Delete the duplicate relations (metadata will cascade)
+        _delete_group_relationships(
+            gr_table.c.id.in_(sa.select([dup.c.drop_id])))
 
-        queried_fk_inst = getattr(GroupRelationship, queried_fk)
         # Update the other non-duplicated relations
-        (
-            GroupRelationship.query
-            .filter(queried_fk_inst.in_(merge_groups_ids))
-            .update({queried_fk_inst: merged_group.id},
-                    synchronize_session='fetch')
-        )
+        db.session.execute(
+            gr_table.update()
+            .where(gr_table.c[queried_fk].in_(moved_groups_ids))
+            .values({queried_fk: merged_group.id}))
 
 
 def delete_duplicate_relationship_m2m(group_a, group_b,
@@ -171,33 +215,8 @@ def delete_duplicate_relationship_m2m(group_a, group_b,
 
     for queried_fk, grouping_fk in [(queried_fk, grouping_fk),
                                     (grouping_fk, queried_fk), ]:
-        left_gr = aliased(cls, name='left_gr')
-        right_gr = aliased(cls, name='right_gr')
-        left_queried_fk = getattr(left_gr, queried_fk)
-        right_queried_fk = getattr(right_gr, queried_fk)
-        left_grouping_fk = getattr(left_gr, grouping_fk)
-        right_grouping_fk = getattr(right_gr, grouping_fk)
-        merge_groups_ids = [group_a.id, group_b.id]
-
-        duplicate_relations = (
-            db.session.query(left_gr, right_gr)
-            .filter(
-                # Because we join in the same table by grouping_fk, we will
-                # have pairs [(A,B), (B,A)] on the list. We can impose an
-                # inequality condition on one FK to reduce this to just one
-                # pair [(A,B)]
-                left_queried_fk < right_queried_fk,
-                left_queried_fk.in_(merge_groups_ids),
-                right_queried_fk.in_(merge_groups_ids),
-                right_queried_fk != left_queried_fk,
-                )
-            .join(
-                right_gr,
-                left_grouping_fk == right_grouping_fk)
-        )
-        # TODO: Delete in a query
-        for rel_a, rel_b in duplicate_relations:
-            db.session.delete(rel_a)
+        _delete_duplicate_m2m(cls, queried_fk, grouping_fk,
+                              [group_a.id, group_b.id])
 
 
 def delete_duplicate_group_m2m(group_a: Group, group_b: Group):
@@ -206,46 +225,108 @@ def delete_duplicate_group_m2m(group_a: Group, group_b: Group):
 
     Removes one of each pair of GroupM2M objects for groups A and B.
     """
-    cls = GroupM2M
     queried_fk = 'group_id'
     grouping_fk = 'subgroup_id'
 
     for queried_fk, grouping_fk in [(queried_fk, grouping_fk),
                                     (grouping_fk, queried_fk), ]:
-        left_gr = aliased(cls, name='left_gr')
-        right_gr = aliased(cls, name='right_gr')
-        left_queried_fk = getattr(left_gr, queried_fk)
-        right_queried_fk = getattr(right_gr, queried_fk)
-        left_grouping_fk = getattr(left_gr, grouping_fk)
-        right_grouping_fk = getattr(right_gr, grouping_fk)
-        merge_groups_ids = [group_a.id, group_b.id]
-
-        duplicate_relations = (
-            db.session.query(left_gr, right_gr)
-            .filter(
-                # Because we join in the same table by grouping_fk, we will
-                # have pairs [(A,B), (B,A)] on the list. We impose an
-                # inequality condition on one FK to reduce this to just one
-                # pair [(A,B)]
-                left_queried_fk < right_queried_fk,
-                left_queried_fk.in_(merge_groups_ids),
-                right_queried_fk.in_(merge_groups_ids),
-                right_queried_fk != left_queried_fk,
-                )
-            .join(
-                right_gr,
-                left_grouping_fk == right_grouping_fk)
-        )
-        # TODO: Delete in a query
-        for rel_a, rel_b in duplicate_relations:
-            db.session.delete(rel_a)
+        _delete_duplicate_m2m(GroupM2M, queried_fk, grouping_fk,
+                              [group_a.id, group_b.id])
+
+
+def _delete_duplicate_m2m(cls, queried_fk, grouping_fk, merge_groups_ids):
+    """Delete one of each pair of M2M rows that collide after a merge.
+
+    Because the same table is joined by grouping_fk, each pair [(A,B), (B,A)]
+    is seen twice. We impose an inequality condition on one FK to reduce this
+    to just one pair [(A,B)], and delete the row of A.
+    """
+    m2m = cls.__table__
+    other = m2m.alias('other_m2m')
+    db.session.execute(m2m.delete().where(sa.and_(
+        m2m.c[queried_fk].in_(merge_groups_ids),
+        sa.exists().where(sa.and_(
+            other.c[queried_fk].in_(merge_groups_ids),
+            m2m.c[queried_fk] < other.c[queried_fk],
+            other.c[grouping_fk] == m2m.c[grouping_fk])).correlate(m2m))))
+
+
+def _delete_merged_groups(*groups):
+    """Delete merged groups and detach them from the session.
+
+    The cached resolutions pointing to the deleted groups are invalidated.
+    The detached objects keep their loaded attributes (e.g. their IDs), while
+    the rest of the session is expired to reflect the set-based updates.
+    """
+    Group.query.filter(Group.id.in_([g.id for g in groups])).delete(
+        synchronize_session=False)
+    current_groups_cache.invalidate_groups(g.id for g in groups)
+    _drop_pending_groups({g.id for g in groups})
+    for group in groups:
+        db.session.expunge(group)
+    db.session.expire_all()
+
+
+def _move_group_closure(group_type: GroupType, absorbed_group: Group,
+                        merged_group: Group):
+    """Move the identifiers of an absorbed group to the merged group."""
+    column = GroupClosure.group_column(group_type)
+    (GroupClosure.query
+     .filter(column == absorbed_group.id)
+     .update({column: merged_group.id}, synchronize_session=False))
+
+
+def group_size(group: Group, limit: int=None) -> int:
+    """Count the rows pointing to a group, i.e. the cost of moving it.
+
+    These are its members (identifiers for Identity groups, subgroups for
+    Version groups) and its incoming and outgoing group relationships. With
+    a ``limit``, counting stops after ``limit + 1`` rows, so that the count
+    is only exact when it is at most ``limit``.
+    """
+    if group.type == GroupType.Identity:
+        members = Identifier2Group.query.filter_by(group_id=group.id)
+    else:
+        members = GroupM2M.query.filter_by(group_id=group.id)
+    relationships = GroupRelationship.query.filter(sa.or_(
+        GroupRelationship.source_id == group.id,
+        GroupRelationship.target_id == group.id))
+    size = 0
+    for query in (members, relationships):
+        if limit is not None:
+            if size > limit:
+                break
+            query = query.limit(limit + 1 - size)
+        size += query.count()
+    return size
+
+
+def _by_size(group_a: Group, group_b: Group) -> Tuple[Group, Group]:
+    """Order two groups as ``(survivor, absorbed)`` of a merge.
+
+    The larger group survives, so that only the rows of the smaller group
+    have to be moved. On ties, group A survives. The rows are counted up to
+    a limit, which grows until one of the groups is within it, so that the
+    rows of a large group are not all counted.
+    """
+    limit = 100
+    while True:
+        size_a = group_size(group_a, limit=limit)
+        size_b = group_size(group_b, limit=limit)
+        if min(size_a, size_b) <= limit:
+            break
+        limit *= 4
+    if size_b > size_a:
+        return group_b, group_a
+    return group_a, group_b
 
 
 def merge_identity_groups(group_a: Group, group_b: Group):
     """Merge two groups of type "Identity".
 
-    Merges the groups together into one group, taking care of migrating
-    all group relationships and M2M objects.
+    The smaller group is absorbed into the larger one, which keeps its ID,
+    taking care of migrating all group relationships and M2M objects of the
+    absorbed group. Returns the surviving Identity and Version groups.
     """
     # Nothing to do if groups are already merged
     if group_a == group_b:
@@ -262,39 +343,42 @@ def merge_identity_groups(group_a: Group, group_b: Group):
     merged_version_group = merge_version_groups(
         version_group_a, version_group_b)
 
-    merged_group = Group(type=GroupType.Identity, id=uuid.uuid4())
-    db.session.add(merged_group)
-    merged_group_meta = GroupMetadata(group_id=merged_group.id)
-    db.session.add(merged_group_meta)
-    json1, json2 = group_a.data.json, group_b.data.json
-    if group_b.data.updated < group_a.data.updated:
+    merged_group, absorbed_group = _by_size(group_a, group_b)
+    # The metadata of the most recently updated group takes precedence
+    json1, json2 = merged_group.data.json, absorbed_group.data.json
+    if absorbed_group.data.updated < merged_group.data.updated:
         json1, json2 = json2, json1
-    merged_group_meta.json = json1
-    merged_group_meta.update(json2)
+    merged_group.data.json = json1
+    merged_group.data.update(json2)
+    db.session.flush()
 
-    merge_group_relationships(group_a, group_b, merged_group)
+    merge_group_relationships(merged_group, absorbed_group, merged_group)
 
     (Identifier2Group.query
-     .filter(Identifier2Group.group_id.in_([group_a.id, group_b.id]))
+     .filter(Identifier2Group.group_id == absorbed_group.id)
      .update({Identifier2Group.group_id: merged_group.id},
-             synchronize_session='fetch'))
+             synchronize_session=False))
 
     # Delete the duplicate GroupM2M entries and update the remaining with
-    # the new Group
-    delete_duplicate_group_m2m(group_a, group_b)
+    # the surviving Group
+    delete_duplicate_group_m2m(merged_group, absorbed_group)
     (GroupM2M.query
-     .filter(GroupM2M.subgroup_id.in_([group_a.id, group_b.id]))
+     .filter(GroupM2M.subgroup_id == absorbed_group.id)
      .update({GroupM2M.subgroup_id: merged_group.id},
-             synchronize_session='fetch'))
+             synchronize_session=False))
+    _move_group_closure(GroupType.Identity, absorbed_group, merged_group)
 
-    Group.query.filter(Group.id.in_([group_a.id, group_b.id])).delete(
-        synchronize_session='fetch')
+    _delete_merged_groups(absorbed_group)
     # After merging identity groups, we need to merge the version groups
     return merged_group, merged_version_group
 
 
 def merge_version_groups(group_a: Group, group_b: Group):
-    """Merge two Version groups into one."""
+    """Merge two Version groups into one.
+
+    The smaller group is absorbed into the larger one, which keeps its ID.
+    Returns the surviving Version group.
+    """
     # Nothing to do if groups are already merged
     if group_a == group_b:
         return
@@ -304,32 +388,256 @@ def merge_version_groups(group_a: Group, group_b: Group):
         # Merging Identity groups is done separately
         raise ValueError("Cannot merge groups of type 'Identity'.")
 
-    merged_group = Group(type=group_a.type, id=uuid.uuid4())
-    db.session.add(merged_group)
+    merged_group, absorbed_group = _by_size(group_a, group_b)
 
-    merge_group_relationships(group_a, group_b, merged_group)
+    merge_group_relationships(merged_group, absorbed_group, merged_group)
 
     # Delete the duplicate GroupM2M entries and update the remaining with
-    # the new Group
-    delete_duplicate_group_m2m(group_a, group_b)
+    # the surviving Group
+    delete_duplicate_group_m2m(merged_group, absorbed_group)
     (GroupM2M.query
-     .filter(GroupM2M.group_id.in_([group_a.id, group_b.id]))
+     .filter(GroupM2M.group_id == absorbed_group.id)
      .update({GroupM2M.group_id: merged_group.id},
-             synchronize_session='fetch'))
+             synchronize_session=False))
     (GroupM2M.query
-     .filter(GroupM2M.subgroup_id.in_([group_a.id, group_b.id]))
+     .filter(GroupM2M.subgroup_id == absorbed_group.id)
      .update({GroupM2M.subgroup_id: merged_group.id},
-             synchronize_session='fetch'))
+             synchronize_session=False))
+    _move_group_closure(GroupType.Version, absorbed_group, merged_group)
 
-    Group.query.filter(Group.id.in_([group_a.id, group_b.id])).delete(
-        synchronize_session='fetch')
+    _delete_merged_groups(absorbed_group)
     return merged_group
 
 
+def _upsert(table, rows: List[dict], key_columns: Tuple[str, ...]) -> dict:
+    """Insert rows skipping existing ones and map their keys to IDs.
+
+    On PostgreSQL the IDs of the inserted rows are returned by the INSERT
+    itself, so that only rows which already existed (or were concurrently
+    inserted) have to be fetched by a second statement.
+    """
+    if not rows:
+        return {}
+    key_cols = [table.c[k] for k in key_columns]
+    ids = {}
+    if db.engine.dialect.name == 'postgresql':
+        inserted = db.session.execute(
+            insert_ignore(table).values(rows)
+            .returning(table.c.id, *key_cols))
+        ids.update((tuple(r)[1:], r[0]) for r in inserted)
+    else:
+        db.session.execute(insert_ignore(table), rows)
+    missing = {tuple(r[k] for k in key_columns) for r in rows} - set(ids)
+    if missing:
+        # Filter on the first (indexed) column and match the rest here
+        first_values = {k[0] for k in missing}
+        existing = db.session.execute(
+            sa.select([table.c.id] + key_cols)
+            .where(key_cols[0].in_(first_values)))
+        ids.update((tuple(r)[1:], r[0]) for r in existing
+                   if tuple(r)[1:] in missing)
+    return ids
+
+
+def resolve_identifiers(
+        identifiers: Iterable[Tuple[str, str]]) -> Dict[Tuple, uuid.UUID]:
+    """Fetch or create identifiers, given as ``(value, scheme)`` pairs.
+
+    The canonical URLs of the created identifiers are stored with them.
+    """
+    rows = [dict(id=uuid.uuid4(), value=value, scheme=scheme,
+                 idurl=identifier_url(value, scheme) or '')
+            for value, scheme in set(identifiers)]
+    return _upsert(Identifier.__table__, rows, ('value', 'scheme'))
+
+
+def backfill_identifier_urls(batch_size: int=10000) -> int:
+    """Store the canonical URLs of the identifiers that were created without.
+
+    Identifiers are updated and committed in batches. Returns the number of
+    updated identifiers.
+    """
+    table = Identifier.__table__
+    updated = 0
+    while True:
+        rows = db.session.execute(
+            sa.select([table.c.id, table.c.value, table.c.scheme])
+            .where(table.c.idurl.is_(None))
+            .limit(batch_size)).fetchall()
+        if not rows:
+            return updated
+        db.session.execute(
+            table.update()
+            .where(table.c.id == sa.bindparam('b_id'))
+            .values(idurl=sa.bindparam('b_idurl')),
+            [{'b_id': id_, 'b_idurl': identifier_url(value, scheme) or ''}
+             for id_, value, scheme in rows])
+        db.session.commit()
+        updated += len(rows)
+
+
+def backfill_group_closure() -> int:
+    """Store the groups closure of the identifiers that have groups without.
+
+    Returns the number of added identifiers.
+    """
+    closure = GroupClosure.__table__
+    id2g = Identifier2Group.__table__
+    g2g = GroupM2M.__table__
+    missing = (
+        sa.select([id2g.c.identifier_id, id2g.c.group_id, g2g.c.group_id])
+        .select_from(id2g.join(g2g, g2g.c.subgroup_id == id2g.c.group_id))
+        .where(~sa.exists().where(
+            closure.c.identifier_id == id2g.c.identifier_id))
+    )
+    result = db.session.execute(closure.insert().from_select(
+        ['identifier_id', 'identity_group_id', 'version_group_id'], missing))
+    db.session.commit()
+    return result.rowcount
+
+
+def resolve_relationships(
+        relationships: Iterable[Tuple]) -> Dict[Tuple, uuid.UUID]:
+    """Fetch or create relationships.
+
+    Relationships are given as ``(source_id, target_id, relation)`` tuples.
+    """
+    rows = [dict(id=uuid.uuid4(), source_id=source_id, target_id=target_id,
+                 relation=relation, deleted=False)
+            for source_id, target_id, relation in set(relationships)]
+    return _upsert(Relationship.__table__, rows,
+                   ('source_id', 'target_id', 'relation'))
+
+
+def resolve_relationship_keys(keys: List[Tuple]) -> List[Relationship]:
+    """Fetch or create in bulk the identifiers and relationships given.
+
+    Relationships are given as ``((source_value, source_scheme),
+    (target_value, target_scheme), relation)`` tuples, and the persistent
+    objects are returned in the same order.
+    """
+    id_map = resolve_identifiers(
+        i for source, target, _ in keys for i in (source, target))
+    rel_keys = [(id_map[source], id_map[target], relation)
+                for source, target, relation in keys]
+    rel_map = resolve_relationships(rel_keys)
+    rel_objs = {
+        r.id: r for r in
+        Relationship.query
+        .filter(Relationship.id.in_(set(rel_map.values())))
+        .options(joinedload(Relationship.source),
+                 joinedload(Relationship.target))
+    }
+    return [rel_objs[rel_map[k]] for k in rel_keys]
+
+
+def get_or_create_relationships(
+        relationships: List[Relationship]) -> List[Relationship]:
+    """Fetch or create in bulk the identifiers and relationships given.
+
+    Takes transient (loaded from a payload) relationships and returns the
+    corresponding persistent objects, in the same order.
+    """
+    return resolve_relationship_keys([
+        ((r.source.value, r.source.scheme), (r.target.value, r.target.scheme),
+         r.relation)
+        for r in relationships])
+
+
+#: Session info key of the groups cache entries of uncommitted transactions.
+PENDING_GROUPS_KEY = 'asclepias_pending_groups'
+
+
+def _outer_transaction(transaction):
+    """Get the transaction or savepoint committing a (sub)transaction."""
+    while transaction.parent is not None and not transaction.nested:
+        transaction = transaction.parent
+    return transaction
+
+
+def _cache_groups(identifier_value, id_type, entry: tuple):
+    """Cache the groups of an identifier once the transaction commits.
+
+    Until then, other processes could read groups that are rolled back. The
+    entry is kept with the current transaction or savepoint, and is passed
+    on to the enclosing transaction when a savepoint is released.
+    """
+    session = db.session()
+    pending = session.info.setdefault(PENDING_GROUPS_KEY, {})
+    pending.setdefault(_outer_transaction(session.transaction), []).append(
+        (identifier_value, id_type, entry))
+
+
+def write_pending_groups(session, transaction):
+    """Write the groups cache entries kept with a committed transaction."""
+    pending = session.info.get(PENDING_GROUPS_KEY, {})
+    for identifier_value, id_type, entry in pending.pop(transaction, ()):
+        current_groups_cache.set(identifier_value, id_type, entry)
+
+
+def _drop_pending_groups(group_ids: set):
+    """Drop the uncommitted groups cache entries pointing to retired groups."""
+    for entries in db.session.info.get(PENDING_GROUPS_KEY, {}).values():
+        entries[:] = [e for e in entries if not group_ids & set(e[2][1:])]
+
+
+@sa.event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    transaction = session.transaction
+    pending = session.info.get(PENDING_GROUPS_KEY)
+    if not pending or transaction not in pending:
+        return
+    if transaction.nested:
+        pending.setdefault(_outer_transaction(transaction.parent), []).extend(
+            pending.pop(transaction))
+    else:
+        write_pending_groups(session, transaction)
+
+
+@sa.event.listens_for(Session, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    # The entries of rolled back transactions are dropped
+    pending = session.info.get(PENDING_GROUPS_KEY)
+    if pending:
+        pending.pop(transaction, None)
+
+
+def _get_cached_groups(identifier_value, id_type):
+    """Get the cached Identity and Version groups of an identifier.
+
+    The groups are taken from the session when they are loaded in it, or are
+    loaded with a single query otherwise. Returns ``None`` if the identifier
+    is not cached, or if any of its cached groups no longer exists, in which
+    case the stale entry is dropped.
+    """
+    entry = current_groups_cache.get(identifier_value, id_type)
+    if entry is None:
+        return None
+    group_ids = entry[1:]
+    groups = [db.session.identity_map.get(identity_key(Group, i))
+              for i in group_ids]
+    if any(g is None or sa.inspect(g).expired for g in groups):
+        loaded = {g.id: g for g in
+                  Group.query.filter(Group.id.in_(group_ids))}
+        groups = [loaded.get(i) for i in group_ids]
+    if None in groups:
+        current_groups_cache.delete(identifier_value, id_type)
+        return None
+    return tuple(groups)
+
+
 def get_or_create_groups(identifier: Identifier) -> Tuple[Group, Group]:
-    """Given an Identifier, fetch or create its Identity and Version groups."""
+    """Given an Identifier, fetch or create its Identity and Version groups.
+
+    The closure row of the identifier is created along with its groups, or
+    if its groups were created before the closure table was.
+    """
+    groups = _get_cached_groups(identifier.value, identifier.scheme)
+    if groups:
+        return groups
     id2g = Identifier2Group.query.filter(
         Identifier2Group.identifier == identifier).one_or_none()
+    created = not id2g
     if not id2g:
         group = Group(type=GroupType.Identity, id=uuid.uuid4())
         db.session.add(group)
@@ -347,19 +655,50 @@ def get_or_create_groups(identifier: Identifier) -> Tuple[Group, Group]:
         db.session.add(group)
         g2g = GroupM2M(group=group, subgroup=id2g.group)
         db.session.add(g2g)
+        created = True
+    if created or GroupClosure.query.get(identifier.id) is None:
+        db.session.add(GroupClosure(
+            identifier=identifier, identity_group=id2g.group,
+            version_group=g2g.group))
+    _cache_groups(identifier.value, identifier.scheme,
+                  (identifier.id, id2g.group.id, g2g.group.id))
     return id2g.group, g2g.group
 
 
 def get_group_from_id(identifier_value, id_type='doi',
                       group_type=GroupType.Identity):
-    """Resolve from 'A' to Identity Group of A or to a Version Group of A."""
+    """Resolve from 'A' to Identity Group of A or to a Version Group of A.
+
+    Identifiers without a closure row (i.e. whose groups were created before
+    the closure table and were not backfilled) are resolved through their
+    Identifier2Group and GroupM2M rows instead.
+    """
     # TODO: Move this method to api.utils or to models?
-    id_ = Identifier.get(identifier_value, id_type)
-    id_grp = id_.id2groups[0].group
+    groups = _get_cached_groups(identifier_value, id_type)
+    if groups is None:
+        closure = (
+            GroupClosure.query
+            .join(Identifier, GroupClosure.identifier_id == Identifier.id)
+            .filter(Identifier.value == identifier_value,
+                    Identifier.scheme == id_type)
+            .options(joinedload(GroupClosure.identity_group),
+                     joinedload(GroupClosure.version_group))
+            .one_or_none()
+        )
+        if closure is None:
+            id_ = Identifier.get(identifier_value, id_type)
+            id_grp = id_.id2groups[0].group
+            ver_grp = GroupM2M.query.filter_by(subgroup=id_grp).one().group
+            return id_grp if group_type == GroupType.Identity else ver_grp
+        groups = closure.identity_group, closure.version_group
+        _cache_groups(
+            identifier_value, id_type,
+            (closure.identifier_id, closure.identity_group_id,
+             closure.version_group_id))
     if group_type == GroupType.Identity:
-        return id_grp
+        return groups[0]
     else:
-        return GroupM2M.query.filter_by(subgroup=id_grp).one().group
+        return groups[1]
 
 
 def add_group_relationship(relationship, src_id_grp, tar_id_grp,
@@ -427,12 +766,16 @@ def update_groups(relationship, delete=False):
 
 # TODO: When merging/splitting groups there is some merging/duplicating of
 # metadata as well
-def update_metadata(relationship: Relationship, payload):
-    """Updates the metadata of the source, target and relationship groups."""
+def update_metadata(relationship: Relationship, payload) -> Tuple[list, list]:
+    """Updates the metadata of the source, target and relationship groups.
+
+    Returns the Identity groups whose metadata changed, and the Identity and
+    Version group relationships whose history changed.
+    """
     # Get identity groups for source and targer
     # TODO: Do something for this case?
     if relationship.relation == Relation.IsIdenticalTo:
-        return
+        return [], []
     src_group = next((id2g.group for id2g in relationship.source.id2groups
                       if id2g.group.type == GroupType.Identity), None)
     trg_group = next((id2g.group for id2g in relationship.target.id2groups
@@ -440,15 +783,22 @@ def update_metadata(relationship: Relationship, payload):
     rel_group = GroupRelationship.query.filter_by(
         source=src_group, target=trg_group, relation=relationship.relation,
         type=GroupType.Identity).one_or_none()
-    if src_group:
-        src_metadata = src_group.data or GroupMetadata(group_id=src_group.id)
-        src_metadata.update(payload['Source'])
-    if trg_group:
-        trg_metadata = trg_group.data or GroupMetadata(group_id=trg_group.id)
-        trg_metadata.update(payload['Target'])
+    changed_groups, changed_relationships = [], []
+    for group, group_payload in ((src_group, payload['Source']),
+                                 (trg_group, payload['Target'])):
+        if group:
+            metadata = group.data or GroupMetadata(group_id=group.id)
+            old_json = metadata.json
+            metadata.update(group_payload)
+            if metadata.json != old_json:
+                changed_groups.append(group)
     if rel_group:
         rel_metadata = rel_group.data or \
             GroupRelationshipMetadata(group_relationship_id=rel_group.id)
         rel_metadata.update(
             {k: v for k, v in payload.items()
              if k in ('LinkPublicationDate', 'LinkProvider')})
+        changed_relationships = [rel_group] + [
+            m2m.relationship for m2m in GroupRelationshipM2M.query.filter_by(
+                subrelationship_id=rel_group.id)]
+    return changed_groups, changed_relationships
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Ingestion latency metrics."""
+
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable
+
+import sqlalchemy as sa
+from flask import current_app
+from invenio_db import db
+
+from ..cache import current_groups_cache
+from ..models import Event, EventStatus, IndexOutbox
+from ..search_cache import current_search_cache
+from .deduplication import get_deduplication_stats
+
+#: Ingestion stages of an event, in order. ``index`` is the time from the
+#: processing of the event until its changes are searchable, and ``total``
+#: the time from its receipt until then.
+STAGES = ('intake', 'queue', 'load', 'update_groups', 'update_metadata',
+          'commit', 'index', 'total')
+
+
+class StageTimer:
+    """Accumulate the durations of the stages of an event."""
+
+    def __init__(self, timings: dict=None):
+        """Initialize the timer with the already measured stages."""
+        self.timings = dict(timings or {})
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure the duration of a stage, added to its previous ones."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + \
+                time.monotonic() - start
+
+
+def _seconds_between(start: datetime, end: datetime) -> float:
+    return max((end - start).total_seconds(), 0) if start and end else None
+
+
+def mark_processed(timings: dict, failed: Iterable=()):
+    """Store the processing timings of committed events.
+
+    ``timings`` maps event IDs to their timings, including the ``commit``
+    stage. Events already marked as indexed are left untouched, while events
+    without changes pending indexing are marked as indexed.
+    """
+    table = Event.__table__
+    rows = [{'b_id': id_, 'b_timings': t} for id_, t in timings.items()]
+    if rows:
+        db.session.execute(
+            table.update()
+            .where(sa.and_(table.c.id == sa.bindparam('b_id'),
+                           table.c.status == EventStatus.Processed))
+            .values(timings=sa.bindparam('b_timings')), rows)
+    failed = list(failed)
+    if failed:
+        db.session.execute(
+            table.update().where(table.c.id.in_(failed))
+            .values(status=EventStatus.Failed))
+    db.session.commit()
+    mark_indexed(timings)
+
+
+def mark_indexed(event_ids: Iterable):
+    """Mark the events without pending outbox entries as indexed."""
+    event_ids = set(event_ids)
+    if not event_ids:
+        return
+    now = datetime.utcnow()
+    pending = {i for i, in db.session.query(IndexOutbox.event_id).filter(
+        IndexOutbox.event_id.in_(event_ids)).distinct()}
+    events = (db.session.query(Event.id, Event.received, Event.processed,
+                               Event.timings)
+              .filter(Event.id.in_(event_ids - pending),
+                      Event.status == EventStatus.Processed))
+    rows = []
+    for id_, received, processed, timings in events:
+        timings = dict(timings or {},
+                       index=_seconds_between(processed, now),
+                       total=_seconds_between(received, now))
+        rows.append({'b_id': id_, 'b_timings': timings})
+    if rows:
+        table = Event.__table__
+        db.session.execute(
+            table.update().where(table.c.id == sa.bindparam('b_id'))
+            .values(status=EventStatus.Indexed, indexed=now,
+                    timings=sa.bindparam('b_timings')), rows)
+        db.session.commit()
+
+
+def get_latency_histograms() -> dict:
+    """Get the histograms of the durations of the ingestion stages.
+
+    The histograms are computed from the most recent events, received within
+    ``ASCLEPIAS_METRICS_WINDOW``, up to ``ASCLEPIAS_METRICS_MAX_EVENTS``
+    events. Buckets are cumulative and keyed by their upper bound.
+    """
+    config = current_app.config
+    buckets = config['ASCLEPIAS_METRICS_BUCKETS']
+    since = datetime.utcnow() - config['ASCLEPIAS_METRICS_WINDOW']
+    events = (db.session.query(Event.timings)
+              .filter(Event.received >= since, Event.timings.isnot(None))
+              .order_by(Event.received.desc())
+              .limit(config['ASCLEPIAS_METRICS_MAX_EVENTS']))
+    histograms = {stage: {'count': 0, 'sum': 0.0,
+                          'buckets': {str(b): 0 for b in buckets}}
+                  for stage in STAGES}
+    for timings, in events:
+        for stage, value in timings.items():
+            if stage not in histograms or value is None:
+                continue
+            histogram = histograms[stage]
+            histogram['count'] += 1
+            histogram['sum'] += value
+            for bound in buckets:
+                if value <= bound:
+                    histogram['buckets'][str(bound)] += 1
+    for histogram in histograms.values():
+        histogram['buckets']['+Inf'] = histogram['count']
+    return histograms
+
+
+def get_metrics() -> dict:
+    """Get the ingestion metrics."""
+    since = datetime.utcnow() - current_app.config['ASCLEPIAS_METRICS_WINDOW']
+    statuses = dict(
+        db.session.query(Event.status, sa.func.count(Event.id))
+        .filter(Event.received >= since)
+        .group_by(Event.status))
+    pending, oldest = db.session.query(
+        sa.func.count(IndexOutbox.id), sa.func.min(IndexOutbox.created)).one()
+    return {
+        'events': {s.name.lower(): statuses.get(s, 0) for s in EventStatus},
+        'latency': get_latency_histograms(),
+        'outbox': {
+            'pending': pending,
+            'oldest_seconds': _seconds_between(oldest, datetime.utcnow()),
+        },
+        'groups_cache': current_groups_cache.get_stats(),
+        'search_cache': current_search_cache.get_stats(),
+        'deduplication': get_deduplication_stats(),
+    }
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Indexing outbox functions."""
+
+from datetime import datetime
+from typing import Iterable, List
+
+from invenio_db import db
+
+from ..indexer import DocumentsContext, build_documents, \
+    build_group_documents, delete_documents, delete_group_documents, \
+    index_documents, update_group_documents
+from ..models import Group, GroupType, IndexObjectType, IndexOutbox
+from .metrics import mark_indexed
+
+#: Name of the lock taken while draining the outbox, so that batches are
+#: drained one at a time.
+INDEXING_LOCK = 'asclepias-indexing'
+
+GROUP_OBJECT_TYPES = {
+    GroupType.Identity: IndexObjectType.IdentityGroup,
+    GroupType.Version: IndexObjectType.VersionGroup,
+}
+
+
+def _add_entries(entries, event_id=None):
+    """Insert outbox entries for ``(object_uuid, object_type)`` pairs."""
+    now = datetime.utcnow()
+    rows = [dict(object_uuid=object_uuid, object_type=object_type,
+                 event_id=event_id, created=now)
+            for object_uuid, object_type in entries]
+    if rows:
+        db.session.execute(IndexOutbox.__table__.insert(), rows)
+
+
+def _add_retried_entries(entries: List[IndexOutbox]):
+    """Add entries again at the end of the outbox, keeping their event."""
+    rows = [dict(object_uuid=e.object_uuid, object_type=e.object_type,
+                 event_id=e.event_id, created=e.created) for e in entries]
+    if rows:
+        db.session.execute(IndexOutbox.__table__.insert(), rows)
+
+
+def add_dirty_groups(groups: Iterable[Group], event_id=None):
+    """Mark the relationship documents of groups as outdated."""
+    _add_entries({(g.id, GROUP_OBJECT_TYPES[g.type])
+                  for g in groups if g is not None}, event_id=event_id)
+
+
+def add_dirty_group_relationships(ids: Iterable, event_id=None):
+    """Mark the documents of group relationships as outdated.
+
+    The documents are rebuilt, or deleted if the group relationships no
+    longer exist.
+    """
+    _add_entries({(id_, IndexObjectType.GroupRelationship) for id_ in ids},
+                 event_id=event_id)
+
+
+def add_dirty_group_metadata(groups: Iterable[Group], event_id=None):
+    """Mark the metadata of Identity groups in their documents as outdated.
+
+    Only the metadata is patched in the documents of the groups, which are
+    not rebuilt.
+    """
+    _add_entries({(g.id, IndexObjectType.GroupMetadata) for g in groups},
+                 event_id=event_id)
+
+
+def drain_outbox(max_entries: int, index: str='relationships') -> dict:
+    """Update the search index from a batch of outbox entries.
+
+    The entries are coalesced, so that the documents of each group are
+    rebuilt once per batch, and those of each group relationship are
+    rebuilt or deleted once. The metadata of the groups whose documents are
+    not rebuilt is patched in place. Entries of groups that no longer exist
+    (e.g. absorbed by a merge) are dropped.
+
+    Entries are locked while the index is updated and are removed once it
+    is done. The entries whose documents could not be updated are added
+    again at the end of the outbox, so that they are retried by a later
+    batch, and their events are not marked as indexed. Documents are built
+    from the state of the database when the batch is drained, so batches
+    must be drained one at a time (see ``INDEXING_LOCK``), or an older
+    state could overwrite a newer one.
+    """
+    entries = (
+        IndexOutbox.query
+        .order_by(IndexOutbox.id)
+        .limit(max_entries)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    ids = {t: set() for t in IndexObjectType}
+    for entry in entries:
+        ids[entry.object_type].add(entry.object_uuid)
+    group_ids = ids[IndexObjectType.IdentityGroup] | \
+        ids[IndexObjectType.VersionGroup] | ids[IndexObjectType.GroupMetadata]
+    existing = {row.id for row in db.session.query(Group.id)
+                .filter(Group.id.in_(group_ids))} if group_ids else set()
+
+    identity_ids = ids[IndexObjectType.IdentityGroup] & existing
+    version_ids = ids[IndexObjectType.VersionGroup] & existing
+    metadata_ids = (ids[IndexObjectType.GroupMetadata] & existing) - \
+        identity_ids
+    rel_ids = ids[IndexObjectType.GroupRelationship]
+    ctx = DocumentsContext()
+    docs = build_group_documents(identity_ids, version_ids, ctx=ctx)
+    if rel_ids:
+        docs.update((d['ID'], d) for d in build_documents(rel_ids, ctx=ctx))
+    errors = index_documents(docs.values(), index=index)
+    errors += delete_documents(rel_ids, index=index)
+    failed = {e['ID'] for e in errors}
+    metadata_errors = update_group_documents(metadata_ids, index=index)
+    if metadata_errors:
+        # Failed patches cannot be traced back to their groups
+        failed |= set(map(str, metadata_ids))
+    errors += metadata_errors
+    group_errors = delete_group_documents(group_ids - existing)
+    failed |= {e['ID'] for e in group_errors}
+    errors += group_errors
+    # The docs of the groups that failed to be indexed are retried, with the
+    # groups and relationships they were built for
+    failed |= {id_ for id_, doc in docs.items()
+               if doc['Source']['ID'] in failed or
+               doc['Target']['ID'] in failed}
+    failed |= {doc[key]['ID'] for id_, doc in docs.items() if id_ in failed
+               for key in ('Source', 'Target')}
+
+    retried = [e for e in entries if str(e.object_uuid) in failed]
+    if entries:
+        (IndexOutbox.query
+         .filter(IndexOutbox.id.in_([e.id for e in entries]))
+         .delete(synchronize_session=False))
+    _add_retried_entries(retried)
+    db.session.commit()
+    # Events are indexed once all their entries were indexed without errors
+    mark_indexed({e.event_id for e in entries if e.event_id} -
+                 {e.event_id for e in retried})
+    return {
+        'entries': len(entries),
+        'retried': len(retried),
+        'groups': len(identity_ids) + len(version_ids),
+        'relationships': len(rel_ids),
+        'metadata': len(metadata_ids),
+        'errors': len(errors),
+    }
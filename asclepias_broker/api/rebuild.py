@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Offline rebuilding of the groups graph."""
+
+import uuid
+from array import array
+from collections import defaultdict
+
+from invenio_db import db
+
+from ..cache import current_groups_cache
+from ..models import OVERRIDABLE_KEYS, Event, Group, GroupClosure, GroupM2M, \
+    GroupMetadata, GroupRelationship, GroupRelationshipM2M, \
+    GroupRelationshipMetadata, GroupType, Identifier, Identifier2Group, \
+    ObjectEvent, PayloadType, Relation, Relationship, \
+    Relationship2GroupRelationship
+
+
+class UnionFind:
+    """Union-find over dense integer indices.
+
+    Uses path halving and union by size, keeping the parent pointers and the
+    component sizes in compact integer arrays.
+    """
+
+    def __init__(self, size: int=0):
+        """Initialize the structure with ``size`` singleton sets."""
+        self.parent = array('l', range(size))
+        self.size = array('l', [1]) * size
+
+    def find(self, idx: int) -> int:
+        """Find the root of the set containing ``idx``."""
+        parent = self.parent
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    def union(self, a: int, b: int) -> int:
+        """Merge the sets containing ``a`` and ``b`` and return the root."""
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def components(self) -> array:
+        """Map each index to a dense component number."""
+        roots = {}
+        result = array('l', [0]) * len(self.parent)
+        for idx in range(len(self.parent)):
+            result[idx] = roots.setdefault(self.find(idx), len(roots))
+        return result
+
+
+def _chunks(rows, chunk_size):
+    """Split an iterable of rows into lists of at most ``chunk_size``."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _bulk_insert(model, rows, chunk_size):
+    """Insert rows into the model's table in chunks."""
+    for chunk in _chunks(rows, chunk_size):
+        db.session.execute(model.__table__.insert(), chunk)
+
+
+def _delete_groups():
+    """Delete all groups and their M2M and metadata objects."""
+    for model in (GroupRelationshipMetadata, GroupRelationshipM2M,
+                  Relationship2GroupRelationship, GroupRelationship,
+                  GroupMetadata, GroupM2M, Identifier2Group, GroupClosure,
+                  Group):
+        db.session.execute(model.__table__.delete())
+
+
+def rebuild_groups(chunk_size: int=10000) -> dict:
+    """Rebuild all Identity and Version groups from the relationships.
+
+    The IsIdenticalTo and HasVersion connected components are computed in
+    memory and every group, group relationship, M2M and metadata object is
+    written again from scratch. Group metadata and relationship histories are
+    recomputed by replaying the processed events in order.
+
+    Relationships between identifiers that end up in the same group are not
+    turned into (self-referencing) group relationships, which is what merging
+    groups one at a time converges to.
+    """
+    db.session.flush()
+
+    # Load all identifiers as dense indices
+    id_uuids = []
+    id_index = {}
+    for id_, in (db.session.query(Identifier.id)
+                 .order_by(Identifier.id).yield_per(chunk_size)):
+        id_index[id_] = len(id_uuids)
+        id_uuids.append(id_)
+
+    # Compute the Identity components, and keep the rest for later
+    identity_uf = UnionFind(len(id_uuids))
+    version_edges = []
+    relations = []
+    rel_index = {}
+    rel_query = (
+        db.session.query(Relationship.id, Relationship.source_id,
+                         Relationship.target_id, Relationship.relation)
+        .yield_per(chunk_size)
+    )
+    for rel_id, source_id, target_id, relation in rel_query:
+        src, trg = id_index[source_id], id_index[target_id]
+        rel_index[rel_id] = (src, trg, relation)
+        if relation == Relation.IsIdenticalTo:
+            identity_uf.union(src, trg)
+        elif relation == Relation.HasVersion:
+            version_edges.append((src, trg))
+        else:
+            relations.append((rel_id, src, trg, relation))
+    identity_comp = identity_uf.components()
+    n_identity = max(identity_comp) + 1 if id_uuids else 0
+
+    # Compute the Version components on top of the Identity components
+    version_uf = UnionFind(n_identity)
+    for src, trg in version_edges:
+        version_uf.union(identity_comp[src], identity_comp[trg])
+    version_comp = version_uf.components()
+    n_version = max(version_comp) + 1 if n_identity else 0
+
+    identity_ids = [uuid.uuid4() for _ in range(n_identity)]
+    version_ids = [uuid.uuid4() for _ in range(n_version)]
+
+    # Build the group relationships
+    id_grp_rels = {}
+    ver_grp_rels = {}
+    grp_rel_m2m = set()
+    rel2grp_rel = []
+    for rel_id, src, trg, relation in relations:
+        src_ig, trg_ig = identity_comp[src], identity_comp[trg]
+        if src_ig == trg_ig:
+            continue
+        id_key = (src_ig, trg_ig, relation)
+        id_grp_rel = id_grp_rels.setdefault(id_key, uuid.uuid4())
+        rel2grp_rel.append((rel_id, id_grp_rel))
+        src_vg, trg_vg = version_comp[src_ig], version_comp[trg_ig]
+        if src_vg == trg_vg:
+            continue
+        ver_key = (src_vg, trg_vg, relation)
+        ver_grp_rel = ver_grp_rels.setdefault(ver_key, uuid.uuid4())
+        grp_rel_m2m.add((ver_grp_rel, id_grp_rel))
+
+    # Replay the events' payloads to recompute the metadata
+    payload_rels = {}
+    object_events = (
+        db.session.query(ObjectEvent.event_id, ObjectEvent.payload_index,
+                         ObjectEvent.object_uuid)
+        .filter(ObjectEvent.payload_type == PayloadType.Relationship)
+        .yield_per(chunk_size)
+    )
+    for event_id, payload_idx, rel_id in object_events:
+        payload_rels[(event_id, payload_idx)] = rel_id
+    group_meta = defaultdict(dict)
+    rel_meta = defaultdict(list)
+    events = (
+        db.session.query(Event.id, Event.payload, Event.normalized_payload)
+        .order_by(Event.created, Event.id)
+        .yield_per(chunk_size)
+    )
+    for event_id, event_payload, normalized in events:
+        for payload_idx, payload in enumerate(event_payload['Payload']):
+            rel = rel_index.get(payload_rels.get((event_id, payload_idx)))
+            if rel is None or rel[2] == Relation.IsIdenticalTo:
+                continue
+            src_ig, trg_ig = identity_comp[rel[0]], identity_comp[rel[1]]
+            src_obj, trg_obj = payload['Source'], payload['Target']
+            if normalized and normalized[payload_idx]['Inverted']:
+                src_obj, trg_obj = trg_obj, src_obj
+            for ig, obj in ((src_ig, src_obj), (trg_ig, trg_obj)):
+                for k in OVERRIDABLE_KEYS:
+                    if obj.get(k):
+                        group_meta[ig][k] = obj[k]
+            id_grp_rel = id_grp_rels.get((src_ig, trg_ig, rel[2]))
+            if id_grp_rel:
+                rel_meta[id_grp_rel].append(
+                    {k: v for k, v in payload.items()
+                     if k in ('LinkPublicationDate', 'LinkProvider')})
+
+    # Write everything from scratch
+    _delete_groups()
+    _bulk_insert(Group, (
+        dict(id=g, type=GroupType.Identity) for g in identity_ids),
+        chunk_size)
+    _bulk_insert(Group, (
+        dict(id=g, type=GroupType.Version) for g in version_ids),
+        chunk_size)
+    _bulk_insert(Identifier2Group, (
+        dict(identifier_id=id_, group_id=identity_ids[identity_comp[idx]])
+        for idx, id_ in enumerate(id_uuids)), chunk_size)
+    _bulk_insert(GroupM2M, (
+        dict(group_id=version_ids[version_comp[ig]], subgroup_id=g)
+        for ig, g in enumerate(identity_ids)), chunk_size)
+    _bulk_insert(GroupClosure, (
+        dict(identifier_id=id_,
+             identity_group_id=identity_ids[identity_comp[idx]],
+             version_group_id=version_ids[
+                 version_comp[identity_comp[idx]]])
+        for idx, id_ in enumerate(id_uuids)), chunk_size)
+    _bulk_insert(GroupMetadata, (
+        dict(group_id=g, json=group_meta.get(ig, {}))
+        for ig, g in enumerate(identity_ids)), chunk_size)
+    _bulk_insert(GroupRelationship, (
+        dict(id=gr, type=GroupType.Identity, relation=relation,
+             source_id=identity_ids[src], target_id=identity_ids[trg])
+        for (src, trg, relation), gr in id_grp_rels.items()), chunk_size)
+    _bulk_insert(GroupRelationship, (
+        dict(id=gr, type=GroupType.Version, relation=relation,
+             source_id=version_ids[src], target_id=version_ids[trg])
+        for (src, trg, relation), gr in ver_grp_rels.items()), chunk_size)
+    _bulk_insert(GroupRelationshipMetadata, (
+        dict(group_relationship_id=gr, json=rel_meta.get(gr, []))
+        for gr in id_grp_rels.values()), chunk_size)
+    _bulk_insert(GroupRelationshipM2M, (
+        dict(relationship_id=ver_gr, subrelationship_id=id_gr)
+        for ver_gr, id_gr in grp_rel_m2m), chunk_size)
+    _bulk_insert(Relationship2GroupRelationship, (
+        dict(relationship_id=rel_id, group_relationship_id=gr)
+        for rel_id, gr in rel2grp_rel), chunk_size)
+    db.session.commit()
+    current_groups_cache.clear()
+    return {
+        'identifiers': len(id_uuids),
+        'identity_groups': n_identity,
+        'version_groups': n_version,
+        'identity_group_relationships': len(id_grp_rels),
+        'version_group_relationships': len(ver_grp_rels),
+    }
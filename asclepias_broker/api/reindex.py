@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Full rebuilding of the relationships index."""
+
+import json
+import multiprocessing
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterator, List
+
+from flask import current_app
+from invenio_db import db
+from invenio_search import current_search, current_search_client
+
+from ..indexer import build_documents, index_documents
+from ..models import GroupRelationship
+from ..search_cache import clear_search_results
+from ..utils import advisory_lock
+from .outbox import INDEXING_LOCK, drain_outbox
+
+#: Application used by the reindexing worker processes.
+_worker_app = None
+
+
+def _init_worker():
+    """Push an application context in a (forked) worker process."""
+    _worker_app.app_context().push()
+    # The session and the pooled connections inherited from the parent
+    # process are still used by it, so they are dropped without being closed
+    db.session.registry.clear()
+    try:
+        db.engine.dispose(close=False)
+    except TypeError:
+        # SQLAlchemy < 1.4.33
+        db.engine.pool = db.engine.pool.recreate()
+
+
+def _index_chunk(args) -> tuple:
+    """Build and index the docs of a chunk of group relationships."""
+    ids, index = args
+    errors = index_documents(build_documents(ids), index=index)
+    return len(ids), len(errors)
+
+
+def iter_group_relationship_ids(chunk_size: int) -> Iterator[List]:
+    """Stream the IDs of all group relationships in chunks.
+
+    Rows are fetched with a server-side cursor, so that they are not all
+    loaded in memory at once.
+    """
+    query = (
+        db.session.query(GroupRelationship.id)
+        .execution_options(stream_results=True)
+        .yield_per(chunk_size)
+    )
+    chunk = []
+    for id_, in query:
+        chunk.append(id_)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def create_versioned_index(alias: str='relationships') -> str:
+    """Create a new timestamped index with the mappings of an alias."""
+    # Mappings are registered as "<alias>-<version>"
+    name = sorted(n for n in current_search.mappings
+                  if n.startswith(alias + '-'))[-1]
+    with open(current_search.mappings[name]) as fp:
+        body = json.load(fp)
+    index = '{}-{:%Y%m%d%H%M%S}'.format(name, datetime.utcnow())
+    current_search_client.indices.create(index=index, body=body)
+    return index
+
+
+def swap_alias(alias: str, index: str) -> List[str]:
+    """Atomically point an alias to an index and return the old indices."""
+    client = current_search_client
+    old_indices = []
+    if client.indices.exists_alias(name=alias):
+        old_indices = list(client.indices.get_alias(name=alias))
+    actions = [{'remove': {'index': i, 'alias': alias}} for i in old_indices]
+    actions.append({'add': {'index': index, 'alias': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+    return old_indices
+
+
+@contextmanager
+def _worker_pool(processes: int):
+    """Start a pool of ``processes`` worker processes, if it is not ``0``."""
+    global _worker_app
+    if processes == 0:
+        yield None
+        return
+    _worker_app = current_app._get_current_object()
+    pool = multiprocessing.get_context('fork').Pool(
+        processes, initializer=_init_worker)
+    try:
+        yield pool
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _index_chunks(chunks: Iterator[List], index: str, pool=None,
+                  max_pending: int=None) -> Iterator[tuple]:
+    """Index chunks of group relationships and yield their results.
+
+    Chunks are read in this process, where the application context is, and
+    are sent to the worker processes of ``pool`` (or indexed in this process,
+    if there is no pool). At most ``max_pending`` chunks are pending at any
+    time, so that the chunks are not all loaded in memory at once.
+    """
+    if pool is None:
+        for ids in chunks:
+            yield _index_chunk((ids, index))
+        return
+    pending = deque()
+    for ids in chunks:
+        pending.append(pool.apply_async(_index_chunk, ((ids, index),)))
+        while len(pending) > max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def reindex_relationships(processes: int=None, chunk_size: int=1000,
+                          alias: str='relationships',
+                          delete_old: bool=False,
+                          progress: Callable=None) -> dict:
+    """Rebuild the relationships index from the database without downtime.
+
+    All group relationships are streamed from the database in chunks, whose
+    docs are built and bulk loaded into a new versioned index by a pool of
+    ``processes`` worker processes (or in this process, if it is ``0``).
+    ``progress`` is called with the number of indexed and total
+    relationships after each chunk.
+
+    The indexing outbox is not drained while the new index is loaded (the
+    reindexing first waits for the current drain to finish), so that the
+    changes made in the meantime, including deletions, are kept in the
+    outbox. The new index then catches up by draining them, and the alias
+    is atomically swapped to it. Until then, searches are served by the old
+    index, without these changes. The search index is thus not updated
+    while the relationships are reindexed.
+
+    The worker processes are started before this function makes any query.
+    They drop the database session and connections inherited from this
+    process, which are still used by it.
+    """
+    start_time = time.time()
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    with _worker_pool(processes) as pool, \
+            advisory_lock(INDEXING_LOCK, wait=True):
+        total = GroupRelationship.query.count()
+        index = create_versioned_index(alias)
+        indexed = errors = 0
+        for chunk_indexed, chunk_errors in _index_chunks(
+                iter_group_relationship_ids(chunk_size), index, pool,
+                max_pending=2 * processes):
+            indexed += chunk_indexed
+            errors += chunk_errors
+            if progress:
+                progress(indexed, total)
+
+        # Catch up with the changes made while loading the new index
+        max_entries = current_app.config['ASCLEPIAS_INDEXER_OUTBOX_BATCH_SIZE']
+        while True:
+            report = drain_outbox(max_entries, index=index)
+            errors += report['errors']
+            if report['entries'] == report['retried']:
+                break
+        current_search_client.indices.refresh(index=index)
+        old_indices = swap_alias(alias, index)
+    clear_search_results()
+    if delete_old:
+        for old_index in old_indices:
+            current_search_client.indices.delete(index=old_index)
+
+    elapsed = time.time() - start_time
+    return {
+        'index': index,
+        'old_indices': old_indices,
+        'relationships': indexed,
+        'errors': errors,
+        'seconds': round(elapsed, 1),
+        'relationships_per_second': round(indexed / elapsed, 1)
+        if elapsed else None,
+    }
@@ -9,9 +9,11 @@
 from itertools import groupby
 
 from invenio_db import db
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
 
-from ..models import Group, GroupRelationship, GroupType, Identifier, \
-    Identifier2Group, Relation
+from ..models import Group, GroupClosure, GroupRelationship, GroupType, \
+    Identifier, Relation, Relationship
 from ..schemas.loaders import from_datacite_relation
 from .ingestion import get_group_from_id
 
@@ -28,77 +30,165 @@ class RelationshipAPI:
         from pprint import pprint
         pprint(full_c)
 
+    @classmethod
+    def _get_relationships(cls, condition, relation):
+        """Get the (non-deleted) relationships of a type matching a condition.
+
+        The source and target identifiers are loaded in the same query.
+        """
+        return (
+            Relationship.query
+            .options(joinedload(Relationship.source),
+                     joinedload(Relationship.target))
+            .filter(condition, Relationship.relation == relation,
+                    Relationship.deleted.is_(False))
+            .all()
+        )
+
+    @classmethod
+    def _expand_identities(cls, identifier_ids) -> set:
+        """Get the Identity group members of several identifiers."""
+        expanded = GroupClosure.get_members(identifier_ids)
+        return {i for identities in expanded.values() for i in identities}
+
     @classmethod
     def get_citations(self, identifier, with_parents=False,
                       with_siblings=False, expand_target=False):
-        """Get citations of an identfier from the database."""
+        """Get citations of an identfier from the database.
+
+        Identities, parents, siblings and citing sources are each expanded
+        for all the identifiers at once, from the groups closure, so that the
+        number of queries does not depend on the size of the graph.
+        """
         # At the beginning, frontier is just identities
-        frontier = identifier.get_identities()
+        frontier = GroupClosure.get_members([identifier.id])[identifier.id]
         frontier_rel = set()
+        iden_parents = set()
         # Expand with parents
         if with_parents or with_siblings:
-            parents_rel = set(
-                sum([iden.get_parents(Relation.HasVersion, as_relation=True)
-                     for iden in frontier], []))
-            iden_parents = [item.source for item in parents_rel]
-            iden_parents = set(
-                sum([p.get_identities() for p in iden_parents], []))
+            parents_rel = set(self._get_relationships(
+                Relationship.target_id.in_([i.id for i in frontier]),
+                Relation.HasVersion))
+            iden_parents = self._expand_identities(
+                {item.source_id for item in parents_rel})
             if with_parents:
                 frontier_rel |= parents_rel
                 frontier += iden_parents
         # Expand with siblings
-        if with_siblings:
-            children_rel = set(
-                sum([p.get_children(Relation.HasVersion, as_relation=True)
-                     for p in iden_parents], []))
+        if with_siblings and iden_parents:
+            children_rel = set(self._get_relationships(
+                Relationship.source_id.in_([p.id for p in iden_parents]),
+                Relation.HasVersion))
             frontier_rel |= children_rel
-            par_children = [item.target for item in children_rel]
-            par_children = set(
-                sum([c.get_identities() for c in par_children], []))
-            frontier += par_children
+            frontier += self._expand_identities(
+                {item.target_id for item in children_rel})
         frontier = set(frontier)
+        frontier_ids = [i.id for i in frontier]
         # frontier contains all identifiers which directly cite the resource
-        citations = set(
-            sum([iden.get_parents(Relation.Cites, as_relation=True)
-                 for iden in frontier], []))
+        citations = self._get_relationships(
+            Relationship.target_id.in_(frontier_ids), Relation.Cites)
         # Expand it to identical identifiers and group them if they repeat
-        expanded_sources = [c.source.get_identities() for c in citations]
-        zipped = sorted(zip(expanded_sources, citations),
+        expanded_sources = GroupClosure.get_members(
+            {c.source_id for c in citations})
+        zipped = sorted(((expanded_sources[c.source_id], c)
+                         for c in citations),
                         key=lambda x: [xi.value for xi in x[0]])
         aggregated_citations = [
             (k, list(vi for _, vi in v))
             for k, v in groupby(zipped, key=lambda x: x[0])]
-        frontier_rel = list(frontier_rel) + list(set(
-            sum([item._get_identities(as_relation=True)
-                 for item in frontier], [])))
+        frontier_rel = list(frontier_rel) + list(set(self._get_relationships(
+            Relationship.source_id.in_(frontier_ids) |
+            Relationship.target_id.in_(frontier_ids),
+            Relation.IsIdenticalTo)))
         if expand_target:
             aggregated_citations += [(list(frontier), frontier_rel)]
         return aggregated_citations
 
     @classmethod
-    def get_citations2(self, identifier, relation: str,
-                       grouping_type=GroupType.Identity):
-        """Get citations of an identfier from the database."""
-        grp = get_group_from_id(identifier.value, identifier.scheme,
-                                group_type=grouping_type)
-
+    def _citations2_query(cls, group, relation: str, grouping_type):
+        """Query the citations of a group, ordered by group and identifier."""
         relation, inverse = from_datacite_relation(relation)
         object_fk = GroupRelationship.source_id
         target_fk = GroupRelationship.target_id
         if inverse:
             object_fk, target_fk = target_fk, object_fk
 
-        res = (
+        return (
             # TODO: +join by metadatas
             db.session.query(GroupRelationship, Group, Identifier)
-            .filter(object_fk == grp.id,
+            .filter(object_fk == group.id,
                     GroupRelationship.relation == relation)
             .join(Group, target_fk == Group.id)
-            .join(Identifier2Group, target_fk == Identifier2Group.group_id)
-            .join(Identifier, Identifier2Group.identifier_id == Identifier.id)
-            .order_by(Group.id)
-            .all()
+            .join(GroupClosure,
+                  target_fk == GroupClosure.group_column(grouping_type))
+            .join(Identifier, GroupClosure.identifier_id == Identifier.id)
+            .order_by(Group.id, Identifier.id)
         )
-        from itertools import groupby
+
+    @classmethod
+    def _citations2_page(cls, query, after=None, size=None) -> list:
+        """Get the rows of a query following a ``(Group.id, Identifier.id)``.
+
+        The rows are selected with a keyset condition, so that every page
+        costs the same regardless of its position.
+        """
+        if after:
+            group_id, identifier_id = after
+            query = query.filter(or_(
+                Group.id > group_id,
+                and_(Group.id == group_id, Identifier.id > identifier_id)))
+        if size:
+            query = query.limit(size)
+        return query.all()
+
+    @classmethod
+    def get_citations2(self, identifier, relation: str,
+                       grouping_type=GroupType.Identity, after=None,
+                       size=None):
+        """Get citations of an identfier from the database.
+
+        Citations are ordered by ``(Group.id, Identifier.id)``. With ``size``
+        only a page of (at most) ``size`` cited identifiers is returned,
+        following the ``after`` pair of IDs, i.e. the ``next_cursor`` of the
+        previous page. The identifiers of a group may span several pages.
+        """
+        grp = get_group_from_id(identifier.value, identifier.scheme,
+                                group_type=grouping_type)
+        res = self._citations2_page(
+            self._citations2_query(grp, relation, grouping_type),
+            after=after, size=size)
         result = [(k, list(v)) for k, v in groupby(res, key=lambda x: x[1])]
         return result
+
+    @classmethod
+    def iter_citations2(self, identifier, relation: str,
+                        grouping_type=GroupType.Identity, page_size=100):
+        """Iterate over the citations of an identifier, grouped by group ID.
+
+        Citations are fetched in pages of ``page_size`` cited identifiers,
+        which are detached from the session once consumed, so that memory is
+        bounded regardless of the number of citations.
+        """
+        grp = get_group_from_id(identifier.value, identifier.scheme,
+                                group_type=grouping_type)
+        query = self._citations2_query(grp, relation, grouping_type)
+
+        def _rows():
+            after = None
+            while True:
+                page = self._citations2_page(query, after=after,
+                                             size=page_size)
+                yield from page
+                for obj in {obj for row in page for obj in row}:
+                    if obj not in (identifier, grp) and obj in db.session:
+                        db.session.expunge(obj)
+                if len(page) < page_size:
+                    break
+                after = next_cursor(page)
+        return groupby(_rows(), key=lambda x: x[1].id)
+
+
+def next_cursor(rows):
+    """Get the ``(Group.id, Identifier.id)`` following rows of citations."""
+    _, group, identifier = rows[-1]
+    return group.id, identifier.id
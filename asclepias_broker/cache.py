@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Identifier to groups resolution cache."""
+
+import threading
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+from typing import Iterable, Optional, Tuple
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+#: Cache entry, i.e. ``(identifier_id, identity_group_id, version_group_id)``.
+GroupsEntry = Tuple[uuid.UUID, uuid.UUID, uuid.UUID]
+
+
+def _entry_key(value: str, scheme: str) -> str:
+    return '{}:{}'.format(scheme, value)
+
+
+def _as_uuid(value) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+class LocalGroupsTier:
+    """In-process LRU tier.
+
+    Keeps a reverse index from group IDs to keys, so that all the entries
+    pointing to a retired group can be dropped at once.
+    """
+
+    def __init__(self, maxsize: Optional[int]=None):
+        """Initialize the tier, keeping at most ``maxsize`` entries."""
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._group_keys = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        """Number of cached entries."""
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[GroupsEntry]:
+        """Get an entry, marking it as the most recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: GroupsEntry):
+        """Add or replace an entry, evicting the least recently used."""
+        with self._lock:
+            self._delete(key)
+            self._entries[key] = entry
+            for group_id in entry[1:]:
+                self._group_keys[group_id].add(key)
+            while self.maxsize and len(self._entries) > self.maxsize:
+                self._delete(next(iter(self._entries)))
+
+    def delete(self, key: str):
+        """Delete an entry."""
+        with self._lock:
+            self._delete(key)
+
+    def delete_groups(self, group_ids: Iterable[uuid.UUID]):
+        """Delete all entries pointing to any of the given groups."""
+        with self._lock:
+            for group_id in group_ids:
+                for key in list(self._group_keys.get(group_id, ())):
+                    self._delete(key)
+
+    def clear(self):
+        """Delete all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._group_keys.clear()
+
+    def _delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for group_id in entry[1:]:
+            keys = self._group_keys.get(group_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._group_keys[group_id]
+
+
+class RedisGroupsTier:
+    """Shared tier stored in Redis.
+
+    Entries are stored as strings and each group has a set of the keys of the
+    entries pointing to it.
+    """
+
+    def __init__(self, url: str, prefix: str='asclepias:groups',
+                 ttl: Optional[int]=None):
+        """Initialize the tier from a Redis URL."""
+        from redis import StrictRedis
+        self.client = StrictRedis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key):
+        return '{}:id:{}'.format(self.prefix, key)
+
+    def _group_key(self, group_id):
+        return '{}:group:{}'.format(self.prefix, group_id)
+
+    def get(self, key: str) -> Optional[GroupsEntry]:
+        """Get an entry."""
+        value = self.client.get(self._key(key))
+        return tuple(map(uuid.UUID, value.split('|'))) if value else None
+
+    def set(self, key: str, entry: GroupsEntry):
+        """Add or replace an entry."""
+        pipe = self.client.pipeline()
+        pipe.set(self._key(key), '|'.join(map(str, entry)), ex=self.ttl)
+        for group_id in entry[1:]:
+            pipe.sadd(self._group_key(group_id), key)
+            if self.ttl:
+                pipe.expire(self._group_key(group_id), self.ttl)
+        pipe.execute()
+
+    def delete(self, key: str):
+        """Delete an entry."""
+        self.client.delete(self._key(key))
+
+    def delete_groups(self, group_ids: Iterable[uuid.UUID]):
+        """Delete all entries pointing to any of the given groups."""
+        group_keys = [self._group_key(g) for g in group_ids]
+        if not group_keys:
+            return
+        keys = self.client.sunion(group_keys)
+        self.client.delete(*[self._key(k) for k in keys], *group_keys)
+
+    def clear(self):
+        """Delete all entries."""
+        keys = list(self.client.scan_iter('{}:*'.format(self.prefix)))
+        if keys:
+            self.client.delete(*keys)
+
+
+class GroupsCache:
+    """Two-tier cache of identifiers' Identity and Version groups.
+
+    Entries map an identifier's ``(value, scheme)`` to the IDs of the
+    identifier and its Identity and Version groups. Lookups go through the
+    in-process tier first and then through the (optional) shared tier.
+
+    Group IDs are never reused, so an entry only becomes stale when one of
+    its groups is retired by a merge. Merges invalidate the entries of the
+    retired groups in both tiers, while entries kept in the local tier of
+    other processes are detected as stale by the callers, which load the
+    cached groups anyway.
+    """
+
+    def __init__(self, local: LocalGroupsTier, shared=None):
+        """Initialize the cache."""
+        self.local = local
+        self.shared = shared
+        self.stats = Counter()
+
+    def get(self, value: str, scheme: str) -> Optional[GroupsEntry]:
+        """Get the cached groups of an identifier."""
+        key = _entry_key(value, scheme)
+        entry = self.local.get(key)
+        if entry is not None:
+            self.stats['local_hits'] += 1
+            return entry
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.stats['shared_hits'] += 1
+                self.local.set(key, entry)
+                return entry
+        self.stats['misses'] += 1
+        return None
+
+    def set(self, value: str, scheme: str, entry: Tuple):
+        """Cache the groups of an identifier."""
+        if any(i is None for i in entry):
+            return
+        key = _entry_key(value, scheme)
+        entry = tuple(_as_uuid(i) for i in entry)
+        self.local.set(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, entry)
+
+    def delete(self, value: str, scheme: str):
+        """Drop the entry of an identifier."""
+        key = _entry_key(value, scheme)
+        self.stats['stale'] += 1
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def invalidate_groups(self, group_ids: Iterable):
+        """Drop all entries pointing to any of the given (retired) groups."""
+        group_ids = [_as_uuid(g) for g in group_ids]
+        self.stats['invalidations'] += len(group_ids)
+        self.local.delete_groups(group_ids)
+        if self.shared is not None:
+            self.shared.delete_groups(group_ids)
+
+    def clear(self):
+        """Drop all entries."""
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def get_stats(self) -> dict:
+        """Get the hit/miss counters and the local tier size."""
+        stats = dict.fromkeys(
+            ('local_hits', 'shared_hits', 'misses', 'stale', 'invalidations'),
+            0)
+        stats.update(self.stats)
+        stats['local_size'] = len(self.local)
+        return stats
+
+
+def create_groups_cache(app) -> GroupsCache:
+    """Create the groups cache from the application's configuration.
+
+    A shared tier URL of ``memory://`` creates an in-process stand-in for the
+    shared tier (e.g. for tests).
+    """
+    config = app.config
+    shared = None
+    url = config.get('ASCLEPIAS_GROUPS_CACHE_REDIS_URL')
+    if url == 'memory://':
+        shared = LocalGroupsTier()
+    elif url:
+        shared = RedisGroupsTier(
+            url, prefix=config['ASCLEPIAS_GROUPS_CACHE_PREFIX'],
+            ttl=config['ASCLEPIAS_GROUPS_CACHE_TTL'])
+    return GroupsCache(
+        LocalGroupsTier(config['ASCLEPIAS_GROUPS_CACHE_SIZE']), shared=shared)
+
+
+def _get_groups_cache() -> GroupsCache:
+    cache = current_app.extensions.get('asclepias-groups-cache')
+    if cache is None:
+        cache = create_groups_cache(current_app)
+        current_app.extensions['asclepias-groups-cache'] = cache
+    return cache
+
+
+#: Groups cache of the current application.
+current_groups_cache = LocalProxy(_get_groups_cache)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Command line interface."""
+
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from .api.consistency import check_index
+from .api.deduplication import get_deduplication_stats
+from .api.ingestion import backfill_group_closure, backfill_identifier_urls
+from .api.rebuild import rebuild_groups
+from .api.reindex import reindex_relationships
+
+
+def abort_if_false(ctx, param, value):
+    """Abort command if value is False."""
+    if not value:
+        ctx.abort()
+
+
+@click.group()
+def asclepias():
+    """Asclepias Broker commands."""
+
+
+@asclepias.command('rebuild-groups')
+@click.option('--yes-i-know', is_flag=True, callback=abort_if_false,
+              expose_value=False,
+              prompt='Do you know that you are going to rebuild all groups?')
+@click.option('--chunk-size', default=10000, show_default=True,
+              help='Number of rows loaded and written per chunk.')
+@with_appcontext
+def rebuild_groups_command(chunk_size):
+    """Rebuild all Identity and Version groups from the relationships."""
+    click.secho('Rebuilding groups...', fg='green')
+    stats = rebuild_groups(chunk_size=chunk_size)
+    for key, value in stats.items():
+        click.echo('{}: {}'.format(key.replace('_', ' ').capitalize(), value))
+    click.secho('Groups rebuilt. The search index has to be rebuilt as well.',
+                fg='yellow')
+
+
+@asclepias.command('dedup-stats')
+@with_appcontext
+def dedup_stats_command():
+    """Show the number of distinct and duplicate events received."""
+    stats = get_deduplication_stats()
+    click.echo('Distinct events: {}'.format(stats['hashes']))
+    click.echo('Duplicate events: {}'.format(stats['duplicates']))
+
+
+@asclepias.command('backfill-idurls')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Number of identifiers updated per transaction.')
+@with_appcontext
+def backfill_idurls_command(batch_size):
+    """Store the canonical URLs of the identifiers created without them."""
+    updated = backfill_identifier_urls(batch_size=batch_size)
+    click.echo('Updated identifiers: {}'.format(updated))
+
+
+@asclepias.command('backfill-closure')
+@with_appcontext
+def backfill_closure_command():
+    """Store the groups closure of the identifiers created without it."""
+    added = backfill_group_closure()
+    click.echo('Added identifiers: {}'.format(added))
+
+
+@asclepias.command('reindex')
+@click.option('--yes-i-know', is_flag=True, callback=abort_if_false,
+              expose_value=False,
+              prompt='Do you know that you are going to reindex everything?')
+@click.option('--processes', type=int, default=None,
+              help='Number of worker processes (defaults to the CPU count, '
+                   '0 to build the documents in this process).')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Number of relationships indexed per chunk.')
+@click.option('--delete-old', is_flag=True,
+              help='Delete the previous indices after swapping the alias.')
+@with_appcontext
+def reindex_command(processes, chunk_size, delete_old):
+    """Rebuild the relationships index into a new index and swap the alias.
+
+    The search index is not updated with the changes made while reindexing
+    until the new index is complete, since the indexing outbox is not drained
+    in the meantime.
+    """
+    start = time.time()
+
+    def progress(indexed, total):
+        elapsed = time.time() - start
+        click.echo('Indexed {}/{} relationships ({:.0f} docs/sec)'.format(
+            indexed, total, indexed / elapsed if elapsed else 0))
+
+    click.secho('Reindexing relationships...', fg='green')
+    stats = reindex_relationships(processes=processes, chunk_size=chunk_size,
+                                  delete_old=delete_old, progress=progress)
+    for key, value in stats.items():
+        click.echo('{}: {}'.format(key.replace('_', ' ').capitalize(), value))
+
+
+@asclepias.command('check-index')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Number of groups checked per chunk.')
+@click.option('--workers', default=1, show_default=True,
+              help='Number of chunks checked in parallel.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='File to resume the check from and save the progress to.')
+@click.option('--dry-run', is_flag=True,
+              help='Only report the differences, without repairing them.')
+@with_appcontext
+def check_index_command(chunk_size, workers, checkpoint, dry_run):
+    """Check the relationships index against the database and repair it."""
+    def progress(stats):
+        click.echo('Checked {} groups ({} mismatched)'.format(
+            stats['groups'], stats['mismatched_groups']))
+
+    stats = check_index(chunk_size=chunk_size, workers=workers,
+                        checkpoint=checkpoint, repair=not dry_run,
+                        progress=progress)
+    for key, value in sorted(stats.items()):
+        click.echo('{}: {}'.format(key.replace('_', ' ').capitalize(), value))
@@ -14,10 +14,10 @@ from datetime import timedelta
 from invenio_app.config import APP_DEFAULT_SECURE_HEADERS
 from invenio_records_rest.facets import terms_filter
 from invenio_records_rest.utils import deny_all
-from invenio_search.api import RecordsSearch
+from kombu import Exchange, Queue
 
-from asclepias_broker.search import enum_term_filter, nested_range_filter, \
-    nested_terms_filter
+from asclepias_broker.search import RelationshipsSearch, enum_term_filter, \
+    nested_range_filter, nested_terms_filter
 
 
 def _(x):
@@ -100,8 +100,109 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'invenio_accounts.tasks.clean_session_table',
         'schedule': timedelta(minutes=60),
     },
+    'asclepias-index': {
+        'task': 'asclepias_broker.tasks.index_dirty_groups',
+        'schedule': timedelta(seconds=30),
+    },
+}
+
+# Events ingestion
+# ================
+
+#: Number of events inserted per transaction by the bulk events endpoint.
+ASCLEPIAS_BULK_EVENTS_BATCH_SIZE = 1000
+
+#: Number of events sent per processing task by the bulk events endpoint.
+ASCLEPIAS_BULK_EVENTS_TASK_CHUNK_SIZE = 100
+
+#: Queue received events to be processed in micro-batches by the
+#: ``process_events_queue`` task, instead of one task per event.
+ASCLEPIAS_EVENTS_BATCH_MODE = False
+
+#: Maximum number of events processed in a single batch transaction.
+ASCLEPIAS_EVENTS_BATCH_SIZE = 500
+
+#: Maximum time (in milliseconds) to wait for a batch to fill up.
+ASCLEPIAS_EVENTS_BATCH_WAIT = 1000
+
+#: Maximum time (in seconds) a ``process_events_queue`` run keeps fetching
+#: batches, so that the scheduled runs do not pile up under sustained load.
+ASCLEPIAS_EVENTS_QUEUE_RUN_TIME = 60
+
+#: Scheduled task draining the events queue, added to
+#: ``CELERY_BEAT_SCHEDULE`` when the application is initialized, in batch
+#: mode only.
+ASCLEPIAS_EVENTS_QUEUE_SCHEDULE = {
+    'task': 'asclepias_broker.tasks.process_events_queue',
+    'schedule': timedelta(seconds=10),
 }
 
+#: Message queue exchange for events pending batch processing.
+ASCLEPIAS_EVENTS_MQ_EXCHANGE = Exchange('asclepias-events', type='direct')
+
+#: Message queue for events pending batch processing.
+ASCLEPIAS_EVENTS_MQ_QUEUE = Queue(
+    'asclepias-events', exchange=ASCLEPIAS_EVENTS_MQ_EXCHANGE,
+    routing_key='asclepias-events')
+
+#: Skip events with the same content (event type and payload) as an already
+#: accepted event.
+ASCLEPIAS_EVENTS_DEDUP = True
+
+#: Time window in which events with the same content are duplicates, as a
+#: ``timedelta`` (``None`` for no limit). The content of an event is also
+#: accepted again once the opposite event (e.g. the deletion of a created
+#: relationship) is accepted.
+ASCLEPIAS_EVENTS_DEDUP_WINDOW = timedelta(days=1)
+
+#: JSON Schema validation backend of events and metadata, either
+#: ``jsonschema`` or ``fastjsonschema`` (requires the ``fastjsonschema``
+#: extra).
+ASCLEPIAS_JSONSCHEMA_BACKEND = 'jsonschema'
+
+# Groups cache
+# ============
+
+#: Maximum number of entries of the in-process identifier groups cache.
+ASCLEPIAS_GROUPS_CACHE_SIZE = 100000
+
+#: Redis URL of the shared identifier groups cache tier (``None`` disables
+#: the shared tier, ``memory://`` uses an in-process stand-in).
+ASCLEPIAS_GROUPS_CACHE_REDIS_URL = None
+
+#: Key prefix of the shared identifier groups cache tier.
+ASCLEPIAS_GROUPS_CACHE_PREFIX = 'asclepias:groups'
+
+#: Expiration time (in seconds) of the shared identifier groups cache entries.
+ASCLEPIAS_GROUPS_CACHE_TTL = 60 * 60 * 24 * 7
+
+# Search cache
+# ============
+
+#: Cache the results of the relationships search, by request and target
+#: groups. The cached results of groups are invalidated when their docs are
+#: indexed. Unless the search and the indexing are done by the same process,
+#: this requires the shared tier (``ASCLEPIAS_SEARCH_CACHE_REDIS_URL``).
+ASCLEPIAS_SEARCH_CACHE_ENABLED = False
+
+#: Maximum number of results of the in-process search cache tier.
+ASCLEPIAS_SEARCH_CACHE_SIZE = 10000
+
+#: Redis URL of the shared search cache tier (``None`` or ``memory://`` use
+#: an in-process tier instead, which is only invalidated by the indexing done
+#: in the same process).
+ASCLEPIAS_SEARCH_CACHE_REDIS_URL = None
+
+#: Key prefix of the shared search cache tier.
+ASCLEPIAS_SEARCH_CACHE_PREFIX = 'asclepias:search'
+
+#: Expiration time (in seconds) of the shared search cache entries.
+ASCLEPIAS_SEARCH_CACHE_TTL = 60 * 60 * 24
+
+#: Time (in seconds) after indexing the docs of a group during which its
+#: results are not cached, which should exceed the index refresh interval.
+ASCLEPIAS_SEARCH_CACHE_SETTLE = 2
+
 # Database
 # ========
 
@@ -112,8 +213,68 @@ SQLALCHEMY_DATABASE_URI = \
 # Search
 # ======
 
+#: Search indices to create. The ``groups`` index is added when the
+#: application is initialized, with ``ASCLEPIAS_INDEXER_SPLIT_GROUPS`` only.
 SEARCH_MAPPINGS = ['relationships']
 
+#: Maximum number of documents per indexing bulk request.
+ASCLEPIAS_INDEXER_BULK_CHUNK_SIZE = 500
+
+#: Maximum size (in bytes) of an indexing bulk request.
+ASCLEPIAS_INDEXER_BULK_MAX_BYTES = 10 * 1024 * 1024
+
+#: Number of threads sending indexing bulk requests in parallel.
+ASCLEPIAS_INDEXER_BULK_THREADS = 1
+
+#: Number of times a document that failed in a bulk request is retried.
+ASCLEPIAS_INDEXER_MAX_RETRIES = 3
+
+#: Initial delay (in seconds) before retrying a document, doubled on each
+#: retry.
+ASCLEPIAS_INDEXER_RETRY_BACKOFF = 0.5
+
+#: Update the search index from the indexing outbox periodically (see the
+#: ``asclepias-index`` scheduled task) instead of right after each event is
+#: processed.
+ASCLEPIAS_INDEXER_DEFERRED = True
+
+#: Maximum number of indexing outbox entries coalesced in a batch.
+ASCLEPIAS_INDEXER_OUTBOX_BATCH_SIZE = 10000
+
+#: Index the metadata of the groups once in the ``groups`` index, and only
+#: the fields used to search the relationships in their docs (see
+#: ``asclepias_broker.indexer.LEAN_GROUP_FIELDS``). Search results are joined
+#: with the metadata of their groups when serialized.
+ASCLEPIAS_INDEXER_SPLIT_GROUPS = False
+
+
+# Metrics
+# =======
+
+#: Time window of the events whose ingestion metrics are reported by the
+#: ``/metrics`` endpoint.
+ASCLEPIAS_METRICS_WINDOW = timedelta(hours=1)
+
+#: Maximum number of (most recent) events the latency histograms are computed
+#: from.
+ASCLEPIAS_METRICS_MAX_EVENTS = 10000
+
+#: Upper bounds (in seconds) of the buckets of the latency histograms.
+ASCLEPIAS_METRICS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300,
+                             900)
+
+
+# Relationships UI
+# ================
+
+#: Number of cited identifiers per page of the ``/relationships`` view. The
+#: ``stream`` parameter renders all of them, fetching one page at a time.
+ASCLEPIAS_RELATIONSHIPS_PAGE_SIZE = 100
+
+#: Maximum number of cited identifiers per page of the ``/relationships``
+#: view, which larger requested sizes are reduced to.
+ASCLEPIAS_RELATIONSHIPS_MAX_PAGE_SIZE = 1000
+
 
 # JSONSchemas
 # ===========
@@ -140,8 +301,7 @@ RECORDS_REST_ENDPOINTS = dict(
         pid_type='relid',
         pid_minter='relid',
         pid_fetcher='relid',
-        # TODO: Make our own search class
-        search_class=RecordsSearch,
+        search_class=RelationshipsSearch,
         indexer_class=None,
         search_index='relationships',
         search_type=None,
@@ -158,7 +318,7 @@ RECORDS_REST_ENDPOINTS = dict(
         },
         # TODO: Implement marshmallow serializers
         search_serializers={
-            'application/json': ('invenio_records_rest.serializers'
+            'application/json': ('asclepias_broker.serializers'
                                  ':json_v1_search'),
         },
         list_route='/relationships',
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Asclepias Broker extension."""
+
+from __future__ import absolute_import, print_function
+
+
+class AsclepiasBroker(object):
+    """Asclepias Broker extension."""
+
+    def __init__(self, app=None):
+        """Extension initialization."""
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Flask application initialization."""
+        self.init_config(app)
+        app.extensions['asclepias-broker'] = self
+
+    def init_config(self, app):
+        """Initialize configuration.
+
+        The configuration values depending on the instance's configuration are
+        set here, once it has been loaded.
+        """
+        config = app.config
+        if config['ASCLEPIAS_EVENTS_BATCH_MODE']:
+            schedule = dict(config['CELERY_BEAT_SCHEDULE'])
+            schedule.setdefault(
+                'asclepias-events', config['ASCLEPIAS_EVENTS_QUEUE_SCHEDULE'])
+            config['CELERY_BEAT_SCHEDULE'] = schedule
+        mappings = config['SEARCH_MAPPINGS']
+        if config['ASCLEPIAS_INDEXER_SPLIT_GROUPS'] and mappings is not None \
+                and 'groups' not in mappings:
+            config['SEARCH_MAPPINGS'] = list(mappings) + ['groups']
@@ -6,17 +6,24 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 """Elasticsearch indexing module."""
 
+import time
+import uuid
+from collections import defaultdict
 from copy import deepcopy
+from typing import Iterable, List
 
-import idutils
 import sqlalchemy as sa
+from elasticsearch import TransportError
+from elasticsearch.helpers import parallel_bulk, streaming_bulk
+from flask import current_app
 from invenio_db import db
 from invenio_search import current_search_client
-from invenio_search.api import RecordsSearch
 from sqlalchemy.orm import aliased
 
-from .models import Group, GroupM2M, GroupRelationship, GroupRelationshipM2M, \
-    GroupType
+from .models import Group, GroupM2M, GroupMetadata, GroupRelationship, \
+    GroupRelationshipM2M, GroupRelationshipMetadata, GroupType, Identifier, \
+    Identifier2Group
+from .search_cache import invalidate_search_results
 
 
 def build_id_info(id_):
@@ -25,57 +32,326 @@ def build_id_info(id_):
         'ID': id_.value,
         'IDScheme': id_.scheme
     }
-    try:
-        id_url = idutils.to_url(id_.value, id_.scheme)
-        if id_url:
-            data['IDURL'] = id_url
-    except Exception:
-        pass
+    id_url = id_.url
+    if id_url:
+        data['IDURL'] = id_url
     return data
 
 
-def build_group_metadata(group: Group) -> dict:
-    """Build the metadata for a group object."""
-    if group.type == GroupType.Version:
-        # Identifiers of the first identity group from all versions
-        id_group = group.groups[0]
-        ids = id_group.identifiers
-        doc = deepcopy((id_group.data and id_group.data.json) or {})
-    else:
-        doc = deepcopy((group.data and group.data.json) or {})
-        ids = group.identifiers
+def _as_uuid(value) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+class DocumentsContext:
+    """Memoized metadata of the groups and relationships of a set of docs.
+
+    The metadata of each group and relationship is built once per context.
+    The identifiers and metadata they are built from are fetched in bulk by
+    ``prefetch_groups`` and ``prefetch_relationships``, so that building the
+    docs of a group takes a constant number of queries, independently of the
+    number of its relationships. Objects that were not prefetched are
+    fetched on demand. Rows are fetched in a fixed order, so that the same
+    docs are built every time.
+    """
+
+    def __init__(self):
+        """Initialize an empty context."""
+        self._fetched = set()
+        # Version group/relationship ID -> first Identity group/relationship
+        self._firsts = {}
+        self._identifiers = defaultdict(list)
+        self._json = {}
+        self._group_metadata = {}
+        self._relationship_metadata = {}
+
+    def prefetch_groups(self, identity_ids: Iterable=(),
+                        version_ids: Iterable=()):
+        """Fetch the identifiers and metadata of groups in bulk."""
+        version_ids = set(map(_as_uuid, version_ids)) - self._fetched
+        if version_ids:
+            rows = (db.session.query(GroupM2M.group_id, GroupM2M.subgroup_id)
+                    .filter(GroupM2M.group_id.in_(version_ids))
+                    .order_by(GroupM2M.subgroup_id))
+            for group_id, subgroup_id in rows:
+                self._firsts.setdefault(group_id, subgroup_id)
+            self._fetched |= version_ids
+        identity_ids = set(map(_as_uuid, identity_ids)) | {
+            self._firsts[g] for g in version_ids if g in self._firsts}
+        identity_ids -= self._fetched
+        if identity_ids:
+            rows = (db.session.query(Identifier2Group.group_id, Identifier)
+                    .join(Identifier,
+                          Identifier2Group.identifier_id == Identifier.id)
+                    .filter(Identifier2Group.group_id.in_(identity_ids))
+                    .order_by(Identifier.value, Identifier.id))
+            for group_id, identifier in rows:
+                self._identifiers[group_id].append(identifier)
+            meta = GroupMetadata
+            rows = (db.session.query(meta.group_id, meta.json)
+                    .filter(meta.group_id.in_(identity_ids)))
+            self._json.update(rows)
+            self._fetched |= identity_ids
+
+    def prefetch_relationships(self, identity_ids: Iterable=(),
+                               version_ids: Iterable=()):
+        """Fetch the metadata of group relationships in bulk."""
+        version_ids = set(map(_as_uuid, version_ids)) - self._fetched
+        if version_ids:
+            rows = (db.session.query(
+                GroupRelationshipM2M.relationship_id,
+                GroupRelationshipM2M.subrelationship_id)
+                .filter(GroupRelationshipM2M.relationship_id.in_(
+                    version_ids))
+                .order_by(GroupRelationshipM2M.subrelationship_id))
+            for rel_id, subrel_id in rows:
+                self._firsts.setdefault(rel_id, subrel_id)
+            self._fetched |= version_ids
+        identity_ids = set(map(_as_uuid, identity_ids)) | {
+            self._firsts[r] for r in version_ids if r in self._firsts}
+        identity_ids -= self._fetched
+        if identity_ids:
+            meta = GroupRelationshipMetadata
+            rows = (db.session.query(meta.group_relationship_id, meta.json)
+                    .filter(meta.group_relationship_id.in_(identity_ids)))
+            self._json.update(rows)
+            self._fetched |= identity_ids
+
+    def group_metadata(self, group_id, group_type: GroupType) -> dict:
+        """Build the metadata of a group.
+
+        Version groups take the identifiers and metadata of their first
+        Identity group, i.e. the one with the lowest ID.
+        """
+        group_id = _as_uuid(group_id)
+        doc = self._group_metadata.get(group_id)
+        if doc is None:
+            if group_type == GroupType.Version:
+                # Identifiers of the first identity group from all versions
+                self.prefetch_groups(version_ids=[group_id])
+                id_group_id = self._firsts.get(group_id)
+            else:
+                self.prefetch_groups(identity_ids=[group_id])
+                id_group_id = group_id
+            doc = deepcopy(self._json.get(id_group_id) or {})
+            doc['Identifier'] = [
+                build_id_info(i) for i in self._identifiers[id_group_id]]
+            doc['ID'] = str(group_id)
+            self._group_metadata[group_id] = doc
+        return doc
+
+    def relationship_metadata(self, rel_id, rel_type: GroupType) -> list:
+        """Build the metadata of a relationship.
+
+        Version relationships take the history of their first Identity
+        relationship, i.e. the one with the lowest ID.
+        """
+        rel_id = _as_uuid(rel_id)
+        doc = self._relationship_metadata.get(rel_id)
+        if doc is None:
+            if rel_type == GroupType.Version:
+                # History of the first group relationship from all versions
+                self.prefetch_relationships(version_ids=[rel_id])
+                id_rel_id = self._firsts.get(rel_id)
+            else:
+                self.prefetch_relationships(identity_ids=[rel_id])
+                id_rel_id = rel_id
+            doc = deepcopy(self._json.get(id_rel_id) or [])
+            self._relationship_metadata[rel_id] = doc
+        return doc
+
+    def build_document(self, rel: GroupRelationship, source_id,
+                       target_id) -> dict:
+        """Build the doc of a relationship.
+
+        The source is always a Version group, while the target is a group of
+        the same type as the relationship. The metadata is shared with the
+        other docs of the context and should not be modified.
+        """
+        return {
+            "ID": str(rel.id),
+            "Grouping": rel.type.name.lower(),
+            "RelationshipType": rel.relation.name,
+            "History": self.relationship_metadata(rel.id, rel.type),
+            "Source": self.group_metadata(source_id, GroupType.Version),
+            "Target": self.group_metadata(target_id, rel.type),
+        }
+
 
-    doc['Identifier'] = [build_id_info(i) for i in ids]
-    doc['ID'] = str(group.id)
-    return doc
+def _is_retryable(status) -> bool:
+    """Check if a failed bulk item may succeed when sent again."""
+    # Connection errors have no status, while client errors (e.g. mapping
+    # errors) fail again, except for the rejections of a busy cluster
+    return not isinstance(status, int) or status == 429 or status >= 500
 
 
-def build_relationship_metadata(rel: GroupRelationship) -> dict:
-    """Build the metadata for a relationship."""
-    if rel.type == GroupType.Version:
-        # History of the first group relationship from all versions
-        # TODO: Maybe concatenate all histories?
-        id_rel = rel.relationships[0]
-        return deepcopy((id_rel.data and id_rel.data.json) or {})
+def _retry_document(client, doc: dict, index: str, doc_type: str,
+                    max_retries: int, backoff: float):
+    """Index a single document with exponential backoff.
+
+    Returns the ``(status, error)`` of the last attempt, or ``None`` when the
+    document was indexed.
+    """
+    status, error = None, None
+    for attempt in range(max_retries):
+        time.sleep(backoff * 2 ** attempt)
+        try:
+            client.index(index=index, doc_type=doc_type, id=doc['ID'],
+                         body=doc)
+            return None
+        except TransportError as e:
+            status, error = e.status_code, str(e)
+            if not _is_retryable(status):
+                break
+    return status, error
+
+
+def bulk_index(client, docs: Iterable[dict], index: str='relationships',
+               doc_type: str='doc', chunk_size: int=500,
+               max_chunk_bytes: int=10 * 1024 * 1024, threads: int=1,
+               max_retries: int=3, retry_backoff: float=0.5) -> List[dict]:
+    """Index documents with bulk requests.
+
+    Documents are keyed by their ``ID`` (i.e. the group relationship's ID),
+    so that indexing a document again replaces it in place. Requests are
+    split by number of documents and by size, and are sent by several
+    threads when ``threads`` is more than one. Documents that fail with a
+    retryable error are then retried one by one. Returns the errors
+    of the documents that could not be indexed, as dictionaries with the
+    document's ``ID``, ``status`` and ``error``.
+    """
+    docs = list(docs)
+    actions = ({'_index': index, '_type': doc_type, '_id': doc['ID'],
+                '_source': doc} for doc in docs)
+    kwargs = dict(chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+                  raise_on_error=False, raise_on_exception=False)
+    if threads > 1:
+        results = parallel_bulk(client, actions, thread_count=threads,
+                                **kwargs)
     else:
-        return deepcopy((rel.data and rel.data.json) or {})
+        results = streaming_bulk(client, actions, **kwargs)
+
+    errors = []
+    # Results are yielded in the same order as the actions
+    for doc, (ok, item) in zip(docs, results):
+        if ok:
+            continue
+        _, info = item.popitem()
+        status, error = info.get('status'), info.get('error')
+        if max_retries and _is_retryable(status):
+            result = _retry_document(client, doc, index, doc_type,
+                                     max_retries, retry_backoff)
+            if result is None:
+                continue
+            status, error = result
+        errors.append({'ID': doc.get('ID'), 'status': status,
+                       'error': error})
+    return errors
+
+
+def bulk_delete(client, ids: Iterable[str], index: str='relationships',
+                doc_type: str='doc', chunk_size: int=500) -> List[dict]:
+    """Delete documents by ID with bulk requests.
+
+    Documents that do not exist are skipped. Returns the errors of the
+    documents that could not be deleted.
+    """
+    actions = ({'_op_type': 'delete', '_index': index, '_type': doc_type,
+                '_id': id_} for id_ in ids)
+    errors = []
+    for ok, item in streaming_bulk(client, actions, chunk_size=chunk_size,
+                                   raise_on_error=False,
+                                   raise_on_exception=False):
+        _, info = item.popitem()
+        if not ok and info.get('status') != 404:
+            errors.append({'ID': info.get('_id'), 'status': info.get('status'),
+                           'error': info.get('error')})
+    return errors
+
+
+#: Fields of the groups kept in the relationship docs when the metadata of
+#: the groups is indexed in the ``groups`` index, which are the fields that
+#: the relationships are searched, filtered and sorted by.
+LEAN_GROUP_FIELDS = ('ID', 'Identifier', 'Type', 'PublicationDate')
+
+
+def lean_group(group: dict) -> dict:
+    """Strip the metadata of a group down to the searched fields."""
+    return {f: group[f] for f in LEAN_GROUP_FIELDS if f in group}
+
+
+def lean_document(doc: dict) -> dict:
+    """Strip the groups of a relationship doc down to the searched fields."""
+    return dict(doc, Source=lean_group(doc['Source']),
+                Target=lean_group(doc['Target']))
+
+
+def split_documents(docs: Iterable[dict]) -> tuple:
+    """Split relationship docs into lean docs and the docs of their groups."""
+    lean_docs, groups = [], {}
+    for doc in docs:
+        groups[doc['Source']['ID']] = doc['Source']
+        groups[doc['Target']['ID']] = doc['Target']
+        lean_docs.append(lean_document(doc))
+    return lean_docs, list(groups.values())
 
 
-def index_documents(docs):
-    """Index a list of documents into ES."""
+def join_group_metadata(docs: List[dict], index: str='groups') -> List[dict]:
+    """Replace the groups of lean relationship docs with their metadata.
+
+    The metadata of all the groups is fetched with a single multi-get
+    request, and the docs are updated in place.
+    """
+    ids = {doc[key]['ID'] for doc in docs for key in ('Source', 'Target')}
+    if not ids:
+        return docs
+    result = current_search_client.mget(
+        index=index, doc_type='doc', body={'ids': sorted(ids)})
+    groups = {d['_id']: d['_source'] for d in result['docs']
+              if d.get('found')}
     for doc in docs:
-        current_search_client.index(
-            index='relationships', doc_type='doc', body=doc)
+        for key in ('Source', 'Target'):
+            doc[key] = groups.get(doc[key]['ID'], doc[key])
+    return docs
+
+
+def index_documents(docs: Iterable[dict],
+                    index: str='relationships') -> List[dict]:
+    """Index a list of documents into ES.
 
+    With ``ASCLEPIAS_INDEXER_SPLIT_GROUPS``, the metadata of their groups is
+    indexed separately and lean docs are indexed instead. Returns the errors
+    of the documents that could not be indexed.
+    """
+    config = current_app.config
+    kwargs = dict(
+        chunk_size=config['ASCLEPIAS_INDEXER_BULK_CHUNK_SIZE'],
+        max_chunk_bytes=config['ASCLEPIAS_INDEXER_BULK_MAX_BYTES'],
+        threads=config['ASCLEPIAS_INDEXER_BULK_THREADS'],
+        max_retries=config['ASCLEPIAS_INDEXER_MAX_RETRIES'],
+        retry_backoff=config['ASCLEPIAS_INDEXER_RETRY_BACKOFF'])
+    docs = list(docs)
+    group_ids = {d[k]['ID'] for d in docs for k in ('Source', 'Target')}
+    errors = []
+    if config['ASCLEPIAS_INDEXER_SPLIT_GROUPS']:
+        docs, groups = split_documents(docs)
+        errors += bulk_index(
+            current_search_client, groups, index='groups', **kwargs)
+    errors += bulk_index(current_search_client, docs, index=index, **kwargs)
+    invalidate_search_results(group_ids)
+    for error in errors:
+        current_app.logger.error(
+            'Failed to index document %s (%s): %s',
+            error['ID'], error['status'], error['error'])
+    return errors
 
-def index_identity_group_relationships(ig_id: str, vg_id: str,
-                                       exclude_group_ids: tuple=None):
-    """Build the relationship docs for Identity relations."""
-    # Build the documents for incoming Version2Identity relations
 
+def build_incoming_identity_documents(
+        ig_id: str, exclude_ig_id: str=None,
+        ctx: DocumentsContext=None) -> List[dict]:
+    """Build the docs for incoming Version2Identity relations of a group."""
+    ctx = ctx or DocumentsContext()
     ver_grp_cls = aliased(Group, name='ver_grp_cls')
     id_grp_cls = aliased(Group, name='id_grp_cls')
-    exclude_ig_id, exclude_vg_id = (exclude_group_ids or (None, None))
 
     filter_cond = [
         ver_grp_cls.type == GroupType.Version,
@@ -86,29 +362,26 @@ def index_identity_group_relationships(ig_id: str, vg_id: str,
         filter_cond.append(GroupRelationship.source_id != exclude_ig_id)
 
     relationships = (
-        db.session.query(GroupM2M, GroupRelationship, ver_grp_cls)
+        db.session.query(GroupRelationship, ver_grp_cls.id)
+        .select_from(GroupM2M)
         .join(id_grp_cls, GroupM2M.subgroup_id == id_grp_cls.id)
         .join(ver_grp_cls, GroupM2M.group_id == ver_grp_cls.id)
         .join(GroupRelationship, GroupRelationship.source_id == id_grp_cls.id)
         .filter(*filter_cond)
+        .all()
     )
-    docs = []
-    ig_obj = Group.query.get(ig_id)
-    for _, rel, src_vg in relationships:
-        src_meta = build_group_metadata(src_vg)
-        trg_meta = build_group_metadata(ig_obj)
-        rel_meta = build_relationship_metadata(rel)
-        doc = {
-            "ID": str(rel.id),
-            "Grouping": "identity",
-            "RelationshipType": rel.relation.name,
-            "History": rel_meta,
-            "Source": src_meta,
-            "Target": trg_meta,
-        }
-        docs.append(doc)
+    ctx.prefetch_groups(identity_ids=[ig_id],
+                        version_ids={vg_id for _, vg_id in relationships})
+    ctx.prefetch_relationships(identity_ids={r.id for r, _ in relationships})
+    return [ctx.build_document(rel, src_vg_id, ig_id)
+            for rel, src_vg_id in relationships]
+
 
-    # Build the documents for outgoing Version2Identity relations
+def build_outgoing_identity_documents(
+        vg_id: str, exclude_vg_id: str=None,
+        ctx: DocumentsContext=None) -> List[dict]:
+    """Build the docs for outgoing Version2Identity relations of a group."""
+    ctx = ctx or DocumentsContext()
     ver_grprel_cls = aliased(GroupRelationship, name='ver_grprel_cls')
     id_grprel_cls = aliased(GroupRelationship, name='id_grprel_cls')
     filter_cond = [
@@ -119,35 +392,26 @@ def index_identity_group_relationships(ig_id: str, vg_id: str,
     if exclude_vg_id:
         filter_cond.append(ver_grprel_cls.target_id != exclude_vg_id)
     relationships = (
-        db.session.query(id_grprel_cls, Group)
+        db.session.query(id_grprel_cls)
         .join(ver_grprel_cls, ver_grprel_cls.source_id == vg_id)
         .join(GroupRelationshipM2M, sa.and_(
             GroupRelationshipM2M.relationship_id == ver_grprel_cls.id,
             GroupRelationshipM2M.subrelationship_id == id_grprel_cls.id))
         .join(Group, id_grprel_cls.target_id == Group.id)
         .filter(*filter_cond)
+        .all()
     )
-
-    vg_obj = Group.query.get(vg_id)
-    for rel, trg_ig in relationships:
-        src_meta = build_group_metadata(vg_obj)
-        trg_meta = build_group_metadata(rel.target)
-        rel_meta = build_relationship_metadata(rel)
-        doc = {
-            "ID": str(rel.id),
-            "Grouping": "identity",
-            "RelationshipType": rel.relation.name,
-            "History": rel_meta,
-            "Source": src_meta,
-            "Target": trg_meta,
-        }
-        docs.append(doc)
-    index_documents(docs)
+    ctx.prefetch_groups(identity_ids={r.target_id for r in relationships},
+                        version_ids=[vg_id])
+    ctx.prefetch_relationships(identity_ids={r.id for r in relationships})
+    return [ctx.build_document(rel, vg_id, rel.target_id)
+            for rel in relationships]
 
 
-def index_version_group_relationships(group_id: str,
-                                      exclude_group_id: str=None):
-    """Build the relationship docs for Version relations."""
+def build_version_documents(group_id: str, exclude_group_id: str=None,
+                            ctx: DocumentsContext=None) -> List[dict]:
+    """Build the docs for Version relations of a group."""
+    ctx = ctx or DocumentsContext()
     if exclude_group_id:
         filter_cond = sa.or_(
             sa.and_(GroupRelationship.source_id == group_id,
@@ -162,49 +426,197 @@ def index_version_group_relationships(group_id: str,
     relationships = GroupRelationship.query.filter(
         GroupRelationship.type == GroupType.Version,
         filter_cond
-    )
-    docs = []
-    for rel in relationships:
-        src_meta = build_group_metadata(rel.source)
-        trg_meta = build_group_metadata(rel.target)
-        rel_meta = build_relationship_metadata(rel)
-        doc = {
-            "ID": str(rel.id),
-            "Grouping": "version",
-            "RelationshipType": rel.relation.name,
-            "History": rel_meta,
-            "Source": src_meta,
-            "Target": trg_meta,
-        }
-        docs.append(doc)
-    index_documents(docs)
+    ).all()
+    ctx.prefetch_groups(version_ids={
+        g for r in relationships for g in (r.source_id, r.target_id)})
+    ctx.prefetch_relationships(version_ids={r.id for r in relationships})
+    return [ctx.build_document(rel, rel.source_id, rel.target_id)
+            for rel in relationships]
 
 
-def delete_group_relations(group_id):
-    """Delete all relations for given group ID from ES."""
-    q = RecordsSearch(index='relationships').query('term', Source__ID=group_id)
-    # Ignore versioning conflicts when deleting
-    q.params(conflicts='proceed').delete()
+def build_documents(group_relationship_ids: Iterable,
+                    ctx: DocumentsContext=None) -> List[dict]:
+    """Build the docs of group relationships given by their IDs."""
+    ctx = ctx or DocumentsContext()
+    relationships = GroupRelationship.query.filter(
+        GroupRelationship.id.in_(list(group_relationship_ids))).all()
+    # The source of Identity relations is the source's Version group
+    identity_sources = {r.source_id for r in relationships
+                        if r.type == GroupType.Identity}
+    version_groups = dict(
+        db.session.query(GroupM2M.subgroup_id, GroupM2M.group_id)
+        .filter(GroupM2M.subgroup_id.in_(identity_sources))
+    ) if identity_sources else {}
+    sources = {r.id: version_groups.get(r.source_id, r.source_id)
+               if r.type == GroupType.Identity else r.source_id
+               for r in relationships}
 
-    q = RecordsSearch(index='relationships').query('term', Target__ID=group_id)
-    q.params(conflicts='proceed').delete()
+    ctx.prefetch_groups(
+        identity_ids={r.target_id for r in relationships
+                      if r.type == GroupType.Identity},
+        version_ids=set(sources.values()) | {
+            r.target_id for r in relationships
+            if r.type == GroupType.Version})
+    ctx.prefetch_relationships(
+        identity_ids={r.id for r in relationships
+                      if r.type == GroupType.Identity},
+        version_ids={r.id for r in relationships
+                     if r.type == GroupType.Version})
+    return [ctx.build_document(rel, sources[rel.id], rel.target_id)
+            for rel in relationships]
 
 
-def update_indices(src_ig, trg_ig, mrg_ig, src_vg, trg_vg, mrg_vg):
-    """Updates Elasticsearch indices with the updated groups."""
-    # `src_group` and `trg_group` were merged into `merged_group`.
-    for grp_id in [src_ig, trg_ig, src_vg, trg_vg]:
-        delete_group_relations(grp_id)
+def build_group_documents(identity_group_ids: Iterable,
+                          version_group_ids: Iterable,
+                          ctx: DocumentsContext=None) -> dict:
+    """Build the relationship docs of several groups, keyed by their ID.
 
-    if mrg_vg:
-        index_version_group_relationships(mrg_vg)
-    else:
-        index_version_group_relationships(src_vg)
-        index_version_group_relationships(trg_vg, exclude_group_id=src_vg)
+    These are the incoming Identity relations of the Identity groups, and
+    the Version and outgoing Identity relations of the Version groups. Docs
+    shared by several groups are built once.
+    """
+    ctx = ctx or DocumentsContext()
+    docs = {}
+    for ig_id in identity_group_ids:
+        docs.update((d['ID'], d) for d in
+                    build_incoming_identity_documents(ig_id, ctx=ctx))
+    for vg_id in version_group_ids:
+        docs.update((d['ID'], d) for d in
+                    build_version_documents(vg_id, ctx=ctx))
+        docs.update((d['ID'], d) for d in
+                    build_outgoing_identity_documents(vg_id, ctx=ctx))
+    return docs
 
-    if mrg_ig:
-        index_identity_group_relationships(mrg_ig, mrg_vg)
-    else:
-        index_identity_group_relationships(src_ig, src_vg)
-        index_identity_group_relationships(trg_ig, trg_vg,
-                                           exclude_group_ids=(src_ig, src_vg))
+
+def index_groups(identity_group_ids: Iterable, version_group_ids: Iterable,
+                 index: str='relationships') -> List[dict]:
+    """Index the relationship docs of several groups at once.
+
+    All the docs are built in the same ``DocumentsContext`` (see
+    ``build_group_documents``).
+    """
+    docs = build_group_documents(identity_group_ids, version_group_ids)
+    return index_documents(docs.values(), index=index)
+
+
+def delete_documents(group_relationship_ids: Iterable,
+                     index: str='relationships') -> List[dict]:
+    """Delete the documents of group relationships that no longer exist.
+
+    Returns the errors of the documents that could not be deleted.
+    """
+    ids = set(group_relationship_ids)
+    if not ids:
+        return []
+    existing = {row.id for row in db.session.query(GroupRelationship.id)
+                .filter(GroupRelationship.id.in_(ids))}
+    errors = bulk_delete(
+        current_search_client, [str(i) for i in ids - existing], index=index,
+        chunk_size=current_app.config['ASCLEPIAS_INDEXER_BULK_CHUNK_SIZE'])
+    for error in errors:
+        current_app.logger.error(
+            'Failed to delete relationship %s (%s): %s',
+            error['ID'], error['status'], error['error'])
+    return errors
+
+
+def delete_group_documents(group_ids: Iterable) -> List[dict]:
+    """Delete the metadata docs of groups from the ``groups`` index."""
+    if not current_app.config['ASCLEPIAS_INDEXER_SPLIT_GROUPS']:
+        return []
+    return bulk_delete(
+        current_search_client, [str(i) for i in group_ids], index='groups',
+        chunk_size=current_app.config['ASCLEPIAS_INDEXER_BULK_CHUNK_SIZE'])
+
+
+#: Painless script replacing the groups of relationship docs in place.
+PATCH_GROUPS_SCRIPT = (
+    'def groups = params.groups; '
+    'if (groups.containsKey(ctx._source.Source.ID)) '
+    '{ ctx._source.Source = groups[ctx._source.Source.ID] } '
+    'if (groups.containsKey(ctx._source.Target.ID)) '
+    '{ ctx._source.Target = groups[ctx._source.Target.ID] }'
+)
+
+
+def patch_group_documents(client, groups: dict,
+                          index: str='relationships',
+                          doc_type: str='doc') -> List[dict]:
+    """Replace the groups of relationship docs with an update-by-query.
+
+    ``groups`` maps group IDs to their (new) metadata. Only the ``Source``
+    and ``Target`` objects of the docs of the groups are replaced. Returns
+    the errors of the documents that could not be updated.
+    """
+    if not groups:
+        return []
+    ids = list(groups)
+    result = client.update_by_query(
+        index=index, doc_type=doc_type, conflicts='proceed', body={
+            'query': {'bool': {'should': [
+                {'terms': {'Source.ID': ids}},
+                {'terms': {'Target.ID': ids}},
+            ]}},
+            'script': {
+                'lang': 'painless',
+                'inline': PATCH_GROUPS_SCRIPT,
+                'params': {'groups': groups},
+            },
+        })
+    return [{'ID': f.get('id'), 'status': f.get('status'),
+             'error': f.get('cause')} for f in result.get('failures', [])]
+
+
+def update_group_documents(identity_group_ids: Iterable,
+                           index: str='relationships') -> List[dict]:
+    """Update the metadata of groups in their docs without rebuilding them.
+
+    The metadata of the Identity groups and of their Version groups is
+    patched in place in the relationship docs. With
+    ``ASCLEPIAS_INDEXER_SPLIT_GROUPS``, the metadata is indexed in the
+    ``groups`` index instead, and the docs are only patched if the fields
+    they keep (``LEAN_GROUP_FIELDS``) changed. Returns the errors of the
+    documents that could not be updated.
+    """
+    identity_group_ids = set(map(_as_uuid, identity_group_ids))
+    if not identity_group_ids:
+        return []
+    config = current_app.config
+    version_group_ids = {i for i, in db.session.query(GroupM2M.group_id)
+                         .filter(GroupM2M.subgroup_id.in_(identity_group_ids))}
+    ctx = DocumentsContext()
+    ctx.prefetch_groups(identity_group_ids, version_group_ids)
+    groups = {str(g): ctx.group_metadata(g, GroupType.Identity)
+              for g in identity_group_ids}
+    groups.update({str(g): ctx.group_metadata(g, GroupType.Version)
+                   for g in version_group_ids})
+    # The docs of the groups, and the docs they are the source of, change
+    changed_group_ids = set(groups) | {
+        i for i, in db.session.query(GroupRelationship.target_id)
+        .filter(GroupRelationship.source_id.in_(
+            identity_group_ids | version_group_ids))}
+
+    errors = []
+    if config['ASCLEPIAS_INDEXER_SPLIT_GROUPS']:
+        result = current_search_client.mget(
+            index='groups', doc_type='doc', body={'ids': list(groups)})
+        old_groups = {d['_id']: d['_source'] for d in result['docs']
+                      if d.get('found')}
+        errors += bulk_index(
+            current_search_client, groups.values(), index='groups',
+            chunk_size=config['ASCLEPIAS_INDEXER_BULK_CHUNK_SIZE'])
+        # The docs only need to be patched if their lean groups changed
+        groups = {k: lean_group(v) for k, v in groups.items()
+                  if lean_group(v) != lean_group(old_groups.get(k, {}))}
+    chunk_size = config['ASCLEPIAS_INDEXER_BULK_CHUNK_SIZE']
+    items = list(groups.items())
+    for start in range(0, len(items), chunk_size):
+        errors += patch_group_documents(
+            current_search_client, dict(items[start:start + chunk_size]),
+            index=index)
+    invalidate_search_results(changed_group_ids)
+    for error in errors:
+        current_app.logger.error(
+            'Failed to update document %s (%s): %s',
+            error['ID'], error['status'], error['error'])
+    return errors
@@ -8,6 +8,7 @@
 
 import json
 import os
+from urllib.parse import urljoin
 
 
 _CUR_DIR = os.path.dirname(__file__)
@@ -20,3 +21,45 @@ with open(os.path.join(_CUR_DIR, 'scholix-v3.json'), 'r') as fp:
 
 with open(os.path.join(_CUR_DIR, 'event.json'), 'r') as fp:
     EVENT_SCHEMA = json.load(fp)
+
+#: Resolution store of the schemas referenced by URI.
+SCHEMAS_STORE = {
+    EVENT_SCHEMA['id']: EVENT_SCHEMA,
+    SCHOLIX_SCHEMA['$id']: SCHOLIX_SCHEMA,
+    urljoin(EVENT_SCHEMA['id'], 'scholix-v3.json'): SCHOLIX_SCHEMA,
+}
+
+COMMON_SCHEMA_DEFINITIONS = SCHOLIX_SCHEMA['definitions']
+OBJECT_TYPE_SCHEMA = COMMON_SCHEMA_DEFINITIONS['ObjectType']
+OVERRIDABLE_KEYS = {'Type', 'Title', 'Creator', 'PublicationDate', 'Publisher'}
+
+# Identifier metadata
+GROUP_METADATA_SCHEMA = {
+    '$schema': 'http://json-schema.org/draft-06/schema#',
+    'definitions': COMMON_SCHEMA_DEFINITIONS,
+    'additionalProperties': False,
+    'properties': {
+        k: v for k, v in OBJECT_TYPE_SCHEMA['properties'].items()
+        if k in OVERRIDABLE_KEYS
+    },
+}
+
+# Relationship metadata
+GROUP_RELATIONSHIP_METADATA_SCHEMA = {
+    '$schema': 'http://json-schema.org/draft-06/schema#',
+    'definitions': COMMON_SCHEMA_DEFINITIONS,
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'additionalProperties': False,
+        'properties': {
+            'LinkPublicationDate': {'$ref': '#/definitions/DateType'},
+            'LinkProvider': {
+                'type': 'array',
+                'items': {'$ref': '#/definitions/PersonOrOrgType'}
+            },
+            'LicenseURL': {'type': 'string'},
+        },
+        'required': ['LinkPublicationDate', 'LinkProvider'],
+    }
+}
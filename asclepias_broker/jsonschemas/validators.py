@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+"""Compiled JSON Schema validators."""
+
+import threading
+
+import jsonschema
+from flask import current_app, has_app_context
+from jsonschema.exceptions import ValidationError, best_match
+
+from . import EVENT_SCHEMA, GROUP_METADATA_SCHEMA, \
+    GROUP_RELATIONSHIP_METADATA_SCHEMA, SCHEMAS_STORE
+
+
+def jsonschema_validator(schema: dict, store: dict):
+    """Compile a schema with the ``jsonschema`` package.
+
+    Errors are the same as the ones raised by ``jsonschema.validate``.
+    """
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    resolver = jsonschema.RefResolver.from_schema(schema, store=store)
+    validator = cls(schema, resolver=resolver)
+
+    def validate(instance):
+        error = best_match(validator.iter_errors(instance))
+        if error is not None:
+            raise error
+    return validate
+
+
+def fastjsonschema_validator(schema: dict, store: dict):
+    """Compile a schema to Python code with the ``fastjsonschema`` package.
+
+    Errors are translated to ``jsonschema.ValidationError``, though they only
+    carry the error message.
+    """
+    import fastjsonschema
+    handlers = {'http': store.__getitem__, 'https': store.__getitem__}
+    compiled = fastjsonschema.compile(schema, handlers=handlers)
+
+    def validate(instance):
+        try:
+            compiled(instance)
+        except fastjsonschema.JsonSchemaException as e:
+            raise ValidationError(e.message)
+    return validate
+
+
+BACKENDS = {
+    'jsonschema': jsonschema_validator,
+    'fastjsonschema': fastjsonschema_validator,
+}
+
+
+class ValidatorRegistry:
+    """Registry of named schemas, compiled once per process and backend."""
+
+    def __init__(self, store: dict=None):
+        """Initialize the registry with a resolution store for ``$ref``s."""
+        self.store = dict(store or {})
+        self._schemas = {}
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, schema: dict):
+        """Register a schema under a name."""
+        self._schemas[name] = schema
+        self._validators = {k: v for k, v in self._validators.items()
+                            if k[0] != name}
+
+    def get(self, name: str, backend: str=None):
+        """Get the compiled validator of a schema."""
+        backend = backend or _default_backend()
+        key = (name, backend)
+        validator = self._validators.get(key)
+        if validator is None:
+            with self._lock:
+                validator = self._validators.get(key)
+                if validator is None:
+                    validator = BACKENDS[backend](
+                        self._schemas[name], self.store)
+                    self._validators[key] = validator
+        return validator
+
+    def validate(self, name: str, instance, backend: str=None):
+        """Validate an instance against a schema."""
+        self.get(name, backend=backend)(instance)
+
+
+def _default_backend():
+    if has_app_context():
+        return current_app.config['ASCLEPIAS_JSONSCHEMA_BACKEND']
+    return 'jsonschema'
+
+
+#: Validators of the broker's schemas.
+validator_registry = ValidatorRegistry(store=SCHEMAS_STORE)
+validator_registry.register('event', EVENT_SCHEMA)
+validator_registry.register('group-metadata', GROUP_METADATA_SCHEMA)
+validator_registry.register('group-relationship-metadata-item', dict(
+    GROUP_RELATIONSHIP_METADATA_SCHEMA['items'],
+    **{k: GROUP_RELATIONSHIP_METADATA_SCHEMA[k]
+       for k in ('$schema', 'definitions')}))
+
+#: Validate an instance against a registered schema.
+validate_schema = validator_registry.validate
@@ -10,10 +10,11 @@
 import enum
 import uuid
 from copy import deepcopy
+from datetime import datetime
 
-import jsonschema
 from invenio_db import db
-from sqlalchemy import JSON, Boolean, Column, Enum, ForeignKey, Integer, String
+from sqlalchemy import JSON, Boolean, Column, Enum, ForeignKey, Integer, \
+    String, and_, case, func, or_, select
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import relationship as orm_relationship
@@ -23,7 +24,10 @@ from sqlalchemy.types import DateTime
 from sqlalchemy_utils.models import Timestamp
 from sqlalchemy_utils.types import JSONType, UUIDType
 
-from .jsonschemas import SCHOLIX_SCHEMA
+from .jsonschemas import GROUP_METADATA_SCHEMA, \
+    GROUP_RELATIONSHIP_METADATA_SCHEMA, OVERRIDABLE_KEYS
+from .jsonschemas.validators import validate_schema
+from .utils import identifier_url
 
 
 class Relation(enum.Enum):
@@ -50,6 +54,17 @@ class PayloadType(enum.Enum):
     Identifier = 2
 
 
+class EventStatus(enum.Enum):
+    """Ingestion status of an event."""
+
+    Received = 1
+    Processed = 2
+    Indexed = 3
+    Failed = 4
+    #: Skipped when processed, as its content was already accepted.
+    Duplicate = 5
+
+
 class GroupType(enum.Enum):
     """Group type."""
 
@@ -57,6 +72,15 @@ class GroupType(enum.Enum):
     Version = 2
 
 
+class IndexObjectType(enum.Enum):
+    """Type of an object pending indexing."""
+
+    IdentityGroup = 1
+    VersionGroup = 2
+    GroupRelationship = 3
+    GroupMetadata = 4
+
+
 class Identifier(db.Model, Timestamp):
     """Identifier model."""
 
@@ -70,11 +94,21 @@ class Identifier(db.Model, Timestamp):
     id = Column(UUIDType, default=uuid.uuid4, primary_key=True)
     value = Column(String)
     scheme = Column(String)
+    # Canonical URL, empty if the identifier has none and NULL if it was not
+    # computed yet
+    idurl = Column(String, nullable=True)
 
     def __repr__(self):
         """String representation of the Identifier."""
         return "<{self.scheme}: {self.value}>".format(self=self)
 
+    @property
+    def url(self):
+        """Canonical URL of the identifier, if it has one."""
+        if self.idurl is None:
+            return identifier_url(self.value, self.scheme)
+        return self.idurl or None
+
     @classmethod
     def get(cls, value=None, scheme=None, **kwargs):
         """Get the identifier from the database."""
@@ -112,12 +146,53 @@ class Identifier(db.Model, Timestamp):
 
     def get_identities(self):
         """Get the fully-expanded list of 'Identical' Identifiers."""
-        ids = next_ids = set([self])
-        while next_ids:
-            grp = set(sum([item._get_identities() for item in next_ids], []))
-            next_ids = grp - ids
-            ids |= grp
-        return list(ids)
+        return self.expand_identities([self.id])[self.id]
+
+    @classmethod
+    def _identities_cte(cls, identifier_ids):
+        """Recursive CTE of the 'Identical' identifiers of identifiers.
+
+        Its rows are ``(root, id)`` pairs, for each of the ``identifier_ids``
+        and each identifier transitively identical to it (including itself).
+        """
+        rel = Relationship.__table__
+        identities = (
+            select([cls.id.label('root'), cls.id.label('id')])
+            .where(cls.id.in_(identifier_ids))
+            .cte('identities', recursive=True)
+        )
+        other_id = case([(rel.c.source_id == identities.c.id,
+                          rel.c.target_id)], else_=rel.c.source_id)
+        # UNION (instead of UNION ALL) stops at already visited identifiers
+        return identities.union(
+            select([identities.c.root, other_id])
+            .select_from(rel.join(identities, or_(
+                rel.c.source_id == identities.c.id,
+                rel.c.target_id == identities.c.id)))
+            .where(and_(rel.c.relation == Relation.IsIdenticalTo,
+                        rel.c.deleted.is_(False))))
+
+    @classmethod
+    def expand_identities(cls, identifier_ids) -> dict:
+        """Get the 'Identical' Identifiers of several identifiers at once.
+
+        Returns a mapping of each identifier ID to the fully-expanded list of
+        its 'Identical' identifiers, sorted by value, in a single query.
+        """
+        identifier_ids = set(identifier_ids)
+        if not identifier_ids:
+            return {}
+        identities = cls._identities_cte(identifier_ids)
+        rows = (
+            db.session.query(identities.c.root, cls)
+            .select_from(identities)
+            .join(cls, cls.id == identities.c.id)
+            .order_by(cls.value)
+        )
+        result = {}
+        for root, identifier in rows:
+            result.setdefault(root, []).append(identifier)
+        return result
 
     def get_parents(self, rel_type, as_relation=False):
         """Get all parents of given Identifier for given relation."""
@@ -231,7 +306,20 @@ class Event(db.Model, Timestamp):
     creator = Column(String)
     source = Column(String)
     payload = Column(JSONType)
+    #: Payload relationships as normalized when the event was accepted.
+    normalized_payload = Column(JSONType, nullable=True)
     time = Column(DateTime)
+    #: Ingestion status of the event.
+    status = Column(Enum(EventStatus), nullable=True,
+                    default=EventStatus.Received)
+    #: Time the event was received.
+    received = Column(DateTime, nullable=True)
+    #: Time the changes of the event were applied to the graph.
+    processed = Column(DateTime, nullable=True)
+    #: Time the changes of the event were searchable.
+    indexed = Column(DateTime, nullable=True)
+    #: Duration (in seconds) of each of the ingestion stages of the event.
+    timings = Column(JSONType, nullable=True)
 
     @classmethod
     def get(cls, id=None, **kwargs):
@@ -243,6 +331,26 @@ class Event(db.Model, Timestamp):
         return "<{self.id}: {self.time}>".format(self=self)
 
 
+class EventHash(db.Model):
+    """Canonical content hash of an accepted event."""
+
+    __tablename__ = 'eventhash'
+    __table_args__ = (
+        Index('ix_eventhash_event_id', 'event_id'),
+    )
+
+    hash = Column(String(64), primary_key=True)
+    # Not a foreign key, since the event is not stored for duplicates
+    event_id = Column(UUIDType, nullable=False)
+    accepted = Column(DateTime, nullable=False)
+    duplicates = Column(Integer, default=0, nullable=False)
+    last_duplicate = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        """String representation of the event hash."""
+        return "<{self.hash}: {self.event_id}>".format(self=self)
+
+
 class ObjectEvent(db.Model, Timestamp):
     """Event related to an Identifier or Relationship."""
 
@@ -357,6 +465,85 @@ class Identifier2Group(db.Model, Timestamp):
                              backref='id2groups')
 
 
+class GroupClosure(db.Model):
+    """Identity and Version groups of an identifier.
+
+    Denormalizes ``Identifier2Group`` and ``GroupM2M``, so that the members
+    of the Identity or Version group of an identifier are found with a single
+    indexed self-join. It is kept up to date when groups are created and
+    merged.
+    """
+
+    __tablename__ = 'groupclosure'
+    __table_args__ = (
+        Index('ix_groupclosure_identity_group_id', 'identity_group_id'),
+        Index('ix_groupclosure_version_group_id', 'version_group_id'),
+    )
+    identifier_id = Column(UUIDType, ForeignKey(Identifier.id,
+                                                ondelete='CASCADE',
+                                                onupdate='CASCADE'),
+                           primary_key=True)
+    identity_group_id = Column(UUIDType, ForeignKey(Group.id,
+                                                    ondelete='CASCADE',
+                                                    onupdate='CASCADE'),
+                               nullable=False)
+    version_group_id = Column(UUIDType, ForeignKey(Group.id,
+                                                   ondelete='CASCADE',
+                                                   onupdate='CASCADE'),
+                              nullable=False)
+
+    # DB relationships
+    identifier = orm_relationship(Identifier, foreign_keys=[identifier_id])
+    identity_group = orm_relationship(Group,
+                                      foreign_keys=[identity_group_id])
+    version_group = orm_relationship(Group, foreign_keys=[version_group_id])
+
+    @classmethod
+    def group_column(cls, group_type: GroupType) -> Column:
+        """Get the column of the group of a type."""
+        if group_type == GroupType.Identity:
+            return cls.identity_group_id
+        return cls.version_group_id
+
+    @classmethod
+    def get_members(cls, identifier_ids,
+                    group_type=GroupType.Identity) -> dict:
+        """Get the members of the groups of several identifiers at once.
+
+        Returns a mapping of each identifier ID to the identifiers of its
+        group, sorted by value. Identifiers without groups are their own only
+        member.
+        """
+        identifier_ids = set(identifier_ids)
+        if not identifier_ids:
+            return {}
+        root = Identifier.__table__.alias('root')
+        root_closure = cls.__table__.alias('root_closure')
+        member_closure = cls.__table__.alias('member_closure')
+        column = cls.group_column(group_type).key
+        rows = (
+            db.session.query(root.c.id, Identifier)
+            .select_from(root)
+            .outerjoin(root_closure,
+                       root_closure.c.identifier_id == root.c.id)
+            .outerjoin(member_closure,
+                       member_closure.c[column] == root_closure.c[column])
+            .join(Identifier, Identifier.id == func.coalesce(
+                member_closure.c.identifier_id, root.c.id))
+            .filter(root.c.id.in_(identifier_ids))
+            .order_by(Identifier.value)
+        )
+        result = {}
+        for root_id, identifier in rows:
+            result.setdefault(root_id, []).append(identifier)
+        return result
+
+    def __repr__(self):
+        """String representation of the model."""
+        return ('<{self.identifier_id}: {self.identity_group_id}, '
+                '{self.version_group_id}>'.format(self=self))
+
+
 class Relationship2GroupRelationship(db.Model, Timestamp):
     """Many-to-many model for Relationship to GroupRelationship."""
 
@@ -439,11 +626,6 @@ class GroupRelationshipM2M(db.Model, Timestamp):
                 .format(self=self))
 
 
-COMMON_SCHEMA_DEFINITIONS = SCHOLIX_SCHEMA['definitions']
-OBJECT_TYPE_SCHEMA = COMMON_SCHEMA_DEFINITIONS['ObjectType']
-OVERRIDABLE_KEYS = {'Type', 'Title', 'Creator', 'PublicationDate', 'Publisher'}
-
-
 class GroupMetadata(db.Model, Timestamp):
     """Metadata for a group."""
 
@@ -467,15 +649,7 @@ class GroupMetadata(db.Model, Timestamp):
     )
 
     # Identifier metadata
-    SCHEMA = {
-        '$schema': 'http://json-schema.org/draft-06/schema#',
-        'definitions': COMMON_SCHEMA_DEFINITIONS,
-        'additionalProperties': False,
-        'properties': {
-            k: v for k, v in OBJECT_TYPE_SCHEMA['properties'].items()
-            if k in OVERRIDABLE_KEYS
-        },
-    }
+    SCHEMA = GROUP_METADATA_SCHEMA
 
     def update(self, payload, validate=True):
         """Update the metadata of a group."""
@@ -484,7 +658,7 @@ class GroupMetadata(db.Model, Timestamp):
             if payload.get(k):
                 new_json[k] = payload[k]
         if validate:
-            jsonschema.validate(new_json, self.SCHEMA)
+            validate_schema('group-metadata', new_json)
         self.json = new_json
         flag_modified(self, 'json')
         return self
@@ -515,34 +689,40 @@ class GroupRelationshipMetadata(db.Model, Timestamp):
     )
 
     # Relationship metadata
-    SCHEMA = {
-        '$schema': 'http://json-schema.org/draft-06/schema#',
-        'definitions': COMMON_SCHEMA_DEFINITIONS,
-        'type': 'array',
-        'items': {
-            'type': 'object',
-            'additionalProperties': False,
-            'properties': {
-                'LinkPublicationDate': {'$ref': '#/definitions/DateType'},
-                'LinkProvider': {
-                    'type': 'array',
-                    'items': {'$ref': '#/definitions/PersonOrOrgType'}
-                },
-                'LicenseURL': {'type': 'string'},
-            },
-            'required': ['LinkPublicationDate', 'LinkProvider'],
-        }
-    }
+    SCHEMA = GROUP_RELATIONSHIP_METADATA_SCHEMA
 
     def update(self, payload, validate=True, multi=False):
         """Updates the metadata of a group relationship."""
-        new_json = deepcopy(self.json or [])
-        if multi:
-            new_json.extend(payload)
-        else:
-            new_json.append(payload)
+        new_items = payload if multi else [payload]
         if validate:
-            jsonschema.validate(new_json, self.SCHEMA)
+            # The existing history has already been validated
+            for item in new_items:
+                validate_schema('group-relationship-metadata-item', item)
+        new_json = deepcopy(self.json or [])
+        new_json.extend(new_items)
         self.json = new_json
         flag_modified(self, 'json')
         return self
+
+
+class IndexOutbox(db.Model):
+    """Object whose relationship documents have to be updated.
+
+    Entries are written in the same transaction as the changes to the groups
+    and are removed once the search index has been updated.
+    """
+
+    __tablename__ = 'indexoutbox'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Not a foreign key, since groups and relationships are deleted by merges
+    object_uuid = Column(UUIDType, nullable=False)
+    object_type = Column(Enum(IndexObjectType), nullable=False)
+    #: Event whose changes the entry was added for.
+    event_id = Column(UUIDType, nullable=True, index=True)
+    created = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        """String representation of the outbox entry."""
+        return "<{self.object_type.name}: {self.object_uuid}>".format(
+            self=self)
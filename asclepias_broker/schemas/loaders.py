@@ -115,10 +115,29 @@ class RelationshipSchema(Schema):
     def inverse(self, data):
         """Normalize the relationship direction based on its type."""
         if self._inversed:
-            data['Source'], data['Target'] = data['Target'], data['Source']
+            data['source'], data['target'] = data['target'], data['source']
         return data
 
 
+def normalize_relationship(payload: dict) -> dict:
+    """Validate a relationship payload and return its normalized form.
+
+    The normalized form holds the source and target identifiers as
+    ``[value, scheme]`` pairs and the broker's relation type, with the
+    direction of inverse relations (e.g. ``IsCitedBy``) already swapped.
+    """
+    schema = RelationshipSchema()
+    relationship, errors = schema.load(payload)
+    if errors:
+        raise ValidationError(errors)
+    return {
+        'Source': [relationship.source.value, relationship.source.scheme],
+        'Target': [relationship.target.value, relationship.target.scheme],
+        'RelationshipType': relationship.relation.name,
+        'Inverted': schema._inversed,
+    }
+
+
 @to_model(Event)
 class EventSchema(Schema):
     """Event loader schema."""
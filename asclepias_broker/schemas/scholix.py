@@ -6,7 +6,7 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 """Scholix marshmallow serializer."""
 
-from marshmallow import Schema, fields, pre_dump, validate
+from marshmallow import Schema, fields, post_dump, pre_dump, validate
 
 SCHOLIX_RELATIONS = {'References', 'IsReferencedBy', 'IsSupplementTo',
                      'IsSupplementedBy'}
@@ -20,6 +20,19 @@ class IdentifierSchema(Schema):
     IDURL = fields.String()
 
 
+class ObjectIdentifierSchema(IdentifierSchema):
+    """Scholix identifier schema for stored identifiers."""
+
+    IDURL = fields.String(attribute='url')
+
+    @post_dump
+    def remove_empty_url(self, data):
+        """Remove the URL of identifiers without one."""
+        if data.get('IDURL') is None:
+            data.pop('IDURL', None)
+        return data
+
+
 class PersonOrOrgSchema(Schema):
     """Scholix person or organization schema."""
 
@@ -36,7 +49,7 @@ class ObjectSchema(Schema):
         obj.Identifier = obj
         return obj
 
-    Identifier = fields.Nested(IdentifierSchema)
+    Identifier = fields.Nested(ObjectIdentifierSchema)
     Type = fields.String()  # TODO: required=True
     Title = fields.String()  # TODO: required=True
     Creator = fields.Nested(PersonOrOrgSchema, many=True)
@@ -6,10 +6,15 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 """Search utilities."""
 
+import base64
+import json
+
 from elasticsearch_dsl import Q
 from elasticsearch_dsl.query import Range
-from flask import request
+from elasticsearch_dsl.response import Response
+from flask import current_app, has_request_context, request
 from invenio_rest.errors import FieldError, RESTValidationError
+from invenio_search.api import RecordsSearch
 
 
 def search_factory(self, search, query_parser=None):
@@ -38,9 +43,38 @@ def search_factory(self, search, query_parser=None):
     if 'groupBy' not in request.values:
         search = search.filter(Q('term', Grouping='identity'))
         urlkwargs['groupBy'] = 'identity'
+
+    # Break ties by ID, so that the order of the results is stable
+    search = search.sort(*(search._sort or ['_score']), 'ID')
+    if 'cursor' in request.values:
+        search = search.extra(from_=0)
+        cursor = request.values['cursor']
+        if cursor:
+            search = search.extra(
+                search_after=decode_cursor(cursor, len(search._sort)))
+        urlkwargs['cursor'] = cursor
     return search, urlkwargs
 
 
+def encode_cursor(sort_values: list) -> str:
+    """Encode the sort values of a hit as an opaque cursor."""
+    content = json.dumps(sort_values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(content.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """Decode a cursor to the sort values to search after."""
+    try:
+        sort_values = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        sort_values = None
+    if not isinstance(sort_values, list) or len(sort_values) != length:
+        raise RESTValidationError(
+            errors=[FieldError('cursor', 'Invalid cursor.')])
+    return sort_values
+
+
 def enum_term_filter(label, field, choices):
     """Term filter with controlled vocabulary."""
     def inner(values):
@@ -76,3 +110,56 @@ def nested_range_filter(label, field, path=None, op=None):
                 errors=[FieldError(label, 'Multiple values specified.')])
         return Q('nested', path=path, query=Range(**{field: {op: values[0]}}))
     return inner
+
+
+def _target_group_ids() -> set:
+    """Get the Identity and Version groups of the searched identifiers."""
+    from .cache import current_groups_cache
+    from .models import GroupClosure, Identifier
+    values = request.values.getlist('id')
+    schemes = request.values.getlist('scheme')
+    group_ids, missing = set(), set()
+    for value in values:
+        for scheme in schemes:
+            entry = current_groups_cache.get(value, scheme)
+            if entry is None:
+                missing.add(value)
+            else:
+                group_ids.update(entry[1:])
+    if missing:
+        rows = (
+            GroupClosure.query
+            .join(Identifier, GroupClosure.identifier_id == Identifier.id)
+            .filter(Identifier.value.in_(missing),
+                    Identifier.scheme.in_(schemes))
+            .with_entities(GroupClosure.identity_group_id,
+                           GroupClosure.version_group_id)
+        )
+        group_ids.update(i for row in rows for i in row)
+    return group_ids
+
+
+class RelationshipsSearch(RecordsSearch):
+    """Relationships search, with results cached by their target groups.
+
+    With ``ASCLEPIAS_SEARCH_CACHE_ENABLED``, the results of a request are
+    cached by the search request and the groups of the searched identifiers
+    (see ``asclepias_broker.search_cache.SearchCache``).
+    """
+
+    def execute(self, ignore_cache=False):
+        """Execute the search, or get its cached result."""
+        if not current_app.config['ASCLEPIAS_SEARCH_CACHE_ENABLED'] or \
+                not has_request_context():
+            return super().execute(ignore_cache=ignore_cache)
+        if ignore_cache or not hasattr(self, '_response'):
+            from .search_cache import current_search_cache
+            search_request = {
+                'index': self._index, 'doc_type': self._doc_type,
+                'body': self.to_dict(), 'params': self._params}
+            result = current_search_cache.get_or_execute(
+                search_request, _target_group_ids(),
+                lambda: super(RelationshipsSearch, self).execute(
+                    ignore_cache=True).to_dict())
+            self._response = Response(self, result)
+        return self._response
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Relationships search results cache."""
+
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Iterable, List, Optional
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+
+class LocalSearchTier:
+    """In-process tier, keeping the results in an LRU."""
+
+    def __init__(self, maxsize: Optional[int]=None):
+        """Initialize the tier, keeping at most ``maxsize`` results."""
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self._generations = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        """Number of cached results."""
+        return len(self._results)
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a result, marking it as the most recently used."""
+        with self._lock:
+            value = self._results.get(key)
+            if value is not None:
+                self._results.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        """Add or replace a result, evicting the least recently used."""
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = value
+            while self.maxsize and len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def get_generations(self, group_ids: List[str]) -> List[float]:
+        """Get the generations of groups."""
+        with self._lock:
+            return [self._generations.get(g, 0) for g in group_ids]
+
+    def set_generations(self, group_ids: Iterable[str], generation: float):
+        """Set the generation of groups."""
+        with self._lock:
+            self._generations.update(dict.fromkeys(group_ids, generation))
+
+    def clear(self):
+        """Delete all results and generations."""
+        with self._lock:
+            self._results.clear()
+            self._generations.clear()
+
+
+class RedisSearchTier:
+    """Shared tier stored in Redis."""
+
+    def __init__(self, url: str, prefix: str='asclepias:search',
+                 ttl: Optional[int]=None):
+        """Initialize the tier from a Redis URL."""
+        from redis import StrictRedis
+        self.client = StrictRedis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key):
+        return '{}:result:{}'.format(self.prefix, key)
+
+    def _generation_key(self, group_id):
+        return '{}:gen:{}'.format(self.prefix, group_id)
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a result."""
+        return self.client.get(self._key(key))
+
+    def set(self, key: str, value: str):
+        """Add or replace a result."""
+        self.client.set(self._key(key), value, ex=self.ttl)
+
+    def get_generations(self, group_ids: List[str]) -> List[float]:
+        """Get the generations of groups."""
+        if not group_ids:
+            return []
+        values = self.client.mget(
+            [self._generation_key(g) for g in group_ids])
+        return [float(v) if v else 0 for v in values]
+
+    def set_generations(self, group_ids: Iterable[str], generation: float):
+        """Set the generation of groups."""
+        pipe = self.client.pipeline()
+        for group_id in group_ids:
+            pipe.set(self._generation_key(group_id), generation, ex=self.ttl)
+        pipe.execute()
+
+    def clear(self):
+        """Delete all results and generations."""
+        keys = list(self.client.scan_iter('{}:*'.format(self.prefix)))
+        if keys:
+            self.client.delete(*keys)
+
+
+class _Flight:
+    """Search in progress, awaited by identical concurrent searches."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SearchCache:
+    """Cache of the search results of the relationships of groups.
+
+    Results are keyed by the search request (i.e. the normalized query
+    arguments) and by the generations of the searched (target) groups. A
+    generation is the time the docs of a group were last indexed, so that
+    indexing makes the results of its group unreachable, in every process
+    sharing the tier, without having to find them.
+
+    Results are not cached while the docs of their groups may still be
+    refreshed, i.e. within ``settle`` seconds of their last indexing. Misses
+    of identical searches in the same process are coalesced into a single
+    search.
+    """
+
+    def __init__(self, tier, settle: float=2):
+        """Initialize the cache."""
+        self.tier = tier
+        self.settle = settle
+        self.stats = Counter()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(request: dict, group_ids: List[str],
+             generations: List[float]) -> str:
+        content = json.dumps([request, list(zip(group_ids, generations))],
+                             sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _coalesce(self, key: str, execute: Callable[[], dict]) -> tuple:
+        """Execute a search, or wait for the identical one in progress.
+
+        Returns the result and whether the search was executed.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self.stats['coalesced'] += 1
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+        try:
+            flight.result = execute()
+            return flight.result, True
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def get_or_execute(self, request: dict, group_ids: Iterable,
+                       execute: Callable[[], dict]) -> dict:
+        """Get the cached result of a search, or execute and cache it.
+
+        ``request`` is the (JSON-serializable) search request, and
+        ``group_ids`` are the groups whose docs are searched. Searches of
+        unknown groups are not cached.
+        """
+        start = time.time()
+        group_ids = sorted(set(map(str, group_ids)))
+        if not group_ids:
+            self.stats['uncached'] += 1
+            return execute()
+        generations = self.tier.get_generations(group_ids)
+        key = self._key(request, group_ids, generations)
+        value = self.tier.get(key)
+        if value is not None:
+            entry = json.loads(value)
+            self.stats['hits'] += 1
+            self.stats['saved_seconds'] += max(
+                entry['took'] - (time.time() - start), 0)
+            return entry['result']
+
+        result, executed = self._coalesce(key, execute)
+        if not executed:
+            return json.loads(json.dumps(result))
+        took = time.time() - start
+        self.stats['misses'] += 1
+        self.stats['miss_seconds'] += took
+        if start - max(generations) >= self.settle:
+            self.tier.set(key, json.dumps({'result': result, 'took': took}))
+        else:
+            self.stats['uncached'] += 1
+        return json.loads(json.dumps(result))
+
+    def invalidate_groups(self, group_ids: Iterable):
+        """Make the cached results of groups unreachable."""
+        group_ids = set(map(str, group_ids))
+        if group_ids:
+            self.stats['invalidations'] += len(group_ids)
+            self.tier.set_generations(group_ids, time.time())
+
+    def clear(self):
+        """Drop all results."""
+        self.tier.clear()
+
+    def get_stats(self) -> dict:
+        """Get the hit/miss counters, hit ratio and saved search time.
+
+        Coalesced misses are not counted as hits, while ``misses`` are the
+        searches actually executed.
+        """
+        stats = dict.fromkeys(
+            ('hits', 'misses', 'coalesced', 'uncached', 'invalidations',
+             'saved_seconds', 'miss_seconds'), 0)
+        stats.update(self.stats)
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else None
+        stats['avg_miss_seconds'] = \
+            stats['miss_seconds'] / stats['misses'] if stats['misses'] \
+            else None
+        if isinstance(self.tier, LocalSearchTier):
+            stats['local_size'] = len(self.tier)
+        return stats
+
+
+def create_search_cache(app) -> SearchCache:
+    """Create the search cache from the application's configuration.
+
+    A Redis URL of ``memory://`` (or ``None``) uses an in-process tier,
+    which is only invalidated by the indexing done in the same process (e.g.
+    for tests).
+    """
+    config = app.config
+    url = config.get('ASCLEPIAS_SEARCH_CACHE_REDIS_URL')
+    if url == 'memory://' or not url:
+        tier = LocalSearchTier(config['ASCLEPIAS_SEARCH_CACHE_SIZE'])
+    else:
+        tier = RedisSearchTier(
+            url, prefix=config['ASCLEPIAS_SEARCH_CACHE_PREFIX'],
+            ttl=config['ASCLEPIAS_SEARCH_CACHE_TTL'])
+    return SearchCache(tier, settle=config['ASCLEPIAS_SEARCH_CACHE_SETTLE'])
+
+
+def _get_search_cache() -> SearchCache:
+    cache = current_app.extensions.get('asclepias-search-cache')
+    if cache is None:
+        cache = create_search_cache(current_app)
+        current_app.extensions['asclepias-search-cache'] = cache
+    return cache
+
+
+#: Search results cache of the current application.
+current_search_cache = LocalProxy(_get_search_cache)
+
+
+def invalidate_search_results(group_ids: Iterable):
+    """Invalidate the cached search results of groups, if enabled."""
+    if current_app.config['ASCLEPIAS_SEARCH_CACHE_ENABLED']:
+        current_search_cache.invalidate_groups(group_ids)
+
+
+def clear_search_results():
+    """Drop all the cached search results, if enabled."""
+    if current_app.config['ASCLEPIAS_SEARCH_CACHE_ENABLED']:
+        current_search_cache.clear()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Search results serializers."""
+
+from flask import current_app, request, url_for
+from invenio_records_rest.schemas import RecordSchemaJSONV1
+from invenio_records_rest.serializers.json import JSONSerializer
+from invenio_records_rest.serializers.response import search_responsify
+
+from .indexer import join_group_metadata
+from .search import encode_cursor
+
+
+class RelationshipsJSONSerializer(JSONSerializer):
+    """JSON serializer of relationship docs.
+
+    With ``ASCLEPIAS_INDEXER_SPLIT_GROUPS``, the lean docs of the search
+    results are joined with the metadata of their groups. With a ``cursor``
+    query argument, the ``next`` link pages with ``search_after`` instead of
+    ``page``.
+    """
+
+    def serialize_search(self, pid_fetcher, search_result, **kwargs):
+        """Serialize a search result."""
+        if current_app.config['ASCLEPIAS_INDEXER_SPLIT_GROUPS']:
+            join_group_metadata(
+                [hit['_source'] for hit in search_result['hits']['hits']])
+        if 'cursor' in request.values:
+            kwargs['links'] = self._cursor_links(
+                search_result, kwargs.get('links') or {})
+        return super().serialize_search(pid_fetcher, search_result, **kwargs)
+
+    @staticmethod
+    def _cursor_links(search_result, links):
+        """Replace the page links with a link to the next cursor."""
+        links = {k: v for k, v in links.items() if k not in ('prev', 'next')}
+        hits = search_result['hits']['hits']
+        size = request.values.get('size', 10, type=int)
+        if hits and len(hits) >= size:
+            args = request.args.to_dict(flat=False)
+            args.pop('page', None)
+            args['cursor'] = encode_cursor(hits[-1]['sort'])
+            links['next'] = url_for(
+                request.endpoint, _external=True, **args)
+        return links
+
+
+json_v1 = RelationshipsJSONSerializer(RecordSchemaJSONV1)
+"""JSON v1 serializer."""
+
+json_v1_search = search_responsify(json_v1, 'application/json')
+"""JSON search response builder that uses the JSON v1 serializer."""
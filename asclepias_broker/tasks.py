@@ -7,20 +7,32 @@
 
 """Asynchronous tasks."""
 
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from celery import current_app as current_celery_app
 from celery import shared_task
+from flask import current_app
 from invenio_db import db
-from marshmallow.exceptions import \
-    ValidationError as MarshmallowValidationError
+from kombu import Producer
+from kombu.compat import Consumer
 
-from .api.ingestion import update_groups, update_metadata
-from .indexer import update_indices
-from .models import Event, ObjectEvent, PayloadType
-from .schemas.loaders import RelationshipSchema
+from .api.deduplication import claim_event_hashes, event_content_hash
+from .api.ingestion import resolve_relationship_keys, update_groups, \
+    update_metadata
+from .api.metrics import StageTimer, mark_processed
+from .api.outbox import INDEXING_LOCK, add_dirty_group_metadata, \
+    add_dirty_group_relationships, add_dirty_groups, drain_outbox
+from .models import Event, EventStatus, ObjectEvent, PayloadType, Relation
+from .schemas.loaders import normalize_relationship
+from .utils import advisory_lock
 
 
 def get_or_create(model, **kwargs):
     """Get or a create a database model."""
-    instance = model.query.filter_by(**kwargs)
+    instance = model.query.filter_by(**kwargs).one_or_none()
     if instance:
         return instance
     else:
@@ -55,37 +67,266 @@ def create_relation_object_events(event, relationship, payload_idx):
     return rel_obj, src_obj, tar_obj
 
 
+def _normalized_payloads(event: Event) -> list:
+    """Get the normalized form of an event's relationships.
+
+    Events accepted before the normalized form was stored with them are
+    validated again.
+    """
+    if event.normalized_payload is not None:
+        return event.normalized_payload
+    return [normalize_relationship(p) for p in event.payload['Payload']]
+
+
+def _process_event(event: Event, delete=False, timer: StageTimer=None):
+    """Apply an event's payloads to the graph in the current transaction.
+
+    The groups touched by each of the event's payloads are added to the
+    indexing outbox. Unless groups were merged, only the relationship and
+    the metadata of the groups that changed are added, so that the other
+    documents of the groups are patched instead of rebuilt. The durations of
+    the processing stages are measured with ``timer`` and stored with the
+    event, which is marked as processed.
+    """
+    timer = timer or StageTimer(event.timings)
+    start = datetime.utcnow()
+    if event.received:
+        timer.timings['queue'] = max(
+            (start - event.received).total_seconds() -
+            timer.timings.get('intake', 0), 0)
+    with timer.stage('load'):
+        # TODO: event.payload contains the whole event, not just payload -
+        # refactor
+        payloads = event.payload['Payload']
+        normalized = _normalized_payloads(event)
+        # We need ORM relationship with IDs, since Event has
+        # 'weak' (non-FK) relations to the objects, hence we need
+        # to know the ID upfront
+        relationships = resolve_relationship_keys([
+            (tuple(n['Source']), tuple(n['Target']),
+             Relation[n['RelationshipType']])
+            for n in normalized])
+
+    for payload_idx, (payload, norm, relationship) in enumerate(
+            zip(payloads, normalized, relationships)):
+        relationship.deleted = delete
+        create_relation_object_events(event, relationship, payload_idx)
+
+        with timer.stage('update_groups'):
+            id_groups, version_groups = update_groups(relationship)
+
+        if norm['Inverted']:
+            # Keep the objects' metadata with their (swapped) identifiers
+            payload = dict(payload, Source=payload['Target'],
+                           Target=payload['Source'])
+        with timer.stage('update_metadata'):
+            changed_groups, changed_relationships = update_metadata(
+                relationship, payload)
+        if id_groups[2] or version_groups[2]:
+            add_dirty_groups(id_groups + version_groups, event_id=event.id)
+        else:
+            add_dirty_group_relationships(
+                (r.id for r in changed_relationships), event_id=event.id)
+            add_dirty_group_metadata(changed_groups, event_id=event.id)
+    event.status = EventStatus.Processed
+    event.processed = datetime.utcnow()
+    event.timings = timer.timings
+
+
+def _is_duplicate_event(event: Event) -> bool:
+    """Check if the event's content was already accepted by another event.
+
+    Duplicates usually stop at the intake, but this also covers events which
+    were accepted concurrently, or before their content hashes were stored.
+    """
+    if not current_app.config['ASCLEPIAS_EVENTS_DEDUP']:
+        return False
+    claim = (event_content_hash(event.payload), event.id)
+    return bool(claim_event_hashes([claim], keep_owner=True))
+
+
+def _index_now():
+    """Drain the indexing outbox right away, unless indexing is deferred."""
+    if not current_app.config['ASCLEPIAS_INDEXER_DEFERRED']:
+        index_dirty_groups()
+
+
+@shared_task
+def index_dirty_groups(max_entries: int=None) -> dict:
+    """Update the search index from the indexing outbox.
+
+    Batches of up to ``max_entries`` entries are drained until the outbox is
+    empty, or until a batch only has entries that failed again. The groups
+    of each batch are coalesced, so that a group touched by many events
+    since the last run is reindexed once. Nothing is done if the outbox is
+    already being drained (or the index rebuilt) by another process.
+    """
+    max_entries = max_entries or \
+        current_app.config['ASCLEPIAS_INDEXER_OUTBOX_BATCH_SIZE']
+    report = Counter()
+    with advisory_lock(INDEXING_LOCK) as locked:
+        while locked:
+            batch_report = drain_outbox(max_entries)
+            report.update(batch_report)
+            if batch_report['entries'] == batch_report['retried']:
+                break
+    return dict(report)
+
+
 @shared_task(ignore_result=True)
 def process_event(event_uuid: str, delete=False):
-    """Process an event's payloads."""
-    # TODO: Should we detect and skip duplicated events?
+    """Process an event's payloads, unless it is a duplicate.
+
+    Duplicate events are marked as such and are not processed.
+    """
     event = Event.get(event_uuid)
-    # TODO: event.payload contains the whole event, not just payload - refactor
-    groups_ids = []
+    if _is_duplicate_event(event):
+        event.status = EventStatus.Duplicate
+        db.session.commit()
+        return
+    timer = StageTimer(event.timings)
     with db.session.begin_nested():
-        for payload_idx, payload in enumerate(event.payload['Payload']):
-            # TODO: marshmallow validation of all payloads
-            # should be done on first event ingestion (check)
-            relationship, errors = \
-                RelationshipSchema(check_existing=True).load(payload)
-            # Errors should never happen as the payload is validated
-            # with RelationshipSchema on the event ingestion
-            if errors:
-                raise MarshmallowValidationError(errors)
-            if relationship.id:
-                relationship.deleted = delete
-            db.session.add(relationship)
-            # We need ORM relationship with IDs, since Event has
-            # 'weak' (non-FK) relations to the objects, hence we need
-            # to know the ID upfront
-            relationship = relationship.fetch_or_create_id()
-            create_relation_object_events(event, relationship, payload_idx)
+        _process_event(event, delete=delete, timer=timer)
+    with timer.stage('commit'):
+        db.session.commit()
+    mark_processed({event.id: timer.timings})
+    _index_now()
 
-            id_groups, version_groups = update_groups(relationship)
 
-            update_metadata(relationship, payload)
-            groups_ids.append(
-                [str(g.id) if g else g for g in id_groups + version_groups])
+@shared_task
+def process_events(event_uuids: list) -> dict:
+    """Process a batch of events in a single transaction.
+
+    Each event is applied inside its own savepoint, so that a failing event
+    is rolled back and reported without affecting the rest of the batch.
+    Duplicate events are skipped and marked as such. The touched groups are
+    added to the indexing outbox. The commit time of the batch is stored
+    with each of its events, and failing events are marked as failed.
+    """
+    report = {'succeeded': [], 'skipped': [], 'failed': {}}
+    timers = {}
+    for event_uuid in event_uuids:
+        try:
+            with db.session.begin_nested():
+                event = Event.get(event_uuid)
+                if event is None:
+                    raise ValueError('Event does not exist.')
+                if _is_duplicate_event(event):
+                    event.status = EventStatus.Duplicate
+                    report['skipped'].append(event_uuid)
+                    continue
+                timer = StageTimer(event.timings)
+                _process_event(event, timer=timer)
+        except Exception as e:
+            current_app.logger.exception(
+                'Failed to process event {}'.format(event_uuid))
+            report['failed'][event_uuid] = str(e)
+        else:
+            report['succeeded'].append(event_uuid)
+            timers[event.id] = timer
+    start = time.monotonic()
     db.session.commit()
-    for ids in groups_ids:
-        update_indices(*ids)
+    commit_time = time.monotonic() - start
+    for timer in timers.values():
+        timer.timings['commit'] = commit_time
+    mark_processed({id_: t.timings for id_, t in timers.items()},
+                   failed=report['failed'])
+    _index_now()
+    return report
+
+
+@contextmanager
+def _events_queue_connection():
+    """Acquire a broker connection for the events queue."""
+    with current_celery_app.pool.acquire(block=True) as conn:
+        yield conn
+
+
+#: Name of the lock taken while draining the events queue.
+EVENTS_QUEUE_LOCK = 'asclepias-events-queue'
+
+
+def queue_events(event_uuids: list):
+    """Send events to the queue drained by ``process_events_queue``."""
+    queue = current_app.config['ASCLEPIAS_EVENTS_MQ_QUEUE']
+    with _events_queue_connection() as conn:
+        producer = Producer(
+            conn,
+            exchange=queue.exchange,
+            routing_key=queue.routing_key,
+            auto_declare=True,
+        )
+        for event_uuid in event_uuids:
+            producer.publish({'id': str(event_uuid)})
+
+
+def _fetch_events_batch(consumer, max_events: int, max_wait: float) -> list:
+    """Fetch up to ``max_events`` messages, waiting at most ``max_wait``."""
+    messages = []
+    deadline = time.monotonic() + max_wait
+    while len(messages) < max_events:
+        message = consumer.fetch()
+        if message is not None:
+            messages.append(message)
+        elif time.monotonic() < deadline:
+            time.sleep(min(0.05, max_wait))
+        else:
+            break
+    return messages
+
+
+@shared_task
+def process_events_queue(max_events: int=None, max_wait: int=None) -> dict:
+    """Drain the events queue in micro-batches.
+
+    Each batch holds up to ``max_events`` events, or whatever arrived within
+    ``max_wait`` milliseconds, and is processed with ``process_events`` in a
+    single transaction. Batches are fetched for at most
+    ``ASCLEPIAS_EVENTS_QUEUE_RUN_TIME`` seconds, and only one run drains the
+    queue at a time, so that the other runs return right away. Messages are
+    acknowledged once their batch has been committed, while the messages of
+    the events that failed are rejected (and dead-lettered, if the queue has
+    a dead letter exchange). Nothing is done unless the batch mode is
+    enabled.
+    """
+    config = current_app.config
+    report = {'succeeded': [], 'skipped': [], 'failed': {}}
+    if not config['ASCLEPIAS_EVENTS_BATCH_MODE']:
+        return report
+    max_events = max_events or config['ASCLEPIAS_EVENTS_BATCH_SIZE']
+    max_wait = (max_wait or config['ASCLEPIAS_EVENTS_BATCH_WAIT']) / 1000.0
+    deadline = time.monotonic() + config['ASCLEPIAS_EVENTS_QUEUE_RUN_TIME']
+    queue = config['ASCLEPIAS_EVENTS_MQ_QUEUE']
+    with advisory_lock(EVENTS_QUEUE_LOCK) as locked:
+        if not locked:
+            return report
+        with _events_queue_connection() as conn:
+            consumer = Consumer(
+                connection=conn,
+                queue=queue.name,
+                exchange=queue.exchange.name,
+                routing_key=queue.routing_key,
+            )
+            try:
+                while time.monotonic() < deadline:
+                    messages = _fetch_events_batch(
+                        consumer, max_events, max_wait)
+                    if not messages:
+                        break
+                    batch_report = process_events(
+                        [m.payload['id'] for m in messages])
+                    for message in messages:
+                        if message.payload['id'] in batch_report['failed']:
+                            message.reject()
+                        else:
+                            message.ack()
+                    report['succeeded'].extend(batch_report['succeeded'])
+                    report['skipped'].extend(batch_report['skipped'])
+                    report['failed'].update(batch_report['failed'])
+            finally:
+                consumer.close()
+    if report['failed']:
+        current_app.logger.warning(
+            'Failed to process {} events: {}'.format(
+                len(report['failed']), sorted(report['failed'])))
+    return report
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Utility functions."""
+
+import hashlib
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Optional
+
+import idutils
+import sqlalchemy as sa
+from invenio_db import db
+from sqlalchemy.dialects import postgresql
+
+
+def insert_ignore(table):
+    """Build an INSERT statement that skips rows violating a constraint.
+
+    Renders ``INSERT ... ON CONFLICT DO NOTHING`` on PostgreSQL and
+    ``INSERT OR IGNORE`` on SQLite.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with('OR IGNORE')
+
+
+@contextmanager
+def advisory_lock(name: str, wait: bool=False):
+    """Take a named lock, shared by all the processes of the database.
+
+    Yields whether the lock was taken, without waiting for it unless
+    ``wait`` is set. On
+    PostgreSQL this is a session-level advisory lock, held by a dedicated
+    connection, so that it is kept across the commits of the session. Other
+    databases are assumed to be used by a single process, and the lock is
+    always taken.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        yield True
+        return
+    # Advisory locks are keyed by a signed 64-bit integer
+    key = int(hashlib.sha1(name.encode('utf-8')).hexdigest()[:15], 16)
+    with db.engine.connect() as conn:
+        if wait:
+            conn.execute(sa.select([sa.func.pg_advisory_lock(key)]))
+            locked = True
+        else:
+            locked = conn.execute(
+                sa.select([sa.func.pg_try_advisory_lock(key)])).scalar()
+        try:
+            yield locked
+        finally:
+            if locked:
+                conn.execute(sa.select([sa.func.pg_advisory_unlock(key)]))
+
+
+@lru_cache(maxsize=100000)
+def identifier_url(value: str, scheme: str) -> Optional[str]:
+    """Get the canonical URL of an identifier, if it has one.
+
+    Results are cached, for the identifiers without a stored URL.
+    """
+    try:
+        return idutils.to_url(value, scheme) or None
+    except Exception:
+        return None
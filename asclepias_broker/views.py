@@ -6,7 +6,12 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 """Views for receiving and querying events and relationships."""
 
-from flask import Blueprint, abort, render_template, request
+import gzip
+import uuid
+import zlib
+
+from flask import Blueprint, Response, abort, current_app, jsonify, \
+    render_template, request, stream_with_context
 from flask.views import MethodView
 from invenio_rest.errors import RESTException
 from jsonschema.exceptions import ValidationError as JSONValidationError
@@ -15,8 +20,10 @@ from marshmallow.exceptions import \
 
 from asclepias_broker.api import EventAPI, RelationshipAPI
 
+from .api.metrics import get_metrics
+from .api.relationships import next_cursor
 from .errors import PayloadValidationRESTError
-from .models import Identifier
+from .models import Event, Identifier
 
 blueprint = Blueprint('asclepias_ui', __name__, template_folder='templates')
 
@@ -55,13 +62,50 @@ def relationships():
     scheme = request.values['scheme']
     relation = request.values['relation']
 
+    config = current_app.config
+    size = request.values.get('size', type=int) or \
+        config['ASCLEPIAS_RELATIONSHIPS_PAGE_SIZE']
+    size = max(min(size, config['ASCLEPIAS_RELATIONSHIPS_MAX_PAGE_SIZE']), 1)
+
     identifier = Identifier.query.filter_by(scheme=scheme, value=id_).first()
     if not identifier:
         return abort(404)
+    elif 'stream' in request.values:
+        citations = RelationshipAPI.iter_citations2(
+            identifier, relation, page_size=size)
+        return Response(stream_with_context(_stream_template(
+            'gcitations.html', target=identifier, citations=citations)))
     else:
-        citations = RelationshipAPI.get_citations2(identifier, relation)
+        citations = RelationshipAPI.get_citations2(
+            identifier, relation, after=_parse_cursor(request.values),
+            size=size)
+        next_after = None
+        if sum(len(rows) for _, rows in citations) == size:
+            next_after = '{}:{}'.format(*next_cursor(citations[-1][1]))
         return render_template(
-            'gcitations.html', target=identifier, citations=citations)
+            'gcitations.html', target=identifier, citations=citations,
+            next_after=next_after, size=size)
+
+
+def _parse_cursor(values):
+    """Parse the ``after`` cursor of a page, i.e. ``<group>:<identifier>``."""
+    cursor = values.get('after')
+    if not cursor:
+        return None
+    parts = cursor.split(':')
+    if len(parts) != 2:
+        abort(400)
+    try:
+        return tuple(uuid.UUID(i) for i in parts)
+    except ValueError:
+        abort(400)
+
+
+def _stream_template(template_name, **context):
+    """Render a template as a stream of chunks."""
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    return template.generate(context)
 
 
 #
@@ -74,21 +118,95 @@ class EventResource(MethodView):
     """Event resource."""
 
     def post(self):
-        """Submit an event."""
+        """Submit an event.
+
+        Events with the same content as an already accepted event are not
+        processed again, and are reported as duplicates.
+        """
         try:
-            EventAPI.handle_event(request.json)
+            accepted = EventAPI.handle_event(request.json)
         except JSONValidationError as e:
             raise PayloadValidationRESTError(e.message, code=422)
         except MarshmallowValidationError as e:
             msg = "Validation error: " + str(e.messages)
             raise PayloadValidationRESTError(msg, code=422)
+        if not accepted:
+            return "Duplicate", 200
         return "Accepted", 202
 
 
+#: Errors raised by an invalid gzip stream (``gzip.BadGzipFile`` is an
+#: ``OSError`` before Python 3.8).
+GZIP_ERRORS = (EOFError, zlib.error, getattr(gzip, 'BadGzipFile', OSError))
+
+
+class BulkEventResource(MethodView):
+    """Bulk event resource."""
+
+    def post(self):
+        """Submit newline-delimited events, optionally gzip-compressed.
+
+        If the gzip stream turns out to be invalid, the events read until
+        then are still accepted, and their report is returned with the
+        error.
+        """
+        stream = request.stream
+        errors = []
+        if request.content_encoding == 'gzip' or \
+                request.mimetype == 'application/gzip':
+            stream = self._gzip_lines(stream, errors)
+        report = EventAPI.handle_events_stream(stream)
+        if errors:
+            report['error'] = 'Invalid gzip stream: ' + errors[0]
+            return jsonify(report), 400
+        return jsonify(report), 202
+
+    @staticmethod
+    def _gzip_lines(stream, errors: list):
+        """Decompress the lines of a stream, stopping at the first error."""
+        try:
+            yield from gzip.GzipFile(fileobj=stream, mode='rb')
+        except GZIP_ERRORS as e:
+            errors.append(str(e))
+
+
+class EventStatusResource(MethodView):
+    """Event status resource."""
+
+    def get(self, event_id):
+        """Get the ingestion status and timings of an event."""
+        event = Event.get(event_id)
+        if event is None:
+            abort(404)
+        return jsonify({
+            'id': str(event.id),
+            'status': event.status.name if event.status else None,
+            'received': event.received and event.received.isoformat(),
+            'processed': event.processed and event.processed.isoformat(),
+            'indexed': event.indexed and event.indexed.isoformat(),
+            'timings': event.timings or {},
+        })
+
+
+class MetricsResource(MethodView):
+    """Ingestion metrics resource."""
+
+    def get(self):
+        """Get the ingestion latency histograms and counters."""
+        return jsonify(get_metrics())
+
+
 #
 # Blueprint definition
 #
 
 event_view = EventResource.as_view('event')
+bulk_event_view = BulkEventResource.as_view('event_bulk')
+event_status_view = EventStatusResource.as_view('event_status')
+metrics_view = MetricsResource.as_view('metrics')
 
 api_blueprint.add_url_rule('/event', view_func=event_view)
+api_blueprint.add_url_rule('/event/bulk', view_func=bulk_event_view)
+api_blueprint.add_url_rule('/event/<uuid:event_id>',
+                           view_func=event_status_view)
+api_blueprint.add_url_rule('/metrics', view_func=metrics_view)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Benchmark the citations query of the ``/citations/<pid>`` view.
+
+Compares the breadth-first expansion of identities (one query per identifier
+and layer) with the groups closure lookups of ``RelationshipAPI``, for graphs
+of increasing size. Each graph has a cited identifier with an identical
+identifier, a parent version with siblings, and citing identifiers which are
+themselves identical to a chain of other identifiers:
+
+.. code-block:: console
+
+    $ python examples/benchmark_citations.py --citations 10 100 1000
+
+The tables are created in the (scratch) database and dropped afterwards.
+"""
+
+import argparse
+import time
+from itertools import groupby
+
+import sqlalchemy as sa
+from invenio_app.factory import create_api
+from invenio_db import db
+
+from asclepias_broker.api import RelationshipAPI
+from asclepias_broker.api.ingestion import update_groups
+from asclepias_broker.models import Identifier, Relation, Relationship
+
+
+def bfs_get_identities(identifier):
+    """Expand the identities of an identifier breadth-first."""
+    ids = next_ids = set([identifier])
+    while next_ids:
+        grp = set(sum([item._get_identities() for item in next_ids], []))
+        next_ids = grp - ids
+        ids |= grp
+    return list(ids)
+
+
+def bfs_get_citations(identifier):
+    """Get the citations of an identifier with breadth-first expansion."""
+    frontier = bfs_get_identities(identifier)
+    parents_rel = set(sum([iden.get_parents(Relation.HasVersion,
+                                            as_relation=True)
+                           for iden in frontier], []))
+    iden_parents = set(sum([bfs_get_identities(p.source)
+                            for p in parents_rel], []))
+    frontier += iden_parents
+    children_rel = set(sum([p.get_children(Relation.HasVersion,
+                                           as_relation=True)
+                            for p in iden_parents], []))
+    frontier += set(sum([bfs_get_identities(c.target)
+                         for c in children_rel], []))
+    citations = set(sum([iden.get_parents(Relation.Cites, as_relation=True)
+                         for iden in set(frontier)], []))
+    expanded_sources = [bfs_get_identities(c.source) for c in citations]
+    zipped = sorted(zip(expanded_sources, citations),
+                    key=lambda x: sorted(xi.value for xi in x[0]))
+    return [(k, list(v)) for k, v in groupby(zipped, key=lambda x: x[0])]
+
+
+def closure_get_citations(identifier):
+    """Get the citations of an identifier from the groups closure."""
+    return RelationshipAPI.get_citations(
+        identifier, with_parents=True, with_siblings=True)
+
+
+def create_graph(name, citations, versions, identities):
+    """Create the identifiers and relationships of a graph."""
+    def _id(value):
+        obj = Identifier(value='{}/{}'.format(name, value), scheme='doi')
+        db.session.add(obj)
+        return obj
+
+    relationships = []
+
+    def _rel(source, relation, target):
+        relationships.append(Relationship(
+            source=source, target=target, relation=relation, deleted=False))
+        db.session.add(relationships[-1])
+
+    cited = _id('cited')
+    _rel(_id('cited-identical'), Relation.IsIdenticalTo, cited)
+    parent = _id('parent')
+    _rel(parent, Relation.HasVersion, cited)
+    for i in range(versions):
+        _rel(parent, Relation.HasVersion, _id('version-{}'.format(i)))
+    for i in range(citations):
+        previous = source = _id('citing-{}'.format(i))
+        _rel(source, Relation.Cites, cited)
+        for j in range(identities):
+            identical = _id('citing-{}-{}'.format(i, j))
+            _rel(previous, Relation.IsIdenticalTo, identical)
+            previous = identical
+    db.session.flush()
+    for relationship in relationships:
+        update_groups(relationship)
+    db.session.commit()
+    return cited.id
+
+
+def measure(func, identifier_id, repeat):
+    """Measure the number of queries and the best time of a function."""
+    statements = []
+
+    def _count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        identifier = Identifier.query.get(identifier_id)
+        del statements[:]
+        sa.event.listen(db.engine, 'before_cursor_execute', _count)
+        try:
+            start = time.time()
+            func(identifier)
+            elapsed = time.time() - start
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', _count)
+        best = elapsed if best is None else min(best, elapsed)
+    return len(statements), best
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database', default='sqlite://',
+                        help='SQLAlchemy URL of a scratch database.')
+    parser.add_argument('--citations', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--versions', type=int, default=10)
+    parser.add_argument('--identities', type=int, default=3,
+                        help='Length of the identity chain of each citing '
+                             'identifier.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = create_api(SQLALCHEMY_DATABASE_URI=args.database)
+    with app.app_context():
+        db.create_all()
+        try:
+            print('{:>10}{:>16}{:>12}{:>20}{:>16}'.format(
+                'citations', 'BFS queries', 'BFS ms', 'Closure queries',
+                'Closure ms'))
+            for citations in args.citations:
+                identifier_id = create_graph(
+                    'graph-{}'.format(citations), citations, args.versions,
+                    args.identities)
+                bfs = measure(bfs_get_citations, identifier_id, args.repeat)
+                closure = measure(closure_get_citations, identifier_id,
+                                  args.repeat)
+                print('{:>10}{:>16}{:>12.1f}{:>20}{:>16.1f}'.format(
+                    citations, bfs[0], bfs[1] * 1000, closure[0],
+                    closure[1] * 1000))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
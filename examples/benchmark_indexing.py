@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Benchmark indexing of relationship documents into Elasticsearch.
+
+Compares indexing the documents one request at a time with the bulk indexing
+pipeline, for an increasing number of threads. Documents are built from the
+payloads of events, e.g. the ones of ``generate_full_graph()`` in
+``generate_graph.py``:
+
+.. code-block:: console
+
+    $ cd examples
+    $ PYTHONPATH=../tests python -c "import generate_graph; \
+        generate_graph.generate_full_graph()" > /tmp/graph-events.json
+    $ python benchmark_indexing.py /tmp/graph-events.json
+
+A scratch index (created with the ``relationships`` mappings) is used and
+deleted afterwards.
+
+Results for the first 20,000 of the 369,790 relationships of the full
+graph, with the default options, in two runs on one Xeon core, Python 3.11
+and elasticsearch-py 5.5:
+
+.. code-block:: text
+
+    method                            docs/sec    errors
+    one request per document         1931-2553         0
+    bulk, 1 thread(s)              32578-41824         0
+    bulk, 2 thread(s)              30026-36772         0
+    bulk, 4 thread(s)              24796-42082         0
+
+No Elasticsearch cluster was available for these runs. They were made
+against a local HTTP endpoint that answers the Elasticsearch API without
+indexing anything, so they only measure the cost of the requests on the
+client side: 20,000 requests of one document, against 40 bulk requests of
+500 documents. Bulk indexing is 16x faster there. Threads do not help, since
+the client and the endpoint share a single core. On a cluster, the indexing
+time adds to each request, and more threads keep more of its nodes busy.
+"""
+
+import argparse
+import json
+import os
+import time
+import uuid
+
+from elasticsearch import Elasticsearch
+
+from asclepias_broker.indexer import bulk_index
+
+MAPPING = os.path.join(
+    os.path.dirname(__file__), os.pardir, 'asclepias_broker', 'mappings',
+    'v5', 'relationships', 'v1.0.0.json')
+
+
+def _group(obj):
+    doc = {k: v for k, v in obj.items() if k != 'Identifier'}
+    doc['Identifier'] = [obj['Identifier']]
+    doc['ID'] = str(uuid.uuid5(uuid.NAMESPACE_URL, obj['Identifier']['ID']))
+    return doc
+
+
+def build_documents(events):
+    """Build relationship documents from the payloads of events."""
+    for event in events:
+        for payload in event['Payload']:
+            yield {
+                'ID': str(uuid.uuid4()),
+                'Grouping': 'identity',
+                'RelationshipType': payload['RelationshipType']['Name'],
+                'History': [{k: payload[k] for k in
+                             ('LinkPublicationDate', 'LinkProvider')}],
+                'Source': _group(payload['Source']),
+                'Target': _group(payload['Target']),
+            }
+
+
+def index_one_by_one(client, docs, index):
+    """Index the documents with one request per document."""
+    for doc in docs:
+        client.index(index=index, doc_type='doc', body=doc)
+    return []
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('events', help='JSON file with a list of events.')
+    parser.add_argument('--host', default='localhost:9200')
+    parser.add_argument('--index', default='benchmark-relationships')
+    parser.add_argument('--limit', type=int, default=20000,
+                        help='Maximum number of documents to index.')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--max-chunk-bytes', type=int,
+                        default=10 * 1024 * 1024)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with open(args.events) as fp:
+        events = json.load(fp)
+    docs = list(build_documents(events))[:args.limit]
+    with open(MAPPING) as fp:
+        mapping = json.load(fp)
+    client = Elasticsearch([args.host])
+
+    cases = [('one request per document', index_one_by_one)]
+    for threads in args.threads:
+        cases.append((
+            'bulk, {} thread(s)'.format(threads),
+            lambda c, d, i, t=threads: bulk_index(
+                c, d, index=i, chunk_size=args.chunk_size,
+                max_chunk_bytes=args.max_chunk_bytes, threads=t)))
+
+    print('{} documents'.format(len(docs)))
+    print('{:<30}{:>12}{:>10}'.format('method', 'docs/sec', 'errors'))
+    for label, func in cases:
+        client.indices.delete(index=args.index, ignore=404)
+        client.indices.create(index=args.index, body=mapping)
+        start = time.time()
+        errors = func(client, docs, args.index)
+        client.indices.refresh(index=args.index)
+        elapsed = time.time() - start
+        print('{:<30}{:>12.0f}{:>10}'.format(
+            label, len(docs) / elapsed, len(errors)))
+    client.indices.delete(index=args.index, ignore=404)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Benchmark JSON Schema validation of events and metadata.
+
+Compares calling ``jsonschema.validate`` on every instance with the cached
+validators of the registry, for each of the available backends:
+
+.. code-block:: console
+
+    $ python examples/benchmark_validation.py examples/*-events.json
+
+Results on the two example events (178 payloads in total), on one Xeon
+core, Python 3.11, jsonschema 4.26 and fastjsonschema 2.22, in microseconds
+per instance. Each run takes the best of 5 or 10 repetitions, and the
+median and range of six runs are shown, since the times vary a lot between
+runs on this machine:
+
+.. code-block:: text
+
+    schema / backend                   median              range
+    event
+      jsonschema.validate (current)   25831.1   21855.1 - 39114.2
+      jsonschema                      23228.8   20435.0 - 29451.3
+      fastjsonschema                   1326.5    1274.7 -  2377.2
+    group-metadata
+      jsonschema.validate (current)    2616.5    2380.7 -  3088.3
+      jsonschema                         35.2      33.3 -    56.0
+      fastjsonschema                      2.4       1.6 -     3.4
+    group-relationship-metadata-item
+      jsonschema.validate (current)    7465.1    6254.3 -  8837.3
+      jsonschema                         72.9      46.1 -    75.8
+      fastjsonschema                      6.4       3.6 -     7.1
+
+The cached ``jsonschema`` validators are about 75x (metadata) and 100x (a
+history entry appended to 50 entries) faster than the current path. For
+events, the time goes into resolving the Scholix ``$ref`` on every payload.
+There, the cached ``jsonschema`` validator is about as fast as the current
+path: it is 10% faster on the median, but it was slower in two of the six
+runs. The ``fastjsonschema`` backend validates events about 20x faster.
+"""
+
+import argparse
+import json
+import timeit
+import warnings
+
+import jsonschema
+
+from asclepias_broker.jsonschemas import EVENT_SCHEMA, GROUP_METADATA_SCHEMA, \
+    GROUP_RELATIONSHIP_METADATA_SCHEMA, OVERRIDABLE_KEYS, SCHEMAS_STORE
+from asclepias_broker.jsonschemas.validators import BACKENDS, \
+    validator_registry
+
+
+def _metadata_instances(events):
+    objects, histories = [], []
+    for event in events:
+        for payload in event['Payload']:
+            for key in ('Source', 'Target'):
+                objects.append({k: v for k, v in payload[key].items()
+                                if k in OVERRIDABLE_KEYS})
+            histories.append({k: payload[k] for k in
+                              ('LinkPublicationDate', 'LinkProvider')})
+    return objects, histories
+
+
+def _timeit(func, instances, number):
+    def run():
+        for instance in instances:
+            func(instance)
+    return min(timeit.repeat(run, number=1, repeat=number)) / len(instances)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('events', nargs='+',
+                        help='JSON files with an event or a list of events.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--history-length', type=int, default=50,
+                        help='Length of the relationship history to append '
+                             'an entry to.')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore', DeprecationWarning)
+
+    events = []
+    for filename in args.events:
+        with open(filename) as fp:
+            data = json.load(fp)
+        events.extend(data if isinstance(data, list) else [data])
+    objects, histories = _metadata_instances(events)
+    history = histories[:1] * args.history_length
+
+    cases = [
+        # The event schema references the Scholix schema by URL, which
+        # ``jsonschema.validate`` would fetch over the network on each call
+        ('event', events, lambda i: jsonschema.validate(
+            i, EVENT_SCHEMA, resolver=jsonschema.RefResolver.from_schema(
+                EVENT_SCHEMA, store=SCHEMAS_STORE))),
+        ('group-metadata', objects,
+         lambda i: jsonschema.validate(i, GROUP_METADATA_SCHEMA)),
+        ('group-relationship-metadata-item', histories,
+         lambda i: jsonschema.validate(
+             history + [i], GROUP_RELATIONSHIP_METADATA_SCHEMA)),
+    ]
+    print('{:<34}{:>16}'.format('schema / backend', 'usec/instance'))
+    for name, instances, current in cases:
+        print(name)
+        results = [('jsonschema.validate (current)', current)]
+        for backend in BACKENDS:
+            try:
+                validator = validator_registry.get(name, backend)
+                results.append((backend, validator))
+            except ImportError:
+                print('  {:<32}{:>16}'.format(backend, 'not installed'))
+        for label, func in results:
+            usec = _timeit(func, instances, args.repeat) * 1e6
+            print('  {:<32}{:>16.1f}'.format(label, usec))
+
+
+if __name__ == '__main__':
+    main()
@@ -36,6 +36,9 @@ extras_require = {
     'docs': [
         'Sphinx>=1.5.1',
     ],
+    'fastjsonschema': [
+        'fastjsonschema>=2.13',
+    ],
     'tests': tests_require,
 }
 
@@ -55,6 +58,7 @@ install_requires = [
     'invenio[{extras}]==3.0.0rc1'.format(extras=INVENIO_EXTRAS),
     'jsonschema>=2.6.0',  # TODO: Investigate `invenio-jsonschemas` usage
     'marshmallow>=2.15.0',
+    'redis>=2.10.0',
     'webargs>=2.1.0',
 ]
 
@@ -85,6 +89,15 @@ setup(
         'console_scripts': [
             'asclepias-broker = invenio_app.cli:cli',
         ],
+        'flask.commands': [
+            'asclepias = asclepias_broker.cli:asclepias',
+        ],
+        'invenio_base.apps': [
+            'asclepias_broker = asclepias_broker.ext:AsclepiasBroker',
+        ],
+        'invenio_base.api_apps': [
+            'asclepias_broker = asclepias_broker.ext:AsclepiasBroker',
+        ],
         'invenio_config.module': [
             'asclepias_broker = asclepias_broker.config',
         ],
@@ -98,6 +111,8 @@ setup(
             'asclepias_broker.admin:relationship_adminview',
             'asclepias_broker_event = '
             'asclepias_broker.admin:event_adminview',
+            'asclepias_broker_event_hash = '
+            'asclepias_broker.admin:event_hash_adminview',
         ],
         'invenio_base.blueprints': [
             'asclepias_broker = asclepias_broker.views:blueprint',
@@ -113,6 +128,7 @@ setup(
         ],
         'invenio_search.mappings': [
             'relationships = asclepias_broker.mappings',
+            'groups = asclepias_broker.mappings',
         ],
 
     },
@@ -7,12 +7,24 @@
 
 """Test ElasticSearch indexing."""
 
-from helpers import generate_payload
-from invenio_search import current_search
+import os
+import uuid
+
+import sqlalchemy as sa
+from helpers import create_objects_from_relations, generate_payload
+from invenio_search import current_search, current_search_client
 from invenio_search.api import RecordsSearch
 
 from asclepias_broker.api import EventAPI
-from asclepias_broker.models import GroupRelationship, GroupType
+from asclepias_broker.api.consistency import check_index
+from asclepias_broker.api.ingestion import get_group_from_id
+from asclepias_broker.api.reindex import reindex_relationships, swap_alias
+from asclepias_broker.indexer import DocumentsContext, \
+    build_incoming_identity_documents, build_version_documents, bulk_delete, \
+    bulk_index
+from asclepias_broker.models import Event, EventStatus, GroupRelationship, \
+    GroupType, IndexObjectType, IndexOutbox, Relation
+from asclepias_broker.tasks import index_dirty_groups
 
 
 def _group_data(id_):
@@ -78,10 +90,11 @@ def assert_es_equals_db():
     es_q = list(RecordsSearch(index='relationships').query().scan())
     db_q = GroupRelationship.query.all()
 
-    # normalize and compare two sets
+    # normalize and compare, documents are keyed by the relationship ID
     es_norm_q = list(map(normalize_es_result, es_q))
     db_norm_q = list(map(normalize_db_result, db_q))
-    assert set(es_norm_q) == set(db_norm_q)
+    assert sorted(es_norm_q) == sorted(db_norm_q)
+    assert all(hit.meta.id == hit.ID for hit in es_q)
 
 
 def run_events_and_compare(events):
@@ -107,3 +120,295 @@ def test_simple_groups(db, es_clear):
          _scholix_data('X', 'Y')),
     ]
     run_events_and_compare(events)
+
+
+def test_bulk_index(es_clear):
+    """Test indexing documents in bulk requests."""
+    docs = [
+        {'ID': str(i), 'Grouping': 'identity', 'RelationshipType': 'Cites',
+         'History': [_rel_data()], 'Source': _group_data('A'),
+         'Target': _group_data('X')}
+        for i in range(5)
+    ]
+    # Client errors are reported without retrying the document
+    docs[3]['History'] = [{'LinkPublicationDate': 'not a date'}]
+    errors = bulk_index(current_search_client, docs, chunk_size=2,
+                        threads=2, retry_backoff=0)
+    assert [(e['ID'], e['status']) for e in errors] == [('3', 400)]
+
+    current_search.flush_and_refresh('relationships')
+    es_ids = {hit.meta.id for hit in
+              RecordsSearch(index='relationships').scan()}
+    assert es_ids == {'0', '1', '2', '4'}
+
+    # Documents are replaced in place and deleted by ID
+    assert bulk_index(current_search_client, docs[:2]) == []
+    assert bulk_delete(current_search_client, ['1', '3']) == []
+    current_search.flush_and_refresh('relationships')
+    es_ids = {hit.meta.id for hit in
+              RecordsSearch(index='relationships').scan()}
+    assert es_ids == {'0', '2', '4'}
+
+
+def test_deferred_indexing(app, db, es_clear):
+    """Test updating the index from the indexing outbox."""
+    app.config['ASCLEPIAS_INDEXER_DEFERRED'] = True
+    try:
+        for evtsrc in [
+            (['C', 'A', 'Cites', 'X', '2018-01-01'], _scholix_data('A', 'X')),
+            (['C', 'B', 'Cites', 'X', '2018-01-01'], _scholix_data('B', 'X')),
+            (['C', 'A', 'IsIdenticalTo', 'B', '2018-01-01'],
+             _scholix_data('A', 'B')),
+        ]:
+            EventAPI.handle_event(generate_payload(evtsrc))
+    finally:
+        app.config['ASCLEPIAS_INDEXER_DEFERRED'] = False
+    current_search.flush_and_refresh('relationships')
+    assert RecordsSearch(index='relationships').count() == 0
+    assert IndexOutbox.query.filter_by(
+        object_type=IndexObjectType.GroupRelationship).count() > 0
+
+    # Groups touched by several events are reindexed once
+    entries = IndexOutbox.query.count()
+    report = index_dirty_groups()
+    assert report['entries'] == entries
+    assert report['groups'] < report['entries']
+    assert IndexOutbox.query.count() == 0
+    assert_es_equals_db()
+
+
+def test_deferred_indexing_errors(app, db, es_clear, mocker):
+    """Test retrying the outbox entries of documents that failed."""
+    app.config['ASCLEPIAS_INDEXER_DEFERRED'] = True
+    try:
+        EventAPI.handle_event(generate_payload(
+            (['C', 'A', 'Cites', 'X', '2018-01-01'], _scholix_data('A', 'X'))))
+    finally:
+        app.config['ASCLEPIAS_INDEXER_DEFERRED'] = False
+    entries = IndexOutbox.query.count()
+    event_ids = {e.event_id for e in IndexOutbox.query}
+
+    def _index_failing(docs, index='relationships'):
+        return [{'ID': d['ID'], 'status': 400, 'error': 'Failed'}
+                for d in docs]
+    mocker.patch('asclepias_broker.api.outbox.index_documents',
+                 _index_failing)
+    report = index_dirty_groups()
+    assert report['retried'] == report['entries'] == entries
+    assert {e.event_id for e in IndexOutbox.query} == event_ids
+    assert Event.query.filter(
+        Event.id.in_(event_ids),
+        Event.status == EventStatus.Indexed).count() == 0
+
+    mocker.stopall()
+    report = index_dirty_groups()
+    assert report['retried'] == 0
+    assert IndexOutbox.query.count() == 0
+    assert Event.query.filter(
+        Event.id.in_(event_ids),
+        Event.status == EventStatus.Indexed).count() == len(event_ids)
+    assert_es_equals_db()
+
+
+def test_documents_context(db):
+    """Test building the docs of a group in a constant number of queries."""
+    def _build_hub_docs(hub, citations):
+        create_objects_from_relations([
+            ('{}-{}'.format(hub, i), Relation.Cites, hub)
+            for i in range(citations)])
+        ig = get_group_from_id(hub)
+        vg = get_group_from_id(hub, group_type=GroupType.Version)
+        db.session.expire_all()
+
+        statements = []
+
+        def _count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sa.event.listen(db.engine, 'before_cursor_execute', _count)
+        try:
+            ctx = DocumentsContext()
+            docs = build_incoming_identity_documents(ig.id, ctx=ctx) + \
+                build_version_documents(vg.id, ctx=ctx)
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', _count)
+        assert len(docs) == 2 * citations
+        # Metadata is built once per group
+        assert len({id(d['Target']) for d in docs}) == 2
+        return len(statements)
+
+    assert _build_hub_docs('X', 2) == _build_hub_docs('Y', 20)
+
+
+def test_documents_order(db, es_clear):
+    """Test building the identifiers of a group in a fixed order."""
+    for evtsrc in [
+        (['C', 'Z', 'IsIdenticalTo', 'M', '2018-01-01'],
+         _scholix_data('Z', 'M')),
+        (['C', 'M', 'IsIdenticalTo', 'A', '2018-01-01'],
+         _scholix_data('M', 'A')),
+    ]:
+        EventAPI.handle_event(generate_payload(evtsrc))
+    group = get_group_from_id('Z')
+    doc = DocumentsContext().group_metadata(group.id, GroupType.Identity)
+    assert [i['ID'] for i in doc['Identifier']] == ['A', 'M', 'Z']
+
+
+def test_reindex(app, db, es_clear):
+    """Test rebuilding the index into a new index behind the alias."""
+    for evtsrc in [
+        (['C', 'A', 'Cites', 'X', '2018-01-01'], _scholix_data('A', 'X')),
+        (['C', 'B', 'Cites', 'X', '2018-01-01'], _scholix_data('B', 'X')),
+        (['C', 'A', 'IsIdenticalTo', 'B', '2018-01-01'],
+         _scholix_data('A', 'B')),
+    ]:
+        EventAPI.handle_event(generate_payload(evtsrc))
+    old_indices = set(current_search_client.indices.get_alias(
+        name='relationships'))
+    total = GroupRelationship.query.count()
+
+    def _progress(indexed, total):
+        progress.append((indexed, total))
+        # Changes made while loading the new index are caught up, including
+        # the deletion of the relationships of merged groups
+        app.config['ASCLEPIAS_INDEXER_DEFERRED'] = True
+        try:
+            for evtsrc in [
+                (['C', 'C', 'Cites', 'X', '2018-01-01'],
+                 _scholix_data('C', 'X')),
+                (['C', 'C', 'IsIdenticalTo', 'A', '2018-01-01'],
+                 _scholix_data('C', 'A')),
+            ]:
+                EventAPI.handle_event(generate_payload(evtsrc))
+        finally:
+            app.config['ASCLEPIAS_INDEXER_DEFERRED'] = False
+
+    progress = []
+    stats = reindex_relationships(processes=0, progress=_progress)
+    try:
+        assert progress == [(total, total)]
+        assert stats['relationships'] == total
+        assert stats['errors'] == 0
+        assert set(stats['old_indices']) == old_indices
+        assert set(current_search_client.indices.get_alias(
+            name='relationships')) == {stats['index']}
+        assert IndexOutbox.query.count() == 0
+        assert_es_equals_db()
+    finally:
+        swap_alias('relationships', old_indices.pop())
+        current_search_client.indices.delete(index=stats['index'])
+
+
+def _count_chunk(args):
+    ids, index = args
+    return len(ids), 0
+
+
+def test_reindex_processes(db, es_clear, mocker):
+    """Test reading the chunks of a reindexing sent to worker processes."""
+    for evtsrc in [
+        (['C', 'A', 'Cites', 'X', '2018-01-01'], _scholix_data('A', 'X')),
+        (['C', 'B', 'Cites', 'X', '2018-01-01'], _scholix_data('B', 'X')),
+    ]:
+        EventAPI.handle_event(generate_payload(evtsrc))
+    old_indices = set(current_search_client.indices.get_alias(
+        name='relationships'))
+    total = GroupRelationship.query.count()
+
+    # The data of the test is not committed, so it cannot be read by the
+    # worker processes, which only count the IDs of their chunks
+    mocker.patch('asclepias_broker.api.reindex._index_chunk', _count_chunk)
+    progress = []
+    stats = reindex_relationships(
+        processes=2, chunk_size=1,
+        progress=lambda indexed, total: progress.append((indexed, total)))
+    try:
+        assert [indexed for indexed, _ in progress] == \
+            list(range(1, total + 1))
+        assert stats['relationships'] == total
+    finally:
+        swap_alias('relationships', old_indices.pop())
+        current_search_client.indices.delete(index=stats['index'])
+
+
+def test_check_index(db, es_clear, tmpdir):
+    """Test detecting and repairing the differences between ES and the DB."""
+    for evtsrc in [
+        (['C', 'A', 'Cites', 'X', '2018-01-01'], _scholix_data('A', 'X')),
+        (['C', 'B', 'Cites', 'X', '2018-01-01'], _scholix_data('B', 'X')),
+        (['C', 'A', 'IsIdenticalTo', 'B', '2018-01-01'],
+         _scholix_data('A', 'B')),
+    ]:
+        EventAPI.handle_event(generate_payload(evtsrc))
+    current_search.flush_and_refresh('relationships')
+    assert check_index()['mismatched_groups'] == 0
+
+    docs = [hit.to_dict() for hit in
+            RecordsSearch(index='relationships').scan()]
+    missing, outdated, stale, orphan = (dict(d) for d in docs[:4])
+    outdated['RelationshipType'] = 'IsCitedBy'
+    stale['ID'] = str(uuid.uuid4())
+    orphan['ID'] = str(uuid.uuid4())
+    orphan['Source'] = dict(orphan['Source'], ID=str(uuid.uuid4()))
+    assert bulk_delete(current_search_client, [missing['ID']]) == []
+    assert bulk_index(current_search_client, [outdated, stale, orphan]) == []
+    current_search.flush_and_refresh('relationships')
+
+    checkpoint = str(tmpdir.join('checkpoint.json'))
+    stats = check_index(chunk_size=1, checkpoint=checkpoint, repair=False)
+    assert stats['indexed'] == 2
+    assert stats['deleted'] == 1
+    assert stats['orphans'] == 2
+    assert not os.path.exists(checkpoint)
+
+    stats = check_index(chunk_size=1)
+    assert stats['mismatched_groups'] > 0
+    assert stats['errors'] == 0
+    assert_es_equals_db()
+    assert check_index()['mismatched_groups'] == 0
+
+
+def test_check_index_identifiers_order(db, es_clear):
+    """Test comparing the identifiers of indexed docs in any order."""
+    for evtsrc in [
+        (['C', 'Z', 'IsIdenticalTo', 'M', '2018-01-01'],
+         _scholix_data('Z', 'M')),
+        (['C', 'M', 'IsIdenticalTo', 'A', '2018-01-01'],
+         _scholix_data('M', 'A')),
+        (['C', 'B', 'Cites', 'M', '2018-01-01'], _scholix_data('B', 'M')),
+    ]:
+        EventAPI.handle_event(generate_payload(evtsrc))
+    current_search.flush_and_refresh('relationships')
+    docs = [hit.to_dict() for hit in
+            RecordsSearch(index='relationships').scan()]
+    for doc in docs:
+        for key in ('Source', 'Target'):
+            doc[key]['Identifier'].reverse()
+    assert bulk_index(current_search_client, docs) == []
+    current_search.flush_and_refresh('relationships')
+
+    assert check_index(repair=False)['mismatched_groups'] == 0
+
+
+def test_metadata_updates(app, db, es_clear):
+    """Test patching the metadata of groups in place."""
+    EventAPI.handle_event(generate_payload(
+        (['C', 'A', 'Cites', 'X', '2018-01-01'], _scholix_data('A', 'X'))))
+    data = _scholix_data('B', 'X')
+    data['Target']['Title'] = 'New title for X'
+    app.config['ASCLEPIAS_INDEXER_DEFERRED'] = True
+    try:
+        EventAPI.handle_event(generate_payload(
+            (['C', 'B', 'Cites', 'X', '2018-01-01'], data)))
+    finally:
+        app.config['ASCLEPIAS_INDEXER_DEFERRED'] = False
+
+    # Only the new relationship is built, the metadata of X is patched
+    report = index_dirty_groups()
+    assert report['groups'] == 0
+    assert report['relationships'] == 2
+    assert report['metadata'] == 2
+    assert report['errors'] == 0
+    assert_es_equals_db()
+    targets = {hit.Target.Title for hit in
+               RecordsSearch(index='relationships').scan()}
+    assert targets == {'New title for X'}
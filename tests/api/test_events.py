@@ -6,12 +6,22 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 
 """Test event ingestion endpoints."""
+import gzip
 import json
+import uuid
 from copy import deepcopy
+from datetime import timedelta
 
 from flask import url_for
+from helpers import generate_payload
+from invenio_db import db as _db
 
+from asclepias_broker.api import EventAPI
+from asclepias_broker.api.deduplication import get_deduplication_stats
+from asclepias_broker.api.metrics import STAGES
 from asclepias_broker.jsonschemas import EVENT_SCHEMA
+from asclepias_broker.models import Event, EventStatus, Relationship
+from asclepias_broker.tasks import process_events, process_events_queue
 
 
 def test_example_events(client, example_events, db, es):
@@ -114,3 +124,186 @@ def test_invalid_payload(client, db, es):
                        content_type='application/json')
     assert resp.status_code == 422
     assert "Invalid time format" in resp.json['message']
+
+
+def test_bulk_events(client, example_events, db, es):
+    """Test bulk ingestion of newline-delimited events."""
+    event_url = url_for('asclepias_api.event_bulk', _external=True)
+    lines = [json.dumps(e) for e in example_events]
+    lines.insert(1, '{"invalid": "true"}')
+    lines.insert(2, 'not a JSON document')
+    lines.append(json.dumps(example_events[0]))
+    data = '\n'.join(lines).encode('utf-8')
+
+    resp = client.post(event_url, data=data,
+                       content_type='application/x-ndjson')
+    assert resp.status_code == 202
+    assert resp.json['accepted'] == len(example_events)
+    assert resp.json['rejected'] == 3
+    statuses = [(r['line'], r['status']) for r in resp.json['results']]
+    assert statuses[:3] == [
+        (1, 'accepted'), (2, 'rejected'), (3, 'rejected')]
+    # The repeated event ID in the same batch is rejected
+    assert statuses[-1] == (len(lines), 'rejected')
+
+    resp = client.post(event_url, data=gzip.compress(data),
+                       content_type='application/x-ndjson',
+                       headers={'Content-Encoding': 'gzip'})
+    assert resp.status_code == 202
+    # Events sent again are reported as duplicates and are left untouched
+    assert resp.json['accepted'] == 0
+    assert resp.json['duplicate'] == len(example_events)
+    assert resp.json['rejected'] == 3
+    assert {e.status for e in Event.query} == {EventStatus.Indexed}
+
+    # The events before an invalid part of a gzip stream are still accepted
+    event = generate_payload(['C', 'Q', 'Cites', 'Z', '2018-01-01'])
+    data = gzip.compress((json.dumps(event) + '\n').encode('utf-8'))
+    resp = client.post(event_url, data=data + b'not gzip',
+                       content_type='application/x-ndjson',
+                       headers={'Content-Encoding': 'gzip'})
+    assert resp.status_code == 400
+    assert resp.json['error'].startswith('Invalid gzip stream')
+    assert resp.json['accepted'] == 1
+
+
+def test_process_events_batch(example_events, db, es_clear):
+    """Test processing a batch of events in a single transaction."""
+    event_uuids = []
+    for data in example_events:
+        event_uuids.append(str(EventAPI.create_event(data).id))
+    _db.session.commit()
+    missing_uuid = '00000000-0000-0000-0000-000000000000'
+
+    report = process_events(event_uuids + [missing_uuid])
+    assert report['succeeded'] == event_uuids
+    assert list(report['failed']) == [missing_uuid]
+    assert Relationship.query.count() > 0
+
+
+def test_process_events_queue(app, example_events, db, es_clear, mocker):
+    """Test acknowledging or rejecting the messages of queued events."""
+    event_uuid = str(EventAPI.create_event(example_events[1]).id)
+    _db.session.commit()
+    missing_uuid = '00000000-0000-0000-0000-000000000000'
+    messages = [mocker.Mock(payload={'id': i})
+                for i in (event_uuid, missing_uuid)]
+    mocker.patch('asclepias_broker.tasks._events_queue_connection')
+    mocker.patch('asclepias_broker.tasks.Consumer')
+    fetch = mocker.patch('asclepias_broker.tasks._fetch_events_batch',
+                         side_effect=[messages, []])
+
+    # The queue is only drained in batch mode
+    assert process_events_queue()['succeeded'] == []
+    assert not fetch.called
+
+    app.config['ASCLEPIAS_EVENTS_BATCH_MODE'] = True
+    try:
+        report = process_events_queue()
+    finally:
+        app.config['ASCLEPIAS_EVENTS_BATCH_MODE'] = False
+    assert report['succeeded'] == [event_uuid]
+    assert list(report['failed']) == [missing_uuid]
+    messages[0].ack.assert_called_once_with()
+    assert not messages[0].reject.called
+    messages[1].reject.assert_called_once_with()
+    assert not messages[1].ack.called
+
+
+def test_duplicate_events(app, example_events, db, es_clear):
+    """Test skipping events with already accepted content."""
+    def _resend(event):
+        event = dict(event, ID=str(uuid.uuid4()))
+        EventAPI.handle_event(event)
+        return event
+
+    event = example_events[1]
+    EventAPI.handle_event(event)
+    _resend(event)
+    assert Event.query.count() == 1
+    assert get_deduplication_stats() == {'hashes': 1, 'duplicates': 1}
+
+    # Events processed twice are skipped by the worker as well
+    event_obj = EventAPI.create_event(dict(event, ID=str(uuid.uuid4())))
+    _db.session.commit()
+    report = process_events([str(event_obj.id)])
+    assert report['skipped'] == [str(event_obj.id)]
+    assert Event.get(event_obj.id).status == EventStatus.Duplicate
+    assert get_deduplication_stats() == {'hashes': 1, 'duplicates': 2}
+
+    # Outside of the time window, the content is accepted again
+    window = app.config['ASCLEPIAS_EVENTS_DEDUP_WINDOW']
+    app.config['ASCLEPIAS_EVENTS_DEDUP_WINDOW'] = timedelta(0)
+    try:
+        _resend(event)
+    finally:
+        app.config['ASCLEPIAS_EVENTS_DEDUP_WINDOW'] = window
+    assert Event.query.count() == 3
+
+
+def test_duplicate_events_released(client, db, es_clear):
+    """Test accepting again the content of an undone event."""
+    event_url = url_for('asclepias_api.event', _external=True)
+    created = ['C', 'A', 'Cites', 'X', '2018-01-01']
+    deleted = ['D', 'A', 'Cites', 'X', '2018-01-01']
+    assert EventAPI.handle_event(generate_payload(created))
+    assert not EventAPI.handle_event(generate_payload(created))
+    # Deleting the relationship releases the content of its creation
+    assert EventAPI.handle_event(generate_payload(deleted))
+    assert EventAPI.handle_event(generate_payload(created))
+    assert Event.query.count() == 3
+
+    # Duplicates are reported to the clients
+    resp = client.post(event_url, data=json.dumps(generate_payload(created)),
+                       content_type='application/json')
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True) == 'Duplicate'
+
+
+def test_resent_event_id(client, example_events, db, es_clear):
+    """Test sending again an event that was already indexed."""
+    event_url = url_for('asclepias_api.event', _external=True)
+    data = json.dumps(example_events[1])
+    resp = client.post(event_url, data=data, content_type='application/json')
+    assert resp.status_code == 202
+    event_obj = Event.get(example_events[1]['ID'])
+    received, timings = event_obj.received, event_obj.timings
+
+    resp = client.post(event_url, data=data, content_type='application/json')
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True) == 'Duplicate'
+    _db.session.expire_all()
+    event_obj = Event.get(example_events[1]['ID'])
+    assert event_obj.status == EventStatus.Indexed
+    assert event_obj.received == received
+    assert event_obj.timings == timings
+
+
+def test_event_status_and_metrics(client, example_events, db, es_clear):
+    """Test the ingestion timings of events and the metrics endpoint."""
+    data = example_events[1]
+    resp = client.post(url_for('asclepias_api.event', _external=True),
+                       data=json.dumps(data),
+                       content_type='application/json')
+    assert resp.status_code == 202
+
+    resp = client.get(url_for('asclepias_api.event_status',
+                              event_id=data['ID'], _external=True))
+    assert resp.status_code == 200
+    assert resp.json['status'] == 'Indexed'
+    assert set(resp.json['timings']) == set(STAGES)
+    assert resp.json['timings']['total'] >= resp.json['timings']['index']
+
+    resp = client.get(url_for('asclepias_api.event_status',
+                              event_id=uuid.uuid4(), _external=True))
+    assert resp.status_code == 404
+
+    resp = client.get(url_for('asclepias_api.metrics', _external=True))
+    assert resp.status_code == 200
+    assert resp.json['events']['indexed'] == 1
+    assert resp.json['outbox']['pending'] == 0
+    total = resp.json['latency']['total']
+    assert total['count'] == 1
+    assert total['buckets']['+Inf'] == 1
+    assert 'misses' in resp.json['groups_cache']
+    assert resp.json['deduplication']['hashes'] == 1
@@ -12,6 +12,7 @@ from helpers import generate_payload
 from invenio_search import current_search
 
 from asclepias_broker.api import EventAPI
+from asclepias_broker.search_cache import current_search_cache
 
 
 def test_invalid_search_parameters(client):
@@ -99,3 +100,75 @@ def test_simple_citations(client, db, es_clear):
         resp = client.get(search_url, query_string=params)
         assert resp.status_code == 200
         assert resp.json['hits']['total'] == 0
+
+
+def test_search_cache(client, db, es_clear):
+    search_url = url_for('invenio_records_rest.relid_list')
+    params = {'id': 'X', 'scheme': 'doi', 'relation': 'isCitedBy'}
+
+    _process_events([
+        ['C', 'A', 'Cites', 'X', '2018-01-01']
+    ])
+    stats = current_search_cache.get_stats()
+    for _ in range(2):
+        resp = client.get(search_url, query_string=params)
+        assert resp.status_code == 200
+        assert _normalize_results(resp.json) == {
+            (frozenset('A'), 'Cites', frozenset('X'))}
+    new_stats = current_search_cache.get_stats()
+    assert new_stats['misses'] == stats['misses'] + 1
+    assert new_stats['hits'] == stats['hits'] + 1
+
+    # Different arguments are cached separately
+    resp = client.get(search_url, query_string=dict(params, size=1))
+    assert resp.json['hits']['total'] == 1
+    assert current_search_cache.get_stats()['misses'] == \
+        new_stats['misses'] + 1
+
+    # Indexing the docs of the target invalidates its results
+    _process_events([
+        ['C', 'B', 'Cites', 'X', '2018-01-01']
+    ])
+    resp = client.get(search_url, query_string=params)
+    assert _normalize_results(resp.json) == {
+        (frozenset('A'), 'Cites', frozenset('X')),
+        (frozenset('B'), 'Cites', frozenset('X')),
+    }
+
+    # Searches of unknown identifiers are not cached
+    stats = current_search_cache.get_stats()
+    resp = client.get(search_url, query_string=dict(params, id='Y'))
+    assert resp.json['hits']['total'] == 0
+    assert current_search_cache.get_stats()['uncached'] == \
+        stats['uncached'] + 1
+
+
+def test_cursor_pagination(client, db, es_clear):
+    search_url = url_for('invenio_records_rest.relid_list')
+    params = {'id': 'X', 'scheme': 'doi', 'relation': 'isCitedBy'}
+
+    _process_events([
+        ['C', 'A', 'Cites', 'X', '2018-01-01'],
+        ['C', 'B', 'Cites', 'X', '2018-01-01'],
+        ['C', 'C', 'Cites', 'X', '2018-01-01'],
+    ])
+    resp = client.get(
+        search_url, query_string=dict(params, size=1, cursor=''))
+    results = set()
+    while resp.json['hits']['hits']:
+        assert resp.status_code == 200
+        assert resp.json['hits']['total'] == 3
+        assert 'prev' not in resp.json['links']
+        results |= _normalize_results(resp.json)
+        resp = client.get(resp.json['links']['next'])
+    assert 'next' not in resp.json['links']
+    assert results == {
+        (frozenset('A'), 'Cites', frozenset('X')),
+        (frozenset('B'), 'Cites', frozenset('X')),
+        (frozenset('C'), 'Cites', frozenset('X')),
+    }
+
+    resp = client.get(
+        search_url, query_string=dict(params, cursor='not-a-cursor'))
+    assert resp.status_code == 400
+    assert resp.json['errors'][0]['field'] == 'cursor'
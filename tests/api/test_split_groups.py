@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Test indexing the metadata of the groups in a separate index."""
+
+import pytest
+from helpers import generate_payload
+from invenio_search import current_search
+from invenio_search.api import RecordsSearch
+
+from asclepias_broker.api import EventAPI
+from asclepias_broker.indexer import build_documents, join_group_metadata
+
+
+@pytest.fixture(scope='module')
+def app_config(app_config):
+    """Application configuration, with the split indexing mode."""
+    app_config['ASCLEPIAS_INDEXER_SPLIT_GROUPS'] = True
+    return app_config
+
+
+def _group_data(id_):
+    return {
+        'Title': 'Title for {}'.format(id_),
+        'Creator': [{'Name': 'Creator for {}'.format(id_)}],
+        'Type': {'Name': 'literature'},
+        'PublicationDate': '2018-01-01',
+    }
+
+
+def _scholix_data(src_id, trg_id):
+    return {
+        'Source': _group_data(src_id),
+        'Target': _group_data(trg_id),
+        'LinkProvider': {'Name': 'Test provider'},
+        'LinkPublicationDate': '2018-01-01',
+    }
+
+
+def test_groups_mapping(app):
+    """Test registering the groups index in the split indexing mode."""
+    assert 'groups' in app.config['SEARCH_MAPPINGS']
+    assert 'groups' in current_search.active_aliases
+
+
+def test_split_groups(db, es_clear):
+    """Test indexing the metadata of the groups in a separate index."""
+    for event in [
+        (['C', 'A', 'Cites', 'X', '2018-01-01'], _scholix_data('A', 'X')),
+        (['C', 'B', 'Cites', 'X', '2018-01-01'], _scholix_data('B', 'X')),
+        (['C', 'A', 'IsIdenticalTo', 'B', '2018-01-01'],
+         _scholix_data('A', 'B')),
+    ]:
+        EventAPI.handle_event(generate_payload(event))
+    current_search.flush_and_refresh('relationships')
+    current_search.flush_and_refresh('groups')
+
+    hits = [hit.to_dict() for hit in
+            RecordsSearch(index='relationships').scan()]
+    assert hits
+    assert all('Title' not in hit[key] and 'Identifier' in hit[key]
+               for hit in hits for key in ('Source', 'Target'))
+    expected = build_documents([hit['ID'] for hit in hits])
+    assert sorted(join_group_metadata(hits), key=lambda d: d['ID']) == \
+        sorted(expected, key=lambda d: d['ID'])
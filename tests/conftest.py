@@ -10,10 +10,13 @@ import json
 import os
 
 import pytest
+import sqlalchemy as sa
 from invenio_app.factory import create_api
 # TODO: fix this in ```pytest-invenio``
 from pytest_invenio.fixtures import celery_config
 
+from asclepias_broker.api.ingestion import write_pending_groups
+
 
 @pytest.fixture(scope='module')
 def create_app():
@@ -21,6 +24,34 @@ def create_app():
     return create_api
 
 
+@pytest.fixture(scope='module')
+def app_config(app_config):
+    """Application configuration."""
+    app_config['ASCLEPIAS_GROUPS_CACHE_REDIS_URL'] = 'memory://'
+    app_config['ASCLEPIAS_INDEXER_DEFERRED'] = False
+    app_config['ASCLEPIAS_SEARCH_CACHE_ENABLED'] = True
+    app_config['ASCLEPIAS_SEARCH_CACHE_REDIS_URL'] = 'memory://'
+    app_config['ASCLEPIAS_SEARCH_CACHE_SETTLE'] = 0
+    return app_config
+
+
+@pytest.fixture()
+def db(db):
+    """Database session, whose test savepoint stands for the transactions.
+
+    The test data is never committed, so the groups cache entries are
+    written when the test savepoint (instead of the outermost transaction)
+    is committed.
+    """
+    @sa.event.listens_for(db.session(), 'after_commit')
+    def write_groups_cache(session):
+        transaction = session.transaction
+        if transaction.nested and transaction.parent.parent is None:
+            write_pending_groups(session, transaction)
+            write_pending_groups(session, transaction.parent)
+    return db
+
+
 #
 # JSON schema and test data loading fixtures
 #
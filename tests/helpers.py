@@ -17,10 +17,10 @@ from invenio_db import db
 
 from asclepias_broker.api.ingestion import get_or_create_groups
 from asclepias_broker.jsonschemas import SCHOLIX_SCHEMA
-from asclepias_broker.models import Group, GroupM2M, GroupMetadata, \
-    GroupRelationship, GroupRelationshipM2M, GroupRelationshipMetadata, \
-    GroupType, Identifier, Identifier2Group, Relationship, \
-    Relationship2GroupRelationship
+from asclepias_broker.models import Group, GroupClosure, GroupM2M, \
+    GroupMetadata, GroupRelationship, GroupRelationshipM2M, \
+    GroupRelationshipMetadata, GroupType, Identifier, Identifier2Group, \
+    Relationship, Relationship2GroupRelationship
 
 #
 # Events generation helpers
@@ -327,6 +327,9 @@ def assert_grouping(grouping):
     # There are as many M2M groups as there are Identity groups
     assert GroupM2M.query.count() == len(id_groups)
 
+    # The groups closure matches the Identity and Version groups
+    assert_group_closure()
+
     # Make sure that all loaded relationships are unique
     id_rels = [r for r, t in zip(rel_map, relationship_types)
                if t is None]
@@ -366,6 +369,18 @@ def assert_grouping(grouping):
                     subrelationship=rel_map[group_subrel]).one()
 
 
+def assert_group_closure():
+    """Assert that the groups closure matches the groups of identifiers."""
+    closure = set(db.session.query(
+        GroupClosure.identifier_id, GroupClosure.identity_group_id,
+        GroupClosure.version_group_id))
+    groups = set(
+        db.session.query(Identifier2Group.identifier_id,
+                         Identifier2Group.group_id, GroupM2M.group_id)
+        .join(GroupM2M, GroupM2M.subgroup_id == Identifier2Group.group_id))
+    assert closure == groups
+
+
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         print('Usage: python gen.py relations_input.json')
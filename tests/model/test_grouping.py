@@ -6,16 +6,21 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 
 """Test broker model."""
-from helpers import assert_grouping, create_objects_from_relations, \
-    generate_payloads
+import uuid
+
+import sqlalchemy as sa
+from helpers import assert_group_closure, assert_grouping, \
+    create_objects_from_relations, generate_payloads
 
 from asclepias_broker.api import EventAPI
-from asclepias_broker.api.ingestion import get_group_from_id, \
-    get_or_create_groups, merge_identity_groups, merge_version_groups
-from asclepias_broker.models import Group, GroupM2M, GroupMetadata, \
-    GroupRelationship, GroupRelationshipM2M, GroupRelationshipMetadata, \
-    GroupType, Identifier, Identifier2Group, Relation, Relationship, \
-    Relationship2GroupRelationship
+from asclepias_broker.api.ingestion import backfill_group_closure, \
+    get_group_from_id, get_or_create_groups, group_size, \
+    merge_identity_groups, merge_version_groups
+from asclepias_broker.cache import current_groups_cache
+from asclepias_broker.models import Group, GroupClosure, GroupM2M, \
+    GroupMetadata, GroupRelationship, GroupRelationshipM2M, \
+    GroupRelationshipMetadata, GroupType, Identifier, Identifier2Group, \
+    Relation, Relationship, Relationship2GroupRelationship
 
 
 def _handle_events(evtsrc):
@@ -602,3 +607,130 @@ def test_merge_identity_groups(db):
     assert id_grp1 == id_grp2 == id_grp3 == id_grp4 and \
         id_grp1.json['Title'] == 'Title of D v2'
     assert_grouping(grouping)
+
+
+def test_groups_cache(db):
+    """Test the identifier groups resolution cache."""
+    current_groups_cache.clear()
+    _handle_events([
+        ['C', 'A', 'Cites', 'B', '2018-01-01'],
+        ['C', 'C', 'HasVersion', 'D', '2018-01-01'],
+    ])
+    grp_a = get_group_from_id('A')
+    ver_grp_a = get_group_from_id('A', group_type=GroupType.Version)
+    entry = current_groups_cache.get('A', 'doi')
+    assert entry[1:] == (grp_a.id, ver_grp_a.id)
+    assert current_groups_cache.shared.get('doi:A') == entry
+
+    # Both tiers are dropped for the absorbed Identity and Version groups
+    stats = current_groups_cache.get_stats()
+    merged_grp, _ = merge_identity_groups(grp_a, get_group_from_id('B'))
+    db.session.commit()
+    assert merged_grp.id == grp_a.id
+    assert current_groups_cache.get('B', 'doi') is None
+    assert current_groups_cache.shared.get('doi:B') is None
+    assert get_group_from_id('B') == merged_grp
+    # Entries are only written once the transaction commits
+    assert current_groups_cache.get('B', 'doi') is None
+    db.session.commit()
+    assert current_groups_cache.get('B', 'doi')[1] == merged_grp.id
+    assert current_groups_cache.get('A', 'doi') == entry
+    new_stats = current_groups_cache.get_stats()
+    assert new_stats['invalidations'] == stats['invalidations'] + 2
+
+    # Entries of the other identifiers are left untouched
+    ver_grp_c = get_group_from_id('C', group_type=GroupType.Version)
+    assert current_groups_cache.get('C', 'doi')[2] == ver_grp_c.id
+
+    # Stale entries (e.g. left in another process) are detected and dropped
+    current_groups_cache.local.set(
+        'doi:D', (uuid.uuid4(), uuid.uuid4(), uuid.uuid4()))
+    assert get_group_from_id('D', group_type=GroupType.Version) == ver_grp_c
+    assert current_groups_cache.get_stats()['stale'] == \
+        new_stats['stale'] + 1
+
+
+def test_merge_keeps_larger_group(db):
+    """Test that merging absorbs the smaller group into the larger one."""
+    _handle_events([
+        ['C', 'X', 'Cites', 'A', '2018-01-01'],
+        ['C', 'Y', 'Cites', 'A', '2018-01-01'],
+        ['C', 'Z', 'Cites', 'B', '2018-01-01'],
+        ['C', 'A', 'HasVersion', 'A1', '2018-01-01'],
+    ])
+    grp_a = get_group_from_id('A')
+    ver_grp_a = get_group_from_id('A', group_type=GroupType.Version)
+    grp_b = get_group_from_id('B')
+    ver_grp_b = get_group_from_id('B', group_type=GroupType.Version)
+    # An identifier and two relationships, counted up to a limit
+    assert group_size(grp_a) == 3
+    assert group_size(grp_a, limit=1) == 2
+    assert group_size(grp_a, limit=0) == 1
+    assert group_size(grp_b, limit=5) == 2
+
+    # The arguments' order does not matter, the larger group survives
+    merged_grp, merged_ver_grp = merge_identity_groups(grp_b, grp_a)
+    db.session.commit()
+    assert merged_grp.id == grp_a.id
+    assert merged_ver_grp.id == ver_grp_a.id
+    assert Group.query.get(grp_b.id) is None
+    assert Group.query.get(ver_grp_b.id) is None
+    assert get_group_from_id('B') == merged_grp
+    assert get_group_from_id('A1', group_type=GroupType.Version) == \
+        merged_ver_grp
+    assert {i.value for i in merged_grp.identifiers} == {'A', 'B'}
+    # The relationships of the absorbed group were moved
+    assert GroupRelationship.query.filter_by(
+        source=get_group_from_id('Z'), target=merged_grp).count() == 1
+    assert GroupRelationship.query.filter(sa.or_(
+        GroupRelationship.source_id.in_([grp_b.id, ver_grp_b.id]),
+        GroupRelationship.target_id.in_([grp_b.id, ver_grp_b.id]),
+    )).count() == 0
+
+
+def test_group_closure(db):
+    """Test the groups closure of identifiers."""
+    _handle_events([
+        ['C', 'A', 'IsIdenticalTo', 'B', '2018-01-01'],
+        ['C', 'C', 'HasVersion', 'A', '2018-01-01'],
+        ['C', 'D', 'Cites', 'C', '2018-01-01'],
+    ])
+    assert_group_closure()
+    a_id = Identifier.get('A', 'doi').id
+    members = GroupClosure.get_members([a_id])
+    assert [i.value for i in members[a_id]] == ['A', 'B']
+    members = GroupClosure.get_members([a_id], GroupType.Version)
+    assert [i.value for i in members[a_id]] == ['A', 'B', 'C']
+
+    # Merging moves the identifiers of the absorbed groups
+    _handle_events([
+        ['C', 'C', 'IsIdenticalTo', 'D', '2018-01-01'],
+    ])
+    assert_group_closure()
+    members = GroupClosure.get_members([a_id], GroupType.Version)
+    assert [i.value for i in members[a_id]] == ['A', 'B', 'C', 'D']
+    assert get_group_from_id('D', group_type=GroupType.Version) == \
+        get_group_from_id('A', group_type=GroupType.Version)
+
+    # Identifiers without groups are their own only member
+    orphan = Identifier(value='E', scheme='doi')
+    db.session.add(orphan)
+    db.session.commit()
+    assert GroupClosure.get_members([orphan.id]) == {orphan.id: [orphan]}
+
+    # Groups without closure rows are resolved from their identifiers, and
+    # the missing rows are created when the identifiers are ingested again
+    GroupClosure.query.delete()
+    db.session.commit()
+    current_groups_cache.clear()
+    a_groups = get_group_from_id('A'), \
+        get_group_from_id('A', group_type=GroupType.Version)
+    assert get_or_create_groups(Identifier.get('A', 'doi')) == a_groups
+    db.session.commit()
+    assert GroupClosure.query.get(a_id).identity_group == a_groups[0]
+
+    # The closure of existing groups can be filled in afterwards
+    GroupClosure.query.delete()
+    db.session.commit()
+    assert backfill_group_closure() == 4
+    assert_group_closure()
@@ -10,7 +10,10 @@ import pytest
 from helpers import generate_payloads
 
 from asclepias_broker.api import EventAPI
-from asclepias_broker.models import Identifier
+from asclepias_broker.api.ingestion import backfill_identifier_urls, \
+    get_or_create_relationships, resolve_identifiers
+from asclepias_broker.models import Identifier, Relation, Relationship
+from asclepias_broker.utils import identifier_url
 
 
 @pytest.mark.parametrize(
@@ -99,3 +102,62 @@ def test_identities(events, result_sets, db, es):
             id_ = Identifier.query.filter_by(value=v).one()
             ids = set(i.value for i in id_.get_identities())
             assert ids == rs
+
+
+def test_resolve_identifiers(db):
+    """Test fetching or creating identifiers in bulk."""
+    id_a = Identifier(value='A', scheme='doi')
+    db.session.add(id_a)
+    db.session.commit()
+
+    ids = resolve_identifiers([('A', 'doi'), ('B', 'doi'), ('A', 'url')])
+    assert ids[('A', 'doi')] == id_a.id
+    assert len(set(ids.values())) == 3
+    assert Identifier.query.count() == 3
+    # Resolving again does not create anything new
+    assert resolve_identifiers(ids.keys()) == ids
+    assert Identifier.query.count() == 3
+
+
+def test_get_or_create_relationships(db):
+    """Test fetching or creating relationships in bulk."""
+    def _rel(source, relation, target):
+        return Relationship(source=Identifier(value=source, scheme='doi'),
+                            target=Identifier(value=target, scheme='doi'),
+                            relation=relation)
+
+    rels = get_or_create_relationships([
+        _rel('A', Relation.Cites, 'B'),
+        _rel('A', Relation.Cites, 'C'),
+        _rel('A', Relation.Cites, 'B'),
+    ])
+    assert [(r.source.value, r.target.value) for r in rels] == \
+        [('A', 'B'), ('A', 'C'), ('A', 'B')]
+    assert rels[0] is rels[2]
+    assert Relationship.query.count() == 2
+    assert Identifier.query.count() == 3
+
+    rels2 = get_or_create_relationships([_rel('A', Relation.Cites, 'C')])
+    assert rels2[0].id == rels[1].id
+    assert Relationship.query.count() == 2
+
+
+def test_identifier_urls(db):
+    """Test storing the canonical URLs of identifiers."""
+    ids = resolve_identifiers([('10.1234/a', 'doi'), ('invalid', 'doi')])
+    id_a = Identifier.query.get(ids[('10.1234/a', 'doi')])
+    assert id_a.idurl == identifier_url('10.1234/a', 'doi')
+    assert id_a.url.endswith('10.1234/a')
+    id_invalid = Identifier.query.get(ids[('invalid', 'doi')])
+    assert id_invalid.idurl == ''
+    assert id_invalid.url is None
+
+    # Identifiers created without their URL are backfilled
+    id_b = Identifier(value='10.1234/b', scheme='doi')
+    db.session.add(id_b)
+    db.session.commit()
+    assert id_b.idurl is None
+    assert id_b.url == identifier_url('10.1234/b', 'doi')
+    assert backfill_identifier_urls(batch_size=1) == 1
+    assert Identifier.query.get(id_b.id).idurl == id_b.url
+    assert backfill_identifier_urls() == 0
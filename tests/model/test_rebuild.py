@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Test offline rebuilding of groups."""
+
+from helpers import assert_group_closure, generate_payloads
+
+from asclepias_broker.api import EventAPI
+from asclepias_broker.api.rebuild import UnionFind, rebuild_groups
+from asclepias_broker.models import Group, GroupRelationship, GroupType
+
+
+def _group_ids(group):
+    if group.type == GroupType.Version:
+        return frozenset(i.value for g in group.groups for i in g.identifiers)
+    return frozenset(i.value for i in group.identifiers)
+
+
+def _graph_state():
+    """Get the groups graph state, independent of the group IDs."""
+    groups = {
+        (g.type, _group_ids(g), tuple(sorted((g.data and g.data.json or {})
+                                             .items())))
+        for g in Group.query
+    }
+    relationships = {
+        (r.type, r.relation, _group_ids(r.source), _group_ids(r.target),
+         len(r.data.json) if r.data else None,
+         frozenset(_group_ids(sr.target) for sr in r.relationships))
+        for r in GroupRelationship.query
+    }
+    return groups, relationships
+
+
+def test_union_find():
+    """Test the union-find components."""
+    uf = UnionFind(6)
+    uf.union(0, 1)
+    uf.union(2, 3)
+    uf.union(1, 3)
+    assert uf.find(0) == uf.find(3)
+    assert uf.find(4) != uf.find(5)
+    assert list(uf.components()) == [0, 0, 0, 0, 1, 2]
+
+
+def test_rebuild_groups(db, es_clear):
+    """Test that rebuilding reproduces the incrementally built graph."""
+    events = generate_payloads([
+        ['C', 'A', 'Cites', 'X', '2018-01-01'],
+        ['C', 'B', 'Cites', 'X', '2018-01-02'],
+        ['C', 'C', 'Cites', 'Y', '2018-01-03'],
+        ['C', 'A', 'IsIdenticalTo', 'B', '2018-01-04'],
+        ['C', 'Y', 'HasVersion', 'Z', '2018-01-05'],
+        ['C', 'Z', 'IsIdenticalTo', 'X', '2018-01-06'],
+        ['C', 'D', 'Cites', 'C', '2018-01-07'],
+    ])
+    for ev in events:
+        EventAPI.handle_event(ev)
+    expected = _graph_state()
+
+    stats = rebuild_groups(chunk_size=2)
+    assert stats['identity_groups'] == 5
+    assert stats['version_groups'] == 4
+    assert _graph_state() == expected
+    assert_group_closure()
@@ -8,10 +8,13 @@
 """Test citation queries."""
 
 import pytest
-from helpers import generate_payloads
+import sqlalchemy as sa
+from helpers import create_objects_from_relations, generate_payloads
 
 from asclepias_broker.api import EventAPI, RelationshipAPI
-from asclepias_broker.models import Identifier
+from asclepias_broker.api.ingestion import update_groups
+from asclepias_broker.api.relationships import next_cursor
+from asclepias_broker.models import Identifier, Relation, Relationship
 
 TEST_CASES = [
     (
@@ -159,3 +162,78 @@ def test_grouping_query(test_case_name, events, results, db, es):
         # cited_id = Identifier.query.filter_by(value=cited_id_value).one()
         # TODO: Fix this test
         # ret = RelationshipAPI.get_citations2(cited_id, 'IsCitedBy')
+
+
+def test_citations2_pages(db, es):
+    """Test the keyset pagination and streaming of grouped citations."""
+    events = [['C', 'C{}'.format(i), 'Cites', 'X', '2018-01-01']
+              for i in range(5)]
+    events += [['C', 'C0', 'IsIdenticalTo', 'C0-i', '2018-01-01'],
+               ['C', 'C3', 'IsIdenticalTo', 'C3-i', '2018-01-01']]
+    for ev in generate_payloads(events):
+        EventAPI.handle_event(ev)
+    identifier = Identifier.get('X', 'doi')
+
+    def _values(citations):
+        return [(gid, [i.value for _, _, i in rows]) for gid, rows in
+                citations]
+
+    expected = [(g.id, rows) for g, rows in _values(
+        RelationshipAPI.get_citations2(identifier, 'isCitedBy'))]
+    assert len(expected) == 5
+    assert sum(len(rows) for _, rows in expected) == 7
+
+    rows, after = [], None
+    while True:
+        page = RelationshipAPI.get_citations2(
+            identifier, 'isCitedBy', after=after, size=2)
+        page_rows = [(g.id, i.value) for g, items in page
+                     for _, _, i in items]
+        assert len(page_rows) <= 2
+        rows += page_rows
+        if len(page_rows) < 2:
+            break
+        after = next_cursor(page[-1][1])
+    assert rows == [(gid, v) for gid, values in expected for v in values]
+
+    streamed = RelationshipAPI.iter_citations2(
+        identifier, 'isCitedBy', page_size=2)
+    assert _values(streamed) == expected
+
+
+def test_citations_query_count(db):
+    """Test getting citations in a number of queries independent of size."""
+    def _count_queries(hub, citations):
+        create_objects_from_relations(
+            [('{}-v'.format(hub), Relation.HasVersion, hub),
+             ('{}-v'.format(hub), Relation.HasVersion, '{}-s'.format(hub)),
+             ('{}-i'.format(hub), Relation.IsIdenticalTo, hub)] +
+            [('{}-{}'.format(hub, i), Relation.Cites, hub)
+             for i in range(citations)] +
+            [('{}-{}'.format(hub, i), Relation.IsIdenticalTo,
+              '{}-{}-i'.format(hub, i)) for i in range(citations)])
+        for rel in Relationship.query.filter_by(
+                relation=Relation.IsIdenticalTo).all():
+            update_groups(rel)
+        db.session.commit()
+        identifier = Identifier.query.filter_by(value=hub).one()
+        db.session.expire_all()
+
+        statements = []
+
+        def _count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sa.event.listen(db.engine, 'before_cursor_execute', _count)
+        try:
+            result = RelationshipAPI.get_citations(
+                identifier, with_parents=True, with_siblings=True,
+                expand_target=True)
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', _count)
+        assert len(result) == citations + 1
+        assert all(len(ids) == 2 for ids, _ in result[:-1])
+        assert {i.value for i in result[-1][0]} == {
+            hub, '{}-i'.format(hub), '{}-v'.format(hub), '{}-s'.format(hub)}
+        return len(statements)
+
+    assert _count_queries('X', 2) == _count_queries('Y', 20)
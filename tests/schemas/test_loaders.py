@@ -15,7 +15,7 @@ import pytest
 from asclepias_broker.models import Event, EventType, Identifier, Relation, \
     Relationship
 from asclepias_broker.schemas.loaders import EventSchema, IdentifierSchema, \
-    RelationshipSchema
+    RelationshipSchema, normalize_relationship
 from asclepias_broker.schemas.scholix import SCHOLIX_RELATIONS
 
 
@@ -110,6 +110,11 @@ def test_identifier_schema(in_id, out_id, out_error, db, es_clear):
         (('10.1234/A', 'doi'), Relation.Cites, ('10.1234/B', 'doi')),
         {},
     ),
+    (
+        (('10.1234/A', 'DOI'), 'IsCitedBy', ('10.1234/B', 'DOI')),
+        (('10.1234/B', 'doi'), Relation.Cites, ('10.1234/A', 'doi')),
+        {},
+    ),
     (
         (('10.1234/A', 'invalid_scheme'), 'Cites', ('10.1234/B', 'DOI')),
         None,
@@ -125,6 +130,22 @@ def test_relationship_schema(in_rel, out_rel, out_error, db, es_clear):
         compare_relationships(relationship, rel_obj(*out_rel))
 
 
+@pytest.mark.parametrize(('in_rel', 'out_rel'), [
+    (
+        (('10.1234/A', 'DOI'), 'Cites', ('10.1234/B', 'DOI')),
+        (['10.1234/A', 'doi'], 'Cites', ['10.1234/B', 'doi'], False),
+    ),
+    (
+        (('10.1234/A', 'DOI'), 'IsVersionOf', ('10.1234/B', 'DOI')),
+        (['10.1234/B', 'doi'], 'HasVersion', ['10.1234/A', 'doi'], True),
+    ),
+])
+def test_normalize_relationship(in_rel, out_rel, db, es_clear):
+    normalized = normalize_relationship(rel_dict(*in_rel))
+    assert normalized == dict(zip(
+        ('Source', 'RelationshipType', 'Target', 'Inverted'), out_rel))
+
+
 @pytest.mark.parametrize(('in_ev', 'out_ev', 'out_error'), [
     (
         ('RelationshipCreated', '1517270400', {'test': 'payload'}),
@@ -12,7 +12,7 @@ import pytest
 from asclepias_broker.api.ingestion import update_metadata
 from asclepias_broker.models import Identifier, Relation, Relationship
 from asclepias_broker.schemas.scholix import SCHOLIX_RELATIONS, \
-    RelationshipSchema
+    ObjectIdentifierSchema, PersonOrOrgSchema, RelationshipSchema
 
 
 def id_dict(identifier, scheme=None):
@@ -66,3 +66,17 @@ def off_test_relationship_schema(input_rel, output_rel, output_error):
         assert errors == output_error
     else:
         assert relationship == rel_dict(*output_rel)
+
+
+def test_identifier_urls():
+    person = {'Name': 'Foobar', 'Identifier': [
+        {'ID': '0000-0001', 'IDScheme': 'orcid',
+         'IDURL': 'https://orcid.org/0000-0001'}]}
+    data, errors = PersonOrOrgSchema().dump(person)
+    assert data['Identifier'][0]['IDURL'] == 'https://orcid.org/0000-0001'
+
+    identifier = id_obj('10.1234/a', 'doi')
+    identifier.idurl = 'https://doi.org/10.1234/a'
+    data, errors = ObjectIdentifierSchema().dump(identifier)
+    assert data == {'ID': '10.1234/a', 'IDScheme': 'doi',
+                    'IDURL': 'https://doi.org/10.1234/a'}
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Test JSON Schema validators."""
+
+import pytest
+from jsonschema.exceptions import ValidationError
+
+from asclepias_broker.jsonschemas.validators import validator_registry
+
+
+@pytest.mark.parametrize('backend', ['jsonschema', 'fastjsonschema'])
+def test_validator_registry(backend, example_events):
+    if backend == 'fastjsonschema':
+        pytest.importorskip('fastjsonschema')
+    validator = validator_registry.get('event', backend)
+    assert validator_registry.get('event', backend) is validator
+    for event in example_events:
+        validator(event)
+    with pytest.raises(ValidationError):
+        validator(dict(example_events[0], EventType='invalid'))
+
+    validate_item = validator_registry.get(
+        'group-relationship-metadata-item', backend)
+    validate_item({'LinkPublicationDate': '2018-01-01',
+                   'LinkProvider': [{'Name': 'Foobar'}]})
+    with pytest.raises(ValidationError):
+        validate_item({'LinkPublicationDate': '2018-01-01'})
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 CERN.
+#
+# Asclepias Broker is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Extension tests."""
+
+from flask import Flask
+
+from asclepias_broker import config
+from asclepias_broker.ext import AsclepiasBroker
+
+
+def _create_app(**kwargs):
+    app = Flask('testapp')
+    app.config.from_object(config)
+    app.config.update(kwargs)
+    AsclepiasBroker(app)
+    return app
+
+
+def test_events_queue_schedule():
+    """Test scheduling the events queue task in batch mode only."""
+    app = _create_app()
+    assert 'asclepias-events' not in app.config['CELERY_BEAT_SCHEDULE']
+
+    app = _create_app(ASCLEPIAS_EVENTS_BATCH_MODE=True)
+    assert app.config['CELERY_BEAT_SCHEDULE']['asclepias-events'] == \
+        config.ASCLEPIAS_EVENTS_QUEUE_SCHEDULE
+    assert 'asclepias-events' not in config.CELERY_BEAT_SCHEDULE
+
+
+def test_groups_mapping():
+    """Test registering the groups index in the split indexing mode only."""
+    app = _create_app()
+    assert app.config['SEARCH_MAPPINGS'] == ['relationships']
+
+    app = _create_app(ASCLEPIAS_INDEXER_SPLIT_GROUPS=True)
+    assert app.config['SEARCH_MAPPINGS'] == ['relationships', 'groups']
+    assert config.SEARCH_MAPPINGS == ['relationships']
+
+    app = _create_app(ASCLEPIAS_INDEXER_SPLIT_GROUPS=True,
+                      SEARCH_MAPPINGS=None)
+    assert app.config['SEARCH_MAPPINGS'] is None